@@ -3,14 +3,14 @@ import pandas as pd
 from fastapi.middleware.cors import CORSMiddleware
 from urllib.parse import unquote
 from typing import List, Optional
-import httpx
 from fastapi import FastAPI, Query
 from pydantic import BaseModel
+import os
 
 app = FastAPI()
 
 # --- CONFIGURASI OPENROUTER ---
-OPENROUTER_API_KEY = "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"
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 class ChatRequest(BaseModel):
     question: str
@@ -18,6 +18,7 @@ class ChatRequest(BaseModel):
 # Contoh: ambil dari df atau database
 def get_dashboard_data(year="2025"):
     """Ambil data aktual dari df"""
+    df = current().df
     # Filter data berdasarkan tahun
     data = df[df["Tahun"] == int(year)].copy()
     if data.empty:
@@ -74,6 +75,194 @@ def get_dashboard_data(year="2025"):
 # ====================
 app = FastAPI(debug=True)  # Tambahkan debug=True
 
+import time
+
+# Durasi tiap fase startup (detik) → dilaporkan di /api/ready
+startup_timings = {}
+_import_started = time.perf_counter()
+
+
+def timed(phases, name, fn, *args):
+    """Jalankan fn(*args) dan catat durasinya di phases[name]."""
+    started = time.perf_counter()
+    result = fn(*args)
+    phases[name] = round(time.perf_counter() - started, 3)
+    return result
+
+# ====================
+# ✅ HTTP Caching (ETag + Cache-Control) & Kompresi
+# ====================
+import hashlib
+import os
+from fastapi import Request, Response
+from starlette.middleware.gzip import GZipMiddleware
+
+from collections import OrderedDict
+import threading
+
+# Serialisasi mutasi cache ber-ukuran (event loop & thread worker) vs pembuangan registry memori
+memory_lock = threading.RLock()
+
+
+class SizedCache(OrderedDict):
+    """
+    OrderedDict (urutan LRU) yang menjaga total ukuran entrinya secara inkremental: ukuran
+    dihitung sekali saat entri disimpan, jadi registry memori cukup membaca `nbytes`.
+    """
+
+    def __init__(self, sizer):
+        super().__init__()
+        self.sizer = sizer
+        self.sizes = {}
+        self.nbytes = 0
+
+    def __setitem__(self, key, value):
+        size = self.sizer(value)  # di luar lock: bisa mahal untuk hasil turunan besar
+        with memory_lock:
+            super().__setitem__(key, value)
+            self.nbytes += size - self.sizes.get(key, 0)
+            self.sizes[key] = size
+
+    def __delitem__(self, key):
+        with memory_lock:
+            super().__delitem__(key)
+            self.nbytes -= self.sizes.pop(key, 0)
+
+    def pop(self, key, *default):
+        with memory_lock:
+            if key not in self:
+                if default:
+                    return default[0]
+                raise KeyError(key)
+            value = super().__getitem__(key)
+            del self[key]
+            return value
+
+    def popitem(self, last=True):
+        with memory_lock:
+            key, value = super().popitem(last=last)
+            self.nbytes -= self.sizes.pop(key, 0)
+            return key, value
+
+    def clear(self):
+        with memory_lock:
+            super().clear()
+            self.sizes.clear()
+            self.nbytes = 0
+
+
+HTTP_CACHE_CONTROL = os.getenv("HTTP_CACHE_CONTROL", "public, max-age=0, must-revalidate")
+# Endpoint GET yang jawabannya tidak boleh di-cache (status/progress, dll)
+NO_CACHE_PATHS = set()
+
+# Cache respons di server (ETag → body JSON), LRU; entri versi dataset lama ikut tergusur
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+response_cache = SizedCache(lambda entry: len(entry[0]))
+
+# Revisi kode ikut masuk ETag supaya perubahan format respons tidak tertutup cache lama
+with open(__file__, "rb") as _src:
+    API_REVISION = hashlib.sha1(_src.read()).hexdigest()[:8]
+
+
+def normalize_query(query_params):
+    """Query string kanonik: parameter diurutkan, nilai `years` dinormalisasi."""
+    items = []
+    for key, value in query_params.multi_items():
+        value = value.strip()
+        if key == "years":
+            value = ",".join(str(y) for y in parse_years_param(value))
+        items.append((key, value))
+    return "&".join(f"{k}={v}" for k, v in sorted(items))
+
+
+def compute_etag(request):
+    key = f"{request.url.path}?{normalize_query(request.query_params)}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return f'W/"{current().version}-{API_REVISION}-{digest}"'
+
+
+# Status respons per request; handler yang jatuh ke jalur except-nya menandai respons
+# sebagai tidak boleh di-cache (body kosong/error tetap 200 demi kompatibilitas frontend)
+import contextvars
+
+response_state = contextvars.ContextVar("response_state", default=None)
+
+
+def uncacheable():
+    state = response_state.get()
+    if state is not None:
+        state["cacheable"] = False
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Perbandingan weak: abaikan prefix W/
+    return "*" in candidates or etag.removeprefix("W/") in [c.removeprefix("W/") for c in candidates]
+
+
+@app.middleware("http")
+async def conditional_get_middleware(request: Request, call_next):
+    """
+    ETag dari versi dataset + parameter request yang dinormalisasi.
+    If-None-Match yang cocok langsung dijawab 304 tanpa menjalankan handler;
+    respons yang sudah pernah dihitung (atau di-warm-up) dilayani dari response_cache.
+    """
+    if request.method not in ("GET", "HEAD") or request.url.path in NO_CACHE_PATHS:
+        return await call_next(request)
+
+    etag = compute_etag(request)
+    headers = {"ETag": etag, "Cache-Control": HTTP_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    cached = response_cache.get(etag)
+    if cached is not None:
+        try:
+            response_cache.move_to_end(etag)
+        except KeyError:
+            pass  # baru saja dibuang registry memori dari thread lain
+        body, media_type = cached
+        return Response(content=body, media_type=media_type, headers={**headers, "X-Cache": "HIT"})
+
+    state = {"cacheable": True}
+    token = response_state.set(state)
+    try:
+        response = await call_next(request)
+    finally:
+        response_state.reset(token)
+    if response.status_code != 200:
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    media_type = response.headers.get("content-type")
+    if not state["cacheable"]:
+        return Response(content=body, media_type=media_type, headers={"Cache-Control": "no-store"})
+    response_cache[etag] = (body, media_type)
+    while len(response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+        response_cache.popitem(last=False)
+    enforce_memory_budget()
+
+    return Response(content=body, media_type=media_type, headers={**headers, "X-Cache": "MISS"})
+
+
+# Endpoint streaming (SSE, unduhan file): tidak di-gzip; potongan kecil SSE tertahan
+# di buffer kompresi dan file xlsx sudah terkompresi
+STREAMING_PATHS = set()
+
+
+class StreamingAwareGZipMiddleware(GZipMiddleware):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in STREAMING_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# Kompresi gzip untuk respons JSON besar (ETag weak, jadi tetap valid setelah dikompresi)
+app.add_middleware(StreamingAwareGZipMiddleware, minimum_size=1000)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],   # Izinkan semua domain
@@ -85,50 +274,78 @@ app.add_middleware(
 # ✅ Load & Clean Data
 # ====================
 
-csv_path = "./data/Data_SPC.csv"
-
-df = pd.read_csv(csv_path)
-
-# Normalisasi nama kolom
-df = df.rename(columns={
-    "Tanggal": "Tanggal",
-    "Kode Transaksi": "NomorSurat",
-    "Pemohon": "Pemohon",
-    "Unit Pemohon": "UnitPemohon",
-    "Kode Barang": "KodeBarang",
-    "Nama Brg": "NamaBrg",
-    "Satuan": "Satuan",
-    "Jml": "Jumlah",
-    "Harga": "HargaSatuan",
-    "Total": "TotalHarga",
-    "Tahun": "Tahun",
-    "Kategori Barang": "GrupBarang",
-    "Kategori": "Kategori"
-})
-
-# Bersihkan kolom numerik — jangan paksa jadi int dulu!
-numeric_cols = ["Jumlah", "HargaSatuan", "TotalHarga"]
-for col in numeric_cols:
-    df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
-
-# Kolom Tahun: pastikan jadi integer (hapus desimal & NaN)
-df["Tahun"] = pd.to_numeric(df["Tahun"], errors="coerce")
-df = df.dropna(subset=["Tahun"])  # hapus baris tanpa tahun
-# ✅ Konversi kolom Tanggal ke datetime (global, sekali saja)
-df["Tanggal"] = pd.to_datetime(df["Tanggal"], dayfirst=True, errors="coerce")
-
-# Validasi kolom penting
-required_cols = ["Jumlah", "TotalHarga",
-                 "UnitPemohon", "NamaBrg", "Kategori", "Tahun"]
-for col in required_cols:
-    if col not in df.columns:
-        raise ValueError(f"Kolom '{col}' tidak ditemukan di data CSV!")
-
-
-def parse_years_param(years_param: str):
+def file_version(csv_path):
+    """Versi dataset = hash isi CSV → dipakai untuk ETag & cache turunan."""
+    with open(csv_path, "rb") as _f:
+        return hashlib.sha1(_f.read()).hexdigest()[:12]
+
+
+def load_transactions(csv_path):
+    """Baca & bersihkan satu file transaksi → (DataFrame, versi dataset)."""
+    df = pd.read_csv(csv_path)
+    dataset_version = file_version(csv_path)
+
+    # Normalisasi nama kolom
+    df = df.rename(columns={
+        "Tanggal": "Tanggal",
+        "Kode Transaksi": "NomorSurat",
+        "Pemohon": "Pemohon",
+        "Unit Pemohon": "UnitPemohon",
+        "Kode Barang": "KodeBarang",
+        "Nama Brg": "NamaBrg",
+        "Satuan": "Satuan",
+        "Jml": "Jumlah",
+        "Harga": "HargaSatuan",
+        "Total": "TotalHarga",
+        "Tahun": "Tahun",
+        "Kategori Barang": "GrupBarang",
+        "Kategori": "Kategori"
+    })
+
+    # Bersihkan kolom numerik — jangan paksa jadi int dulu!
+    numeric_cols = ["Jumlah", "HargaSatuan", "TotalHarga"]
+    for col in numeric_cols:
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+
+    # Kolom Tahun: pastikan jadi integer (hapus desimal & NaN)
+    df["Tahun"] = pd.to_numeric(df["Tahun"], errors="coerce")
+    df = df.dropna(subset=["Tahun"])  # hapus baris tanpa tahun
+    # ✅ Konversi kolom Tanggal ke datetime (global, sekali saja)
+    df["Tanggal"] = pd.to_datetime(df["Tanggal"], dayfirst=True, errors="coerce")
+
+    # Validasi kolom penting
+    required_cols = ["Jumlah", "TotalHarga",
+                     "UnitPemohon", "NamaBrg", "Kategori", "Tahun"]
+    for col in required_cols:
+        if col not in df.columns:
+            raise ValueError(f"Kolom '{col}' tidak ditemukan di data CSV!")
+
+    return df, dataset_version
+
+
+DEFAULT_YEARS = "2025"  # `years` default endpoint dashboard bila from/to juga tidak diisi
+
+
+def years_in_range(period):
+    """Tahun data yang beririsan dengan rentang (start, end) ns; end eksklusif."""
+    start, end = period
+    first = pd.Timestamp(start).year if start is not None else None
+    last = pd.Timestamp(end - 1).year if end is not None else None
+    return [y for y in all_years() if (first is None or y >= first) and (last is None or y <= last)]
+
+
+def parse_years_param(years_param: Optional[str], period=(None, None)):
+    """
+    Parameter `years` → daftar tahun. Jika `years` tidak diisi tetapi from/to diisi, tahun
+    diturunkan dari rentang tanggal; jika keduanya kosong dipakai DEFAULT_YEARS.
+    """
+    if years_param is None:
+        if period[0] is not None or period[1] is not None:
+            return years_in_range(period)
+        years_param = DEFAULT_YEARS
     if not years_param or years_param.lower() == "all":
         # Ambil SEMUA tahun unik dari dataset
-        return sorted(df["Tahun"].dropna().unique().astype(int).tolist())
+        return all_years()
 
     try:
         return sorted(set(int(y.strip()) for y in years_param.split(",") if y.strip().isdigit()))
@@ -138,56 +355,1015 @@ def parse_years_param(years_param: str):
 # ====================
 # ✅ Hitung & Tambahkan Kolom Segmen
 # ====================
-# Agregasi dasar per Unit Pemohon untuk menghitung ambang batas
-unit_agg_for_segmen = df.groupby("UnitPemohon").agg(
-    TotalPermintaan=("Jumlah", "sum"),
-    TotalPengeluaran=("TotalHarga", "sum")
-).reset_index()
-
-# Tentukan ambang batas untuk Permintaan (Jumlah) → untuk LabelSegmen
-permintaan_vals = unit_agg_for_segmen["TotalPermintaan"]
-p33 = permintaan_vals.quantile(0.33)
-p66 = permintaan_vals.quantile(0.66)
-
-# Tentukan ambang batas untuk Pengeluaran (Uang) → untuk Segmen
-pengeluaran_vals = unit_agg_for_segmen["TotalPengeluaran"]
-e33 = pengeluaran_vals.quantile(0.33)
-e66 = pengeluaran_vals.quantile(0.66)
-
-# Buat dictionary mapping untuk UnitPemohon -> LabelSegmen & Segmen
-unit_to_label_segmen = {}
-unit_to_segmen = {}
-
-for _, row in unit_agg_for_segmen.iterrows():
-    total_permintaan = row["TotalPermintaan"]
-    total_pengeluaran = row["TotalPengeluaran"]
-
-    # Klasifikasi Permintaan (Jumlah Unit) → untuk LabelSegmen
-    if total_permintaan >= p66:
-        label_segmen = "Tinggi"
-    elif total_permintaan >= p33:
-        label_segmen = "Sedang"
-    else:
-        label_segmen = "Rendah"
+def assign_segments(df):
+    """
+    Segmen unit berdasarkan kuantil total permintaan & pengeluaran seluruh data
+    (aturan yang sama dengan unit_profile untuk semua tahun).
+    Menambahkan kolom label_segmen & segmen ke df.
+    """
+    # Agregasi dasar per Unit Pemohon untuk menghitung ambang batas
+    unit_agg_for_segmen = df.groupby("UnitPemohon").agg(
+        TotalPermintaan=("Jumlah", "sum"),
+        TotalPengeluaran=("TotalHarga", "sum")
+    ).reset_index()
+
+    # Klasifikasi sekaligus untuk semua unit (tanpa iterrows)
+    label_segmen, segmen, _ = classify_segments(
+        unit_agg_for_segmen["TotalPermintaan"], unit_agg_for_segmen["TotalPengeluaran"]
+    )
+
+    # Buat dictionary mapping untuk UnitPemohon -> LabelSegmen & Segmen
+    units = unit_agg_for_segmen["UnitPemohon"]
+    unit_to_label_segmen = dict(zip(units, label_segmen.tolist()))
+    unit_to_segmen = dict(zip(units, segmen.tolist()))
+
+    # Tambahkan kolom baru ke DataFrame utama
+    df["label_segmen"] = df["UnitPemohon"].map(unit_to_label_segmen)
+    df["segmen"] = df["UnitPemohon"].map(unit_to_segmen)
+
+    # Isi nilai NaN jika ada unit pemohon baru yang tidak tercakup dalam agregasi
+    df["label_segmen"] = df["label_segmen"].fillna("Rendah")
+    df["segmen"] = df["segmen"].fillna("Hemat")
+
+
+# ====================
+# ✅ ID Stabil Barang & Unit + Indeks Baris
+# ====================
+import json
+import numpy as np
+
+
+def _group_row_index(codes, n_groups):
+    """
+    Indeks baris per grup (format CSR): baris milik grup g adalah
+    order[bounds[g]:bounds[g + 1]] — posisi baris, urut seperti di df.
+    """
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(n_groups + 1))
+    return order, bounds
+
+
+def load_id_registry(path):
+    """Registry ID tersimpan → {"items": [KodeBarang per ID], "units": [UnitPemohon per ID]}."""
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {"items": [], "units": []}
+
+
+def save_id_registry(path, registry):
+    """Tulis atomik (file sementara lalu rename) supaya registry tidak pernah setengah jadi."""
+    try:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(registry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"[ERROR] Simpan registry ID {path}: {e}")
+
+
+def assign_ids(keys, known):
+    """
+    ID append-only: kunci yang sudah terdaftar memakai ID lamanya, kunci baru ditambahkan
+    di belakang (urut kunci). `known` diperpanjang di tempat → (ID per baris, ada kunci baru?).
+    """
+    uniques, inverse = np.unique(keys, return_inverse=True)
+    lookup = {key: i for i, key in enumerate(known)}
+    new_keys = [key for key in uniques.tolist() if key not in lookup]
+    for key in new_keys:
+        lookup[key] = len(known)
+        known.append(key)
+    return np.array([lookup[key] for key in uniques.tolist()], dtype=np.int32)[inverse], bool(new_keys)
+
+
+def build_id_indexes(frame, registry_path=None):
+    """
+    Dictionary-encoding untuk barang (kunci alami: KodeBarang) dan unit pemohon.
+    ID disimpan di registry append-only (registry_path), jadi tetap sama setelah reload/import
+    walaupun ada barang/unit baru; kode yang hilang dari data tetap memegang ID-nya.
+    Menambahkan kolom ItemID & UnitID ke frame dan mengembalikan indeks lookup.
+    """
+    registry = load_id_registry(registry_path)
+    item_ids, new_items = assign_ids(frame["KodeBarang"].astype(str).to_numpy(), registry["items"])
+    unit_ids, new_units = assign_ids(frame["UnitPemohon"].astype(str).to_numpy(), registry["units"])
+    if registry_path and (new_items or new_units):
+        save_id_registry(registry_path, registry)
+    item_codes = np.array(registry["items"], dtype=str)
+    unit_names = np.array(registry["units"], dtype=str)
+    frame["ItemID"] = item_ids.astype(np.int32)
+    frame["UnitID"] = unit_ids.astype(np.int32)
+
+    # Satu KodeBarang bisa tercatat dengan beberapa ejaan NamaBrg / Kategori
+    # → ambil yang paling sering muncul sebagai nama kanonik.
+    def canonical(col):
+        return (
+            frame.groupby(["ItemID", col]).size()
+            .reset_index(name="n")
+            .sort_values(["ItemID", "n"], ascending=[True, False], kind="stable")
+            .drop_duplicates("ItemID")
+            .set_index("ItemID")[col]
+            .reindex(range(len(item_codes)))
+        )
+
+    item_dim = pd.DataFrame({
+        "KodeBarang": item_codes,
+        "NamaBrg": canonical("NamaBrg"),
+        "Kategori": canonical("Kategori"),
+    })
+    item_dim.index.name = "ItemID"
+
+    return {
+        "item_codes": item_codes,
+        "unit_names": unit_names,
+        "item_to_id": {code: i for i, code in enumerate(registry["items"])},
+        "unit_to_id": {name: i for i, name in enumerate(registry["units"])},
+        "item_dim": item_dim,
+        "item_rows": _group_row_index(item_ids, len(item_codes)),
+        "unit_rows": _group_row_index(unit_ids, len(unit_names)),
+    }
+
+
+
+def rows_for(kind, group_id):
+    """Posisi baris df untuk ItemID/UnitID tertentu (kind: 'item' atau 'unit')."""
+    order, bounds = current().id_index[f"{kind}_rows"]
+    if group_id < 0 or group_id >= len(bounds) - 1:
+        return order[:0]
+    return order[bounds[group_id]:bounds[group_id + 1]]
+
+
+# ====================
+# ✅ Indeks Waktu (Tahun → Tanggal) untuk Filter Rentang Tanggal
+# ====================
+from fastapi import Depends, HTTPException
+
+NO_DATE = np.iinfo(np.int64).max  # baris tanpa Tanggal ditaruh di akhir blok tahunnya
+
+
+def build_time_index(frame):
+    """
+    Urutan baris berdasarkan (Tahun, Tanggal) + prefix sum Jumlah & TotalHarga.
+    Rentang tanggal di dalam satu tahun = dua binary search, dan total rentang
+    = selisih dua nilai kumulatif.
+    """
+    tahun = frame["Tahun"].to_numpy(dtype=np.int64)
+    tanggal = frame["Tanggal"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    tanggal = np.where(frame["Tanggal"].isna().to_numpy(), NO_DATE, tanggal)
+
+    order = np.lexsort((tanggal, tahun))
+    tahun_sorted = tahun[order]
+    years = np.unique(tahun_sorted)
+    starts = np.searchsorted(tahun_sorted, years, side="left")
+    ends = np.searchsorted(tahun_sorted, years, side="right")
+
+    return {
+        "order": order,
+        "tanggal": tanggal[order],
+        "year_bounds": {int(y): (int(s), int(e)) for y, s, e in zip(years, starts, ends)},
+        "cum_jumlah": np.concatenate([[0.0], np.cumsum(frame["Jumlah"].to_numpy(dtype=float)[order])]),
+        "cum_total": np.concatenate([[0.0], np.cumsum(frame["TotalHarga"].to_numpy(dtype=float)[order])]),
+    }
+
+
+
+def parse_date_range(date_from=None, date_to=None):
+    """
+    Parameter `from`/`to` (ISO: YYYY, YYYY-MM, atau YYYY-MM-DD) → (start, end) dalam ns,
+    end eksklusif. `to=2024-06` berarti sampai akhir Juni 2024.
+    """
+    try:
+        start = pd.Period(date_from.strip()).start_time.value if date_from else None
+        end = (pd.Period(date_to.strip()) + 1).start_time.value if date_to else None
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Format tanggal tidak valid, gunakan YYYY-MM-DD / YYYY-MM / YYYY")
+    return start, end
+
+
+def date_range_param(
+    date_from: Optional[str] = Query(None, alias="from", description="Tanggal awal (YYYY-MM-DD / YYYY-MM / YYYY)"),
+    date_to: Optional[str] = Query(None, alias="to", description="Tanggal akhir, inklusif"),
+):
+    return parse_date_range(date_from, date_to)
+
+
+def time_slices(years, period=(None, None)):
+    """Potongan [lo, hi) pada urutan time_index untuk setiap tahun yang dipilih."""
+    time_index = current().time_index
+    start, end = period
+    slices = []
+    for year in years:
+        bounds = time_index["year_bounds"].get(int(year))
+        if bounds is None:
+            continue
+        lo, hi = bounds
+        if start is not None or end is not None:
+            block = time_index["tanggal"][lo:hi]
+            # Baris tanpa Tanggal (NO_DATE, di akhir blok) tidak termasuk rentang apa pun
+            hi = lo + int(np.searchsorted(block, end if end is not None else NO_DATE, side="left"))
+            if start is not None:
+                lo = lo + int(np.searchsorted(block, start, side="left"))
+        if hi > lo:
+            slices.append((lo, hi))
+    return slices
+
+
+def select_positions(years, period=(None, None)):
+    """Posisi baris df (terurut naik) untuk daftar tahun & rentang tanggal opsional."""
+    slices = time_slices(years, period)
+    if not slices:
+        return np.empty(0, dtype=np.int64)
+    order = current().time_index["order"]
+    return np.sort(np.concatenate([order[lo:hi] for lo, hi in slices]))
+
+
+def select_rows(years, period=(None, None)):
+    """
+    Baris df untuk daftar tahun & rentang tanggal opsional, lewat indeks waktu.
+    Urutan baris asli dipertahankan (agregasi "first" tetap sama).
+    """
+    check_deadline()
+    return current().df.iloc[select_positions(years, period)]
+
+
+def range_sums(years, period=(None, None)):
+    """Total Jumlah, TotalHarga & jumlah baris untuk tahun/rentang — O(log n), tanpa scan."""
+    time_index = current().time_index
+    jumlah = total = 0.0
+    rows = 0
+    for lo, hi in time_slices(years, period):
+        jumlah += time_index["cum_jumlah"][hi] - time_index["cum_jumlah"][lo]
+        total += time_index["cum_total"][hi] - time_index["cum_total"][lo]
+        rows += hi - lo
+    # Selisih prefix sum membawa noise floating point → bulatkan ke sen
+    return round(jumlah, 2), round(total, 2), rows
+
+
+def all_years():
+    return sorted(current().time_index["year_bounds"].keys())
+
+
+# ====================
+# ✅ Cache Turunan per Versi Dataset
+# ====================
+# Kunci cache bisa memuat parameter request (subset tahun, metrik, k) → dibatasi LRU
+DERIVED_CACHE_MAX_ENTRIES = int(os.getenv("DERIVED_CACHE_MAX_ENTRIES", "64"))
+
+
+def cached_per_version(name, builder):
+    """
+    Hasil builder() disimpan di dataset aktif per versinya (LRU, maksimal
+    DERIVED_CACHE_MAX_ENTRIES entri); dibangun ulang otomatis saat data berubah.
+    """
+    dataset = current()
+    cache = dataset.derived_cache
+    entry = cache.get(name)
+    if entry is not None and entry[0] == dataset.version:
+        try:
+            cache.move_to_end(name)
+        except KeyError:
+            pass  # baru saja dibuang registry memori dari thread lain
+        return entry[1]
+
+    check_deadline()
+    entry = (dataset.version, builder())
+    cache[name] = entry
+    with memory_lock:
+        # LRU jumlah entri juga tidak boleh membuang hasil turunan yang dipin (anomali)
+        while len(cache) > DERIVED_CACHE_MAX_ENTRIES:
+            oldest = next((key for key in cache if key not in DERIVED_PINNED), None)
+            if oldest is None:
+                break
+            del cache[oldest]
+    enforce_memory_budget(keep=dataset.name)
+    return entry[1]
+
+
+def cache_years(years):
+    """Subset tahun untuk kunci cache: hanya tahun yang ada di data, urut & unik."""
+    available = set(all_years())
+    return tuple(sorted({int(y) for y in years} & available))
 
-    # Klasifikasi Pengeluaran (Uang) → untuk Segmen
-    if total_pengeluaran >= e66:
-        segmen = "Boros"
-    elif total_pengeluaran >= e33:
-        segmen = "Sedang"
-    else:
-        segmen = "Hemat"
 
-    unit_to_label_segmen[row["UnitPemohon"]] = label_segmen
-    unit_to_segmen[row["UnitPemohon"]] = segmen
+# ====================
+# ✅ Time-Series Bulanan (Tahun × Bulan × Metrik)
+# ====================
+BULAN_NAMA = ["Januari", "Februari", "Maret", "April", "Mei", "Juni",
+              "Juli", "Agustus", "September", "Oktober", "November", "Desember"]
+
+
+def build_monthly_store():
+    """
+    Grid Tahun × 12 bulan untuk setiap metrik, dibangun sekali per versi dataset:
+    jumlah (Jumlah), total (TotalHarga), nilai (Jumlah × HargaSatuan), rows (transaksi).
+    Baris tanpa Tanggal tidak ikut dihitung.
+    """
+    df = current().df
+    valid = df["Tanggal"].notna().to_numpy()
+    tahun = df["Tahun"].to_numpy(dtype=np.int64)[valid]
+    bulan = df["Tanggal"].dt.month.to_numpy()[valid].astype(np.int64) - 1
+    years = np.unique(tahun)
+    cell = np.searchsorted(years, tahun) * 12 + bulan
+    size = len(years) * 12
+
+    jumlah = df["Jumlah"].to_numpy(dtype=float)[valid]
+    harga = df["HargaSatuan"].to_numpy(dtype=float)[valid]
+    metrics = {
+        "jumlah": jumlah,
+        "total": df["TotalHarga"].to_numpy(dtype=float)[valid],
+        "nilai": jumlah * harga,
+        "rows": None,
+    }
+
+    store = {"years": {int(y): i for i, y in enumerate(years)}}
+    for key, weights in metrics.items():
+        store[key] = np.bincount(cell, weights=weights, minlength=size).reshape(-1, 12)
+    return store
+
+
+def monthly_series(years, metric="jumlah"):
+    """Total per bulan (Jan–Des) untuk daftar tahun — O(12) per tahun dari store."""
+    store = cached_per_version("monthly_store", build_monthly_store)
+    result = np.zeros(12)
+    for year in years:
+        i = store["years"].get(int(year))
+        if i is not None:
+            result += store[metric][i]
+    return np.round(result, 2)
+
+
+def monthly_active(years, metric="jumlah"):
+    """Seri bulanan (index 1–12) hanya untuk bulan yang ada transaksinya."""
+    values = pd.Series(monthly_series(years, metric), index=range(1, 13))
+    return values[monthly_series(years, "rows") > 0]
+
+
+def monthly_from_frame(data, column):
+    """Fallback untuk rentang tanggal sembarang: agregasi bulanan langsung dari baris."""
+    data = data.dropna(subset=["Tanggal"])
+    return (
+        data.groupby(data["Tanggal"].dt.month)[column]
+        .sum()
+        .reindex(range(1, 13), fill_value=0)
+        .to_numpy(dtype=float)
+    )
+
+
+def in_period(frame, period):
+    """Filter rentang tanggal untuk subset kecil (mis. baris satu ItemID/UnitID)."""
+    start, end = period
+    if start is None and end is None:
+        return frame
+    tanggal = frame["Tanggal"]
+    mask = tanggal.notna()
+    if start is not None:
+        mask &= tanggal >= pd.Timestamp(start)
+    if end is not None:
+        mask &= tanggal < pd.Timestamp(end)
+    return frame[mask]
+
+
+def shift_period(period, years):
+    """Geser rentang (start, end) sebanyak `years` tahun — untuk perbandingan vs tahun lalu."""
+    return tuple(
+        None if bound is None else (pd.Timestamp(bound) + pd.DateOffset(years=years)).value
+        for bound in period
+    )
+
+# ====================
+# ✅ Segmentasi & Profil Unit per Subset Tahun
+# ====================
+SEGMEN_QUANTILES = (0.33, 0.66)
+# Fitur radar per unit + rentang normalisasi p10–p90 (lihat /api/data-radar)
+RADAR_FEATURES = ["TotalPengeluaran", "TotalPermintaan", "RataHarga", "Efisiensi", "Frekuensi", "Keragaman"]
+RADAR_SCALE_QUANTILES = (0.1, 0.9)
+
+
+def classify_segments(permintaan, pengeluaran):
+    """
+    Aturan segmen tunggal untuk semua endpoint: kuantil 33/66 atas total per unit.
+    Permintaan → LabelSegmen (Tinggi/Sedang/Rendah), Pengeluaran → Segmen (Boros/Sedang/Hemat).
+    Return: (label_segmen, segmen, ambang batas).
+    """
+    p33, p66 = (permintaan.quantile(q) for q in SEGMEN_QUANTILES)
+    e33, e66 = (pengeluaran.quantile(q) for q in SEGMEN_QUANTILES)
+    label_segmen = np.select([permintaan >= p66, permintaan >= p33], ["Tinggi", "Sedang"], "Rendah")
+    segmen = np.select([pengeluaran >= e66, pengeluaran >= e33], ["Boros", "Sedang"], "Hemat")
+    thresholds = {"p33": float(p33), "p66": float(p66), "e33": float(e33), "e66": float(e66)}
+    return label_segmen, segmen, thresholds
+
+
+def build_unit_profile(years, period=(None, None)):
+    """
+    Satu baris per UnitPemohon untuk subset tahun/rentang: total, transaksi, kategori pertama,
+    fitur radar, Segmen & LabelSegmen (ambang dari subset yang sama) + skala p10/p90 fitur radar.
+    """
+    data = select_rows(years, period)
+    bulan = data["Tanggal"].dt.year * 12 + data["Tanggal"].dt.month
+    units = (
+        data.assign(_bulan=bulan)
+        .groupby("UnitPemohon")
+        .agg(
+            UnitID=("UnitID", "first"),
+            TotalPermintaan=("Jumlah", "sum"),
+            TotalPengeluaran=("TotalHarga", "sum"),
+            Transaksi=("Jumlah", "size"),
+            Kategori=("Kategori", "first"),
+            Keragaman=("Kategori", "nunique"),
+            JumlahBulan=("_bulan", "nunique"),
+        )
+    )
+    units["Kategori"] = units["Kategori"].fillna("Lainnya")
+
+    permintaan = units["TotalPermintaan"]
+    units["RataHarga"] = (units["TotalPengeluaran"] / permintaan.where(permintaan > 0)).fillna(0.0)
+    units["Efisiensi"] = permintaan / units["Transaksi"]
+    units["Frekuensi"] = (permintaan / units["JumlahBulan"].where(units["JumlahBulan"] > 0)).fillna(0.0)
+
+    units["LabelSegmen"], units["Segmen"], thresholds = (
+        classify_segments(permintaan, units["TotalPengeluaran"]) if len(units)
+        else ([], [], {})
+    )
+    scale = {
+        col: tuple(float(units[col].quantile(q)) for q in RADAR_SCALE_QUANTILES)
+        for col in RADAR_FEATURES
+    } if len(units) else {}
+    return {"units": units, "thresholds": thresholds, "scale": scale}
+
+
+def unit_profile(years, period=(None, None)):
+    """
+    Profil & segmen unit untuk subset tahun — dihitung sekali per subset per versi dataset.
+    Rentang tanggal sembarang dihitung langsung (tidak di-cache).
+    """
+    years = cache_years(years)
+    if period == (None, None):
+        return cached_per_version(f"unit_profile:{years}", lambda: build_unit_profile(years))
+    return build_unit_profile(years, period)
+
+
+def with_subset_segments(data, years, period=(None, None)):
+    """Ganti kolom segmen/label_segmen di potongan df dengan segmen subset tahun yang sama."""
+    units = unit_profile(years, period)["units"]
+    return data.assign(
+        segmen=data["UnitPemohon"].map(units["Segmen"]),
+        label_segmen=data["UnitPemohon"].map(units["LabelSegmen"]),
+    )
+
+
+# ====================
+# ✅ Storage Backend (pandas / eksperimen query pushdown SQLite)
+# ====================
+# pandas = sumber data & jalur utama semua endpoint. sqlite = eksperimen pushdown opsional:
+# hanya storage.aggregate (top kategori, facet kategori per tahun, top-spending-units) yang
+# dijalankan di SQL. DataFrame tetap dimuat penuh dan impor tetap lewat CSV, jadi mode ini
+# tidak mengurangi memori dan menambah waktu startup (build mirror per versi dataset).
+import sqlite3
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "pandas").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "./data/stark.db")
+
+# Dimensi yang boleh dipakai untuk filter/group-by (juga whitelist nama kolom SQL)
+STORAGE_DIMENSIONS = ["Tahun", "Bulan", "UnitPemohon", "KodeBarang", "NamaBrg", "Kategori", "GrupBarang"]
+STORAGE_COLUMNS = ["Tanggal", "Tahun", "Bulan", "NomorSurat", "Pemohon", "UnitPemohon", "KodeBarang",
+                   "NamaBrg", "Satuan", "Jumlah", "HargaSatuan", "TotalHarga", "GrupBarang", "Kategori"]
+# Rollup per tahun: nama tabel → dimensi selain Tahun
+SQLITE_ROLLUPS = {
+    "rollup_kategori": ["Kategori"],
+    "rollup_unit": ["UnitPemohon"],
+    "rollup_barang": ["KodeBarang"],
+    "rollup_bulan": ["Bulan"],
+}
+
+
+def check_dimensions(by):
+    unknown = [b for b in by if b not in STORAGE_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Dimensi tidak dikenal: {unknown}")
+
+
+class PandasStorage:
+    """Semua data di DataFrame `df`; filter lewat indeks waktu, group-by dengan pandas."""
+    name = "pandas"
+
+    def aggregate(self, by, years, period=(None, None), filters=None):
+        """
+        Jumlah, TotalHarga & jumlah transaksi per kombinasi `by`
+        untuk tahun/rentang tanggal dan filter kesamaan opsional {dimensi: [nilai]}.
+        """
+        check_dimensions(by)
+        data = select_rows(years, period)
+        for col, values in (filters or {}).items():
+            check_dimensions([col])
+            data = data[self._column(data, col).isin(values)]
+        if not by:
+            return pd.DataFrame([{"Jumlah": data["Jumlah"].sum(), "TotalHarga": data["TotalHarga"].sum(),
+                                  "Transaksi": len(data)}])
+        keys = [self._column(data, b) for b in by]
+        return (
+            data.groupby(keys)
+            .agg(Jumlah=("Jumlah", "sum"), TotalHarga=("TotalHarga", "sum"), Transaksi=("Jumlah", "size"))
+            .reset_index()
+        )
+
+    @staticmethod
+    def _column(data, col):
+        if col == "Bulan":
+            return data["Tanggal"].dt.month.rename("Bulan")
+        return data[col]
+
+
+class SQLiteStorage:
+    """
+    EKSPERIMEN: mirror read-only dari DataFrame dataset (tabel transaksi ber-index + rollup
+    per tahun), dibangun ulang sekali per versi dataset. Hanya storage.aggregate yang
+    di-pushdown ke SQL; rollup dipakai jika query tidak memakai rentang tanggal. Hasil harus
+    identik dengan PandasStorage (lihat tests/test_storage.py).
+    Data tetap dimuat penuh ke memori (df & indeks dipakai endpoint lain); perubahan data
+    masuk lewat file CSV + reload, bukan ditulis langsung ke database.
+    """
+    name = "sqlite"
+
+    def __init__(self, path, frame, version):
+        self.path = path
+        self.version = version
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'dataset_version'").fetchone()
+        if row is None or row[0] != version:
+            self.rebuild(frame)
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    @staticmethod
+    def _to_records(frame):
+        rows = frame.assign(
+            Tanggal=frame["Tanggal"].dt.strftime("%Y-%m-%d"),
+            Bulan=frame["Tanggal"].dt.month.astype("Int64"),
+            Tahun=frame["Tahun"].astype(int),
+        )[STORAGE_COLUMNS]
+        return rows.astype(object).where(rows.notna(), None).itertuples(index=False, name=None)
+
+    def rebuild(self, frame):
+        """Buat ulang tabel transaksi + index + rollup dari DataFrame (sekali per versi dataset)."""
+        columns = ", ".join(STORAGE_COLUMNS)
+        placeholders = ", ".join("?" for _ in STORAGE_COLUMNS)
+        with self._connect() as conn:
+            conn.execute("DROP TABLE IF EXISTS transaksi")
+            conn.execute(f"""
+                CREATE TABLE transaksi (
+                    id INTEGER PRIMARY KEY,
+                    Tanggal TEXT, Tahun INTEGER, Bulan INTEGER, NomorSurat TEXT, Pemohon TEXT,
+                    UnitPemohon TEXT, KodeBarang TEXT, NamaBrg TEXT, Satuan TEXT,
+                    Jumlah REAL, HargaSatuan REAL, TotalHarga REAL, GrupBarang TEXT, Kategori TEXT
+                )""")
+            conn.executemany(f"INSERT INTO transaksi ({columns}) VALUES ({placeholders})", self._to_records(frame))
+            conn.execute("CREATE INDEX idx_transaksi_tahun_bulan ON transaksi (Tahun, Bulan)")
+            conn.execute("CREATE INDEX idx_transaksi_tanggal ON transaksi (Tahun, Tanggal)")
+            conn.execute("CREATE INDEX idx_transaksi_unit ON transaksi (UnitPemohon, Tahun)")
+            conn.execute("CREATE INDEX idx_transaksi_barang ON transaksi (KodeBarang, Tahun)")
+            self._refresh_rollups(conn)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dataset_version', ?)", (self.version,))
+        print(f"[INFO] SQLite storage dibangun ulang: {len(frame)} baris → {self.path}")
+
+    def _refresh_rollups(self, conn, years=None):
+        where = ""
+        params = []
+        if years is not None:
+            where = f"WHERE Tahun IN ({', '.join('?' for _ in years)})"
+            params = [int(y) for y in years]
+        for table, dims in SQLITE_ROLLUPS.items():
+            cols = ", ".join(["Tahun"] + dims)
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    {cols}, Jumlah REAL, TotalHarga REAL, Transaksi INTEGER,
+                    PRIMARY KEY ({cols})
+                )""")
+            conn.execute(f"DELETE FROM {table} {where}", params)
+            conn.execute(f"""
+                INSERT INTO {table} ({cols}, Jumlah, TotalHarga, Transaksi)
+                SELECT {cols}, SUM(Jumlah), SUM(TotalHarga), COUNT(*)
+                FROM transaksi {where} GROUP BY {cols}""", params)
+
+    def aggregate(self, by, years, period=(None, None), filters=None):
+        check_dimensions(by)
+        filters = filters or {}
+        check_dimensions(list(filters))
+        start, end = period
+
+        # Tanpa rentang tanggal & semua kolom tersedia di satu rollup → baca rollup
+        table = "transaksi"
+        if start is None and end is None:
+            needed = set(by) | set(filters)
+            for rollup, dims in SQLITE_ROLLUPS.items():
+                if needed <= {"Tahun", *dims}:
+                    table = rollup
+                    break
+
+        where = [f"Tahun IN ({', '.join('?' for _ in years)})"]
+        params = [int(y) for y in years]
+        if start is not None:
+            where.append("Tanggal >= ?")
+            params.append(pd.Timestamp(start).strftime("%Y-%m-%d"))
+        if end is not None:
+            where.append("Tanggal < ?")
+            params.append(pd.Timestamp(end).strftime("%Y-%m-%d"))
+        for col, values in filters.items():
+            where.append(f"{col} IN ({', '.join('?' for _ in values)})")
+            params.extend(values)
+
+        count_expr = "SUM(Transaksi)" if table != "transaksi" else "COUNT(*)"
+        group = ", ".join(by)
+        select = f"{group}, " if by else ""
+        sql = (f"SELECT {select}SUM(Jumlah) AS Jumlah, SUM(TotalHarga) AS TotalHarga, {count_expr} AS Transaksi "
+               f"FROM {table} WHERE {' AND '.join(where)}")
+        if by:
+            sql += f" GROUP BY {group}"
+        with self._connect() as conn:
+            result = pd.read_sql_query(sql, conn, params=params)
+        # SUM di SQLite menjumlah dengan urutan berbeda dari pandas → bulatkan noise float
+        result = result.fillna({"Jumlah": 0, "TotalHarga": 0, "Transaksi": 0})
+        return result.round({"Jumlah": 2, "TotalHarga": 2}).astype({"Transaksi": int})
+
+
+def top_categories(years, period, metric, n=6):
+    """N kategori teratas menurut `metric` (Jumlah / TotalHarga) lewat storage backend."""
+    agg = current().storage.aggregate(["Kategori"], years, period)
+    return agg.sort_values("Kategori").nlargest(n, metric)[["Kategori", metric]].reset_index(drop=True)
+
+
+def create_storage(name, frame, version):
+    if STORAGE_BACKEND == "sqlite":
+        # Satu file database per dataset: stark.db untuk default, stark_<nama>.db untuk lainnya
+        root, ext = os.path.splitext(SQLITE_PATH)
+        path = SQLITE_PATH if name == DEFAULT_DATASET else f"{root}_{name}{ext}"
+        return SQLiteStorage(path, frame, version)
+    return PandasStorage()
+
+
+# ====================
+# ✅ Registry Dataset (beberapa kampus / file dalam satu deployment)
+# ====================
+import asyncio
+import contextvars
+import threading
+from fastapi.responses import JSONResponse
+
+DATA_DIR = os.getenv("DATA_DIR", "./data")
+# Format: nama=file.csv,nama2=file2.csv (file relatif terhadap DATA_DIR)
+DATASET_FILES = {
+    name.strip().lower(): os.path.join(DATA_DIR, file.strip())
+    for name, _, file in (
+        entry.partition("=")
+        for entry in os.getenv("DATASETS", "spc=Data_SPC.csv,su=Data_FIXX_SU.csv").split(",")
+        if "=" in entry
+    )
+}
+DEFAULT_DATASET = os.getenv("DEFAULT_DATASET", next(iter(DATASET_FILES)))
+# Registry ID barang/unit per dataset (ids_<nama>.json), append-only agar ItemID/UnitID stabil
+ID_REGISTRY_DIR = os.getenv("ID_REGISTRY_DIR", DATA_DIR)
+# Endpoint status yang tidak butuh (dan tidak boleh menunggu) data dimuat
+DATASET_FREE_PATHS = {"/api/ready", "/api/datasets"}
+
+
+class Dataset:
+    """Satu file transaksi beserta semua indeks & cache turunannya."""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.load_phases = {}
+        self.df, self.version = timed(self.load_phases, "read_csv", load_transactions, path)
+        timed(self.load_phases, "segments", assign_segments, self.df)
+        self.id_index = timed(self.load_phases, "id_index", build_id_indexes, self.df,
+                              os.path.join(ID_REGISTRY_DIR, f"ids_{name}.json"))
+        self.time_index = timed(self.load_phases, "time_index", build_time_index, self.df)
+        self.derived_cache = SizedCache(lambda entry: deep_sizeof(entry[1]))
+        self.storage = timed(self.load_phases, "storage", create_storage, name, self.df, self.version)
+        self.loaded_at = time.time()
+        self._nbytes = None
+
+    def nbytes(self):
+        """
+        Perkiraan memori: DataFrame + array indeks (cache turunan dihitung terpisah).
+        Data tidak berubah setelah dimuat → dihitung sekali (memory_usage deep memindai kolom teks).
+        """
+        if self._nbytes is None:
+            arrays = [self.time_index["order"], self.time_index["tanggal"],
+                      self.time_index["cum_jumlah"], self.time_index["cum_total"],
+                      *self.id_index["item_rows"], *self.id_index["unit_rows"]]
+            self._nbytes = int(self.df.memory_usage(deep=True).sum()) + sum(a.nbytes for a in arrays)
+        return self._nbytes
+
+
+loaded_datasets = OrderedDict()  # nama → Dataset, urutan LRU
+# dataset_lock: serialisasi muat/reload (bisa lama, hanya di thread worker)
+# registry_lock: operasi singkat pada loaded_datasets (boleh diambil dari event loop)
+dataset_lock = threading.Lock()
+registry_lock = threading.Lock()
+active_dataset = contextvars.ContextVar("active_dataset", default=None)
+
+
+def get_dataset(name):
+    """Dataset dari registry; dimuat saat pertama dipakai lalu dijaga dalam budget memori."""
+    with dataset_lock:
+        with registry_lock:
+            dataset = loaded_datasets.get(name)
+            if dataset is not None:
+                loaded_datasets.move_to_end(name)
+                return dataset
+
+        started = time.time()
+        dataset = Dataset(name, DATASET_FILES[name])
+        with registry_lock:
+            loaded_datasets[name] = dataset
+        print(f"[INFO] Dataset '{name}' dimuat: {len(dataset.df)} baris, "
+              f"{dataset.nbytes() / 2**20:.1f} MB, {time.time() - started:.2f} detik")
+        # Budget memori global (dataset + cache); dataset default & `name` tidak pernah dilepas
+        enforce_memory_budget(keep=name)
+        return dataset
+
+
+def current():
+    """Dataset untuk request yang sedang berjalan (parameter `dataset`), default DEFAULT_DATASET."""
+    dataset = active_dataset.get()
+    return dataset if dataset is not None else get_dataset(DEFAULT_DATASET)
+
+
+@app.middleware("http")
+async def dataset_middleware(request: Request, call_next):
+    """
+    Semua endpoint menerima `?dataset=<nama>` opsional. Dataset dimuat (jika perlu) di thread
+    terpisah, lalu dipasang sebagai dataset aktif untuk handler & middleware di dalamnya.
+    """
+    if request.url.path in DATASET_FREE_PATHS:
+        return await call_next(request)
+
+    name = (request.query_params.get("dataset") or DEFAULT_DATASET).strip().lower()
+    if name not in DATASET_FILES:
+        return JSONResponse(status_code=404, content={
+            "detail": f"Dataset '{name}' tidak dikenal",
+            "datasets": sorted(DATASET_FILES),
+        })
+    with registry_lock:
+        dataset = loaded_datasets.get(name)
+        if dataset is not None:
+            loaded_datasets.move_to_end(name)
+    if dataset is None:
+        dataset = await asyncio.to_thread(get_dataset, name)
+        # Dataset baru dimuat → anomali dihitung di latar belakang, bukan saat request pertama
+        if "anomalies" not in dataset.derived_cache:
+            spawn(run_anomaly_job(dataset))
+
+    token = active_dataset.set(dataset)
+    try:
+        return await call_next(request)
+    finally:
+        active_dataset.reset(token)
+
+
+NO_CACHE_PATHS.add("/api/datasets")
+
+
+@app.get("/api/datasets")
+async def list_datasets():
+    """Daftar dataset yang tersedia beserta status muat & pemakaian memorinya."""
+    with registry_lock:
+        loaded = dict(loaded_datasets)
+    return {
+        "default": DEFAULT_DATASET,
+        "memoryBudgetMB": MEMORY_BUDGET_MB,
+        "datasets": [
+            {
+                "name": name,
+                "file": os.path.basename(path),
+                "loaded": name in loaded,
+                "version": loaded[name].version if name in loaded else None,
+                "rows": len(loaded[name].df) if name in loaded else None,
+                "memoryMB": round(loaded[name].nbytes() / 2**20, 2) if name in loaded else None,
+            }
+            for name, path in DATASET_FILES.items()
+        ],
+    }
+
+
+# =====================================================
+# ✅ Mode Aproksimasi: Sketsa HyperLogLog & Sampel Terstratifikasi per Partisi Bulan
+# =====================================================
+# Partisi = (tahun, bulan) di urutan time_index.
+# Sketsa & sampel dibangun sekali per versi dataset, query `approx=true` hanya menggabungkan
+# partisi yang dipilih → biaya tidak bergantung jumlah baris.
+HLL_PRECISION = int(os.getenv("HLL_PRECISION", "14"))
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_RELATIVE_ERROR = round(1.04 / HLL_REGISTERS ** 0.5, 4)
+HLL_COLUMNS = ["UnitPemohon", "NamaBrg"]
+APPROX_SAMPLE_PER_PARTITION = int(os.getenv("APPROX_SAMPLE_PER_PARTITION", "2000"))
+APPROX_Z = 1.96  # interval kepercayaan 95%
+
+
+def month_partitions():
+    """
+    [(tahun, bulan, lo, hi)] pada urutan time_index; partisi kosong dilewati. Bulan 0/13 =
+    baris yang Tanggal-nya sebelum/sesudah tahunnya (termasuk tanpa tanggal, selalu di akhir).
+    """
+    time_index = current().time_index
+    partitions = []
+    for year, (lo, hi) in sorted(time_index["year_bounds"].items()):
+        edges = [pd.Timestamp(year=year, month=m, day=1).value for m in range(1, 13)]
+        edges.append(pd.Timestamp(year=year + 1, month=1, day=1).value)
+        cuts = [lo, *(lo + np.searchsorted(time_index["tanggal"][lo:hi], edges, side="left")), hi]
+        for month in range(14):
+            if cuts[month + 1] > cuts[month]:
+                partitions.append((year, month, int(cuts[month]), int(cuts[month + 1])))
+    return partitions
+
+
+def hll_hash_registers(values, partition_ids, n_partitions):
+    """Register HLL per partisi, vectorised: 64-bit hash → indeks register & posisi bit 1 pertama."""
+    hashes = pd.util.hash_array(np.asarray(values, dtype=object))
+    index = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - HLL_PRECISION)) - 1)
+    # frexp → panjang bit sisa hash; rank = jumlah nol di depan + 1
+    bit_length = np.frexp(rest.astype(np.float64))[1]
+    rank = (64 - HLL_PRECISION - bit_length + 1).astype(np.uint8)
+    registers = np.zeros(n_partitions * HLL_REGISTERS, dtype=np.uint8)
+    np.maximum.at(registers, partition_ids * HLL_REGISTERS + index, rank)
+    return registers.reshape(n_partitions, HLL_REGISTERS)
+
+
+def hll_estimate(registers):
+    """Estimasi kardinalitas HyperLogLog (dengan koreksi linear counting untuk nilai kecil)."""
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def build_approx_index():
+    """Partisi bulan + sketsa HLL per kolom + sampel acak tanpa pengembalian per partisi."""
+    dataset = current()
+    df, order = dataset.df, dataset.time_index["order"]
+    partitions = month_partitions()
+    sizes = np.array([hi - lo for _, _, lo, hi in partitions], dtype=np.int64)
+    partition_ids = np.repeat(np.arange(len(partitions)), sizes)
+    covered = np.concatenate([np.arange(lo, hi) for _, _, lo, hi in partitions]) if partitions else np.array([], int)
+    rows = order[covered]
+
+    sketches = {
+        column: hll_hash_registers(df[column].to_numpy()[rows], partition_ids, len(partitions))
+        for column in HLL_COLUMNS
+    }
+
+    # Seed dari versi dataset → sampel (dan respons ber-ETag) deterministik per versi
+    rng = np.random.default_rng(int(dataset.version, 16))
+    sample_positions, sample_strata = [], []
+    for i, (_, _, lo, hi) in enumerate(partitions):
+        take = min(hi - lo, APPROX_SAMPLE_PER_PARTITION)
+        sample_positions.append(lo + rng.choice(hi - lo, size=take, replace=False))
+        sample_strata.append(np.full(take, i))
+    sample_positions = np.concatenate(sample_positions) if partitions else np.array([], int)
+    return {
+        "partitions": partitions,
+        "sketches": sketches,
+        "sample_rows": order[sample_positions],
+        "sample_strata": np.concatenate(sample_strata) if partitions else np.array([], int),
+        "population": sizes,
+        "sample_sizes": np.bincount(np.concatenate(sample_strata), minlength=len(partitions))
+        if partitions else np.array([], int),
+    }
+
+
+def approx_partitions(years, period=(None, None)):
+    """
+    Indeks partisi yang tepat menutup (tahun, rentang); None jika rentang tidak jatuh di
+    batas bulan (mis. from=2024-03-15) → pemanggil kembali ke perhitungan exact.
+    """
+    start, end = period
+    for bound in (start, end):
+        if bound is not None and pd.Timestamp(bound) != pd.Timestamp(bound).to_period("M").start_time:
+            return None
+    index = cached_per_version("approx_index", build_approx_index)
+    wanted = {int(y) for y in years}
+    selected = []
+    for i, (year, month, _, _) in enumerate(index["partitions"]):
+        if year not in wanted:
+            continue
+        if month == 0:
+            # Tanggal sebelum tahunnya: ikut jika tidak ada batas awal & batas akhir sesudahnya
+            if start is None and (end is None or end > pd.Timestamp(year=year, month=1, day=1).value):
+                selected.append(i)
+            continue
+        if month == 13:
+            # Tanggal sesudah tahunnya / tanpa tanggal: hanya jika tidak ada batas akhir
+            if end is None:
+                selected.append(i)
+            continue
+        month_start = pd.Timestamp(year=year, month=month, day=1).value
+        if (start is None or month_start >= start) and (end is None or month_start < end):
+            selected.append(i)
+    return index, np.array(selected, dtype=np.int64)
+
+
+def approx_distinct(years, period=(None, None)):
+    """Distinct UnitPemohon & NamaBrg dari gabungan sketsa partisi; None jika tidak selaras bulan."""
+    found = approx_partitions(years, period)
+    if found is None:
+        return None
+    index, selected = found
+    if not len(selected):
+        return {column: 0 for column in HLL_COLUMNS}
+    return {column: hll_estimate(index["sketches"][column][selected].max(axis=0)) for column in HLL_COLUMNS}
 
-# Tambahkan kolom baru ke DataFrame utama
-df["label_segmen"] = df["UnitPemohon"].map(unit_to_label_segmen)
-df["segmen"] = df["UnitPemohon"].map(unit_to_segmen)
 
-# Isi nilai NaN jika ada unit pemohon baru yang tidak tercakup dalam agregasi
-df["label_segmen"] = df["label_segmen"].fillna("Rendah")
-df["segmen"] = df["segmen"].fillna("Hemat")
+def approx_group_sums(years, period, by, value):
+    """
+    Estimasi Σ`value` per grup `by` dari sampel terstratifikasi (estimator Horvitz-Thompson
+    per strata) beserta batas galat 95%: z·√(Σ_h N_h²(1 − n_h/N_h)·s²_h / n_h).
+    Return (DataFrame [*by, estimate, errorBound], info sampel, baris sampel) atau None jika
+    rentang tidak selaras bulan.
+    """
+    found = approx_partitions(years, period)
+    if found is None:
+        return None
+    index, selected = found
+    in_scope = np.isin(index["sample_strata"], selected)
+    strata = index["sample_strata"][in_scope]
+    sample = current().df.iloc[index["sample_rows"][in_scope]][by + [value]].assign(_strata=strata)
+    population = index["population"]
+    sample_sizes = index["sample_sizes"]
+
+    per_stratum = (
+        sample.assign(_sq=sample[value] ** 2)
+        .groupby(by + ["_strata"], sort=False)
+        .agg(total=(value, "sum"), squares=("_sq", "sum"))
+        .reset_index()
+    )
+    N = population[per_stratum["_strata"].to_numpy()].astype(float)
+    n = sample_sizes[per_stratum["_strata"].to_numpy()].astype(float)
+    # Varians y·1{grup} di dalam strata (baris sampel di luar grup bernilai 0)
+    variance = np.where(
+        n > 1, (per_stratum["squares"] - per_stratum["total"] ** 2 / n) / np.maximum(n - 1, 1), 0.0)
+    per_stratum["estimate"] = N / n * per_stratum["total"]
+    per_stratum["variance"] = N ** 2 * (1 - n / N) * variance / n
+
+    result = per_stratum.groupby(by, sort=False)[["estimate", "variance"]].sum().reset_index()
+    result["errorBound"] = APPROX_Z * np.sqrt(result.pop("variance").clip(lower=0))
+    info = {
+        "sampleRows": int(sample_sizes[selected].sum()),
+        "populationRows": int(population[selected].sum()),
+        "confidence": 0.95,
+    }
+    return result, info, sample
+
+
+def approx_data_summary(years, period=(None, None)):
+    """
+    Ringkasan /api/data tanpa scan: total dari prefix sum (exact), unit unik dari HLL,
+    top 5 barang dari sampel terstratifikasi (± batas galat). None jika tidak selaras bulan.
+    """
+    distinct = approx_distinct(years, period)
+    grouped = approx_group_sums(years, period, ["Kategori", "NamaBrg"], "Jumlah")
+    if distinct is None or grouped is None:
+        return None
+    sums, info, sample = grouped
+    jumlah, total, rows = range_sums(years, period)
+    top = sums.nlargest(5, "estimate")
+
+    # Unit peminta terbanyak per barang: frekuensi baris sampel dibobot N_h / n_h
+    index = cached_per_version("approx_index", build_approx_index)
+    weights = index["population"] / np.maximum(index["sample_sizes"], 1)
+    requesters = (
+        sample.assign(UnitPemohon=current().df.loc[sample.index, "UnitPemohon"],
+                      _weight=weights[sample["_strata"].to_numpy()])
+        .groupby(["Kategori", "NamaBrg", "UnitPemohon"], sort=False)["_weight"].sum()
+        .reset_index()
+        .sort_values("_weight", ascending=False, kind="stable")
+        .drop_duplicates(["Kategori", "NamaBrg"])
+        .set_index(["Kategori", "NamaBrg"])["UnitPemohon"]
+    )
+
+    top_items = [
+        {
+            "Kategori": row.Kategori,
+            "NamaBrg": row.NamaBrg,
+            "TopRequester": requesters.get((row.Kategori, row.NamaBrg), "N/A"),
+            "Terjual": int(round(row.estimate)),
+            "TerjualErrorBound": int(np.ceil(row.errorBound)),
+        }
+        for row in top.itertuples(index=False)
+    ]
+    return {
+        "totalRequests": int(round(jumlah)),
+        "outflowValueFormatted": f"Rp{total:,.0f}".replace(",", "."),
+        "totalUniqueRequesters": distinct["UnitPemohon"],
+        "fastMovingItems": top_items[0]["NamaBrg"] if top_items else "Tidak ada",
+        "topItems": top_items,
+        "totalData": rows,
+        "approximate": {**info, "distinctRelativeStdError": HLL_RELATIVE_ERROR},
+    }
 
 
 # =====================================================
@@ -196,11 +1372,17 @@ df["segmen"] = df["segmen"].fillna("Hemat")
 
 
 @app.get("/api/data")
-async def get_all_data():
+async def get_all_data(period=Depends(date_range_param), approx: bool = False):
     """
-    Mengambil ringkasan seluruh data tanpa filter.
+    Mengambil ringkasan seluruh data tanpa filter tahun (opsional: rentang `from`/`to`).
+    `approx=true` → lihat approx_data_summary (rentang tidak selaras bulan tetap exact).
     """
-    data = df.copy()
+    if approx:
+        summary = approx_data_summary(all_years(), period)
+        if summary is not None:
+            return summary
+
+    data = select_rows(all_years(), period).copy()
 
     totalRequests = int(data["Jumlah"].sum())
     outflowValue = float(data["TotalHarga"].sum())
@@ -246,10 +1428,11 @@ import numpy as np
 from fastapi import HTTPException
 
 @app.get("/api/data-per-tahun")
-async def get_data_per_tahun():
+async def get_data_per_tahun(period=Depends(date_range_param)):
     try:
         # Validasi df
-        if 'df' not in globals() or df.empty:
+        df = current().df
+        if df.empty:
             raise ValueError("DataFrame 'df' tidak tersedia.")
 
         hasil = {}
@@ -271,7 +1454,7 @@ async def get_data_per_tahun():
             # 🔑 KUNCI: Pastikan key adalah string (JSON hanya izinkan string sebagai key)
             tahun_key = str(int(tahun))  # double cast: numpy → int → str
 
-            data_tahun = df[df["Tahun"] == tahun]
+            data_tahun = select_rows([tahun], period)
 
             if data_tahun.empty:
                 hasil[tahun_key] = {
@@ -329,6 +1512,7 @@ async def get_data_per_tahun():
         return hasil
 
     except Exception as e:
+        uncacheable()
         import traceback
         print("[ERROR] Traceback lengkap:")
         traceback.print_exc()
@@ -354,17 +1538,26 @@ async def root():
 
 
 @app.get("/api/dashboard-metrics")
-async def get_dashboard_metrics(years: str = "2025"):
+async def get_dashboard_metrics(years: Optional[str] = None, period=Depends(date_range_param), approx: bool = False):
+    """
+    `approx=true`: jumlah unit & barang unik dari sketsa HyperLogLog per bulan (tanpa scan);
+    rentang yang tidak selaras bulan tetap dihitung exact.
+    """
     try:
         # Parse tahun dari parameter
-        selected_years = parse_years_param(years)
+        selected_years = parse_years_param(years, period)
         if not selected_years:
             selected_years = [2025]
 
-        # Filter data hanya untuk tahun yang dipilih
-        data = df[df["Tahun"].isin(selected_years)].copy()
+        distinct = approx_distinct(selected_years, period) if approx else None
+        if distinct is None:
+            # Filter data hanya untuk tahun yang dipilih
+            data = select_rows(selected_years, period).copy()
+            empty = data.empty
+        else:
+            empty = range_sums(selected_years, period)[2] == 0
 
-        if data.empty:
+        if empty:
             # Jika tidak ada data, kembalikan nilai kosong
             return {
                 "metrics": {
@@ -375,11 +1568,18 @@ async def get_dashboard_metrics(years: str = "2025"):
                 }
             }
 
-        # Hitung metrik utama dari data yang difilter
-        total_requests = int(data["Jumlah"].sum())
-        outflow_value = float(data["TotalHarga"].sum())
-        unique_requesters = int(data["UnitPemohon"].nunique())
-        unique_skus = int(data["NamaBrg"].nunique())
+        # Hitung metrik utama: total dari prefix sum indeks waktu, distinct dari data
+        jumlah_sum, total_sum, _ = range_sums(selected_years, period)
+        total_requests = int(round(jumlah_sum))
+        outflow_value = float(total_sum)
+        if distinct is None:
+            unique_requesters = int(data["UnitPemohon"].nunique())
+            unique_skus = int(data["NamaBrg"].nunique())
+            distinct_note = {}
+        else:
+            unique_requesters = distinct["UnitPemohon"]
+            unique_skus = distinct["NamaBrg"]
+            distinct_note = {"approximate": True, "relativeStdError": HLL_RELATIVE_ERROR}
 
         # Format Rupiah
         def format_rupiah(value):
@@ -397,9 +1597,9 @@ async def get_dashboard_metrics(years: str = "2025"):
             target_year = selected_years[0]
             prev_year = target_year - 1
 
-            prev_data = df[df["Tahun"] == prev_year]
-            prev_requests = int(
-                prev_data["Jumlah"].sum()) if not prev_data.empty else 0
+            # Rentang tanggal (jika ada) digeser satu tahun ke belakang
+            prev_jumlah, _, _ = range_sums([prev_year], shift_period(period, -1))
+            prev_requests = int(round(prev_jumlah))
 
             # Contoh untuk totalRequests
             if prev_requests == 0:
@@ -430,17 +1630,20 @@ async def get_dashboard_metrics(years: str = "2025"):
                 "totalUniqueRequesters": {
                     "value": unique_requesters,
                     "changeText": "Total unit unik",
-                    "isPositive": None
+                    "isPositive": None,
+                    **distinct_note
                 },
                 "totalUniqueSKUs": {
                     "value": unique_skus,
                     "changeText": "Total barang unik",
-                    "isPositive": None
+                    "isPositive": None,
+                    **distinct_note
                 }
             }
         }
 
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Dashboard Metrics ({years}): {e}")
         import traceback
         traceback.print_exc()
@@ -458,76 +1661,45 @@ async def get_dashboard_metrics(years: str = "2025"):
 # ✅ Endpoint 4: Data Bulanan per Tahun
 # =====================================================
 @app.get("/api/monthly-demand")
-async def get_monthly_demand(years: str = "2025"):
+async def get_monthly_demand(years: Optional[str] = None, period=Depends(date_range_param)):
     """
     Ambil total permintaan (unit) per bulan dari satu atau banyak tahun.
     """
     try:
-        selected_years = parse_years_param(years)
+        selected_years = parse_years_param(years, period)
         if not selected_years:
             return {"monthlyDemand": [0] * 12}
 
-        data = df[df["Tahun"].isin(selected_years)].copy()
-        if data.empty:
-            return {"monthlyDemand": [0] * 12}
-
-        data["Tanggal"] = pd.to_datetime(
-            data["Tanggal"], dayfirst=True, errors="coerce")
-        data = data.dropna(subset=["Tanggal"])
-        data["Bulan"] = data["Tanggal"].dt.month
-
-        monthly = (
-            data.groupby("Bulan")["Jumlah"]
-            .sum()
-            .reindex(range(1, 13), fill_value=0)
-            .tolist()
-        )
+        # Tanpa rentang tanggal → langsung dari time-series bulanan
+        if period == (None, None):
+            monthly = monthly_series(selected_years, "jumlah")
+        else:
+            monthly = monthly_from_frame(select_rows(selected_years, period), "Jumlah")
 
-        return {"monthlyDemand": monthly}
+        return {"monthlyDemand": monthly.tolist()}
 
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Monthly Demand ({years}): {e}")
         return {"monthlyDemand": [0] * 12}
 
 
 @app.get("/api/monthly-outcome/{year}")
-async def get_monthly_outcome(year: int):
+async def get_monthly_outcome(year: int, period=Depends(date_range_param)):
+    """
+    Total pengeluaran (Jml × Harga) per bulan untuk satu tahun, dibulatkan ke Rupiah.
+    """
     try:
-        # Salin data untuk menghindari efek samping
-        temp_df = df.copy()
-
-        # 1. Parse Tanggal dengan benar (format: DD/MM/YYYY)
-        temp_df["Tanggal"] = pd.to_datetime(
-            temp_df["Tanggal"], dayfirst=True, errors="coerce")
-        temp_df = temp_df.dropna(subset=["Tanggal"])
-
-        # 2. Ekstrak Tahun dan Bulan dari Tanggal (lebih akurat)
-        temp_df["Tahun"] = temp_df["Tanggal"].dt.year
-        temp_df["Bulan"] = temp_df["Tanggal"].dt.month
-
-        # 3. Filter data berdasarkan tahun yang diminta
-        data = temp_df[temp_df["Tahun"] == year]
-        if data.empty:
-            return {"monthlyDemand": [0] * 12}
-
-        # 4. Pastikan kolom 'Jml' dan 'Harga' numerik
-        data["Jml"] = pd.to_numeric(data["Jml"], errors="coerce")
-        data["Harga"] = pd.to_numeric(data["Harga"], errors="coerce")
-
-        # 5. Hitung Total = Jml * Harga (abaikan baris dengan NaN)
-        data = data.dropna(subset=["Jml", "Harga"])
-        data["Total"] = data["Jml"] * data["Harga"]
-
-        # 6. Agregasi total pengeluaran per bulan (1–12)
-        monthly_sum = data.groupby("Bulan")["Total"].sum()
-        full_year = monthly_sum.reindex(
-            range(1, 13), fill_value=0).sort_index()
+        if period == (None, None):
+            monthly = monthly_series([year], "nilai")
+        else:
+            data = select_rows([year], period)
+            monthly = monthly_from_frame(data.assign(Nilai=data["Jumlah"] * data["HargaSatuan"]), "Nilai")
 
-        # 7. Konversi ke integer (pembulatan ke Rupiah terdekat)
-        result = [int(round(x)) for x in full_year.tolist()]
-        return {"monthlyDemand": result}
+        return {"monthlyDemand": [int(round(x)) for x in monthly]}
 
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Gagal memuat data pengeluaran bulanan {year}: {e}")
         import traceback
         traceback.print_exc()
@@ -538,10 +1710,10 @@ async def get_monthly_outcome(year: int):
 # ✅ Endpoint 5: Kategori & Top Items per Tahun
 # =====================================================
 @app.get("/api/category-and-top-items")
-async def get_category_and_top_items(years: str = "2025"):
+async def get_category_and_top_items(years: Optional[str] = None, period=Depends(date_range_param)):
     try:
         # Parse years
-        selected_years = parse_years_param(years)
+        selected_years = parse_years_param(years, period)
         if not selected_years:
             return {
                 "categoryValueLabels": [],
@@ -549,7 +1721,7 @@ async def get_category_and_top_items(years: str = "2025"):
                 "topItems": []
             }
 
-        data = df[df["Tahun"].isin(selected_years)].copy()
+        data = select_rows(selected_years, period).copy()
         if data.empty:
             return {
                 "categoryValueLabels": [],
@@ -558,14 +1730,10 @@ async def get_category_and_top_items(years: str = "2025"):
             }
 
         # Agregasi kategori
-        category_agg = (
-            data.groupby("Kategori")["TotalHarga"]
-            .sum()
-            .nlargest(6)
-            .reset_index()
-        )
+        category_agg = top_categories(selected_years, period, "TotalHarga")
 
-        # Top 5 barang
+        # Top 5 barang (DemandClass = LabelSegmen unit untuk tahun yang dipilih)
+        data = with_subset_segments(data, selected_years, period)
         top_items_agg = (
             data.groupby(["Kategori", "NamaBrg", "label_segmen"])
             .agg(
@@ -594,6 +1762,7 @@ async def get_category_and_top_items(years: str = "2025"):
         }
 
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Category & Top Items ({years}): {e}")
         import traceback
         traceback.print_exc()
@@ -608,114 +1777,321 @@ async def get_category_and_top_items(years: str = "2025"):
 
 
 @app.get("/api/dashboard-metrics/{year}")
-async def get_dashboard_metrics_by_year(year: int):
+async def get_dashboard_metrics_by_year(year: int, period=Depends(date_range_param)):
     try:
         # Ambil data tahun ini
-        current_data = df[df["Tahun"] == year]
-        if current_data.empty:
+        if not time_slices([year], period):
             return {
                 "error": f"Tidak ada data untuk tahun {year}",
                 "data": {}
             }
 
-        # Cari tahun sebelumnya
+        # Tahun ini & tahun lalu (rentang digeser) dalam satu pass
         previous_year = year - 1
-        previous_data = df[df["Tahun"] == previous_year]
-
-        # Hitung metrik tahun ini
-        total_requests_current = int(
-            current_data["Jumlah"].sum()) if not current_data.empty else 0
-        outflow_value_current = float(
-            current_data["TotalHarga"].sum()) if not current_data.empty else 0.0
-        unique_requesters_current = int(
-            current_data["UnitPemohon"].nunique()) if not current_data.empty else 0
-        unique_skus_current = int(
-            current_data["NamaBrg"].nunique()) if not current_data.empty else 0
-
-        # Hitung metrik tahun lalu
-        total_requests_prev = int(
-            previous_data["Jumlah"].sum()) if not previous_data.empty else 0
-        outflow_value_prev = float(
-            previous_data["TotalHarga"].sum()) if not previous_data.empty else 0.0
-        unique_requesters_prev = int(
-            previous_data["UnitPemohon"].nunique()) if not previous_data.empty else 0
-        unique_skus_prev = int(
-            previous_data["NamaBrg"].nunique()) if not previous_data.empty else 0
-
-        # Helper
-        def calc_change(curr, prev):
-            return "N/A" if prev == 0 else round(((curr - prev) / prev) * 100, 1)
-
-        def format_change(val):
-            if val == "N/A":
-                return "N/A"
-            sign = "↑" if val > 0 else "↓"
-            return f"{sign} {abs(val):.1f}% vs Tahun Lalu"
-
-        def format_rupiah(value):
-            if value >= 1_000_000_000:
-                return f"Rp{value / 1_000_000_000:.1f}M"
-            elif value >= 1_000_000:
-                return f"Rp{value / 1_000_000:.1f}jt"
-            else:
-                return f"Rp{value:,.0f}".replace(",", ".")
+        comparison = compare_years([year], period)
 
         return {
             "current_year": year,
             "previous_year": previous_year,
             "metrics": {
-                "totalRequests": {
-                    "value": total_requests_current,
-                    "changeText": format_change(calc_change(total_requests_current, total_requests_prev)),
-                    "isPositive": calc_change(total_requests_current, total_requests_prev) > 0 if calc_change(total_requests_current, total_requests_prev) != "N/A" else None
-                },
-                "outflowValue": {
-                    "value": (outflow_value_current),
-                    "changeText": format_change(calc_change(outflow_value_current, outflow_value_prev)),
-                    "isPositive": calc_change(outflow_value_current, outflow_value_prev) > 0 if calc_change(outflow_value_current, outflow_value_prev) != "N/A" else None
-                },
-                "totalUniqueRequesters": {
-                    "value": unique_requesters_current,
-                    "changeText": format_change(calc_change(unique_requesters_current, unique_requesters_prev)),
-                    "isPositive": calc_change(unique_requesters_current, unique_requesters_prev) > 0 if calc_change(unique_requesters_current, unique_requesters_prev) != "N/A" else None
-                },
-                "totalUniqueSKUs": {
-                    "value": unique_skus_current,
-                    "changeText": format_change(calc_change(unique_skus_current, unique_skus_prev)),
-                    "isPositive": calc_change(unique_skus_current, unique_skus_prev) > 0 if calc_change(unique_skus_current, unique_skus_prev) != "N/A" else None
+                metric: {
+                    "value": entries[0]["value"],
+                    "changeText": entries[0]["changeText"],
+                    "isPositive": entries[0]["isPositive"]
                 }
+                for metric, entries in comparison.items()
             }
         }
 
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Dashboard Metrics by Year: {e}")
         return {"error": "Internal Server Error", "detail": str(e)}
+# =====================================================
+# ✅ Perbandingan N Tahun (satu pass group-by)
+# =====================================================
+COMPARE_METRICS = ["totalRequests", "outflowValue", "totalUniqueRequesters", "totalUniqueSKUs"]
+
+
+def year_metrics(requests):
+    """
+    Empat metrik kartu dashboard untuk setiap (tahun, rentang) di `requests` dalam satu group-by:
+    posisi baris semua potongan digabung dengan kode slot, lalu diagregasi per slot.
+    Return: {(tahun, rentang): {metrik: nilai}}.
+    """
+    requests = list(dict.fromkeys(requests))
+    positions = [select_positions([year], period) for year, period in requests]
+    rows = current().df.iloc[np.concatenate(positions)]
+    slots = np.repeat(np.arange(len(requests)), [len(p) for p in positions])
+
+    agg = (
+        pd.DataFrame({
+            "slot": slots,
+            "Jumlah": rows["Jumlah"].to_numpy(),
+            "TotalHarga": rows["TotalHarga"].to_numpy(),
+            "UnitID": rows["UnitID"].to_numpy(),
+            "NamaBrg": rows["NamaBrg"].to_numpy(),
+        })
+        .groupby("slot")
+        .agg(
+            totalRequests=("Jumlah", "sum"),
+            outflowValue=("TotalHarga", "sum"),
+            totalUniqueRequesters=("UnitID", "nunique"),
+            totalUniqueSKUs=("NamaBrg", "nunique"),
+        )
+        .reindex(range(len(requests)), fill_value=0)
+    )
+    result = {}
+    for slot, key in enumerate(requests):
+        row = agg.loc[slot]
+        result[key] = {
+            "totalRequests": int(row["totalRequests"]),
+            "outflowValue": round(float(row["outflowValue"]), 2),
+            "totalUniqueRequesters": int(row["totalUniqueRequesters"]),
+            "totalUniqueSKUs": int(row["totalUniqueSKUs"]),
+        }
+    return result
+
+
+def change_fields(curr, prev):
+    """Perubahan vs tahun lalu: persen (None jika tahun lalu 0), teks kartu, dan arah."""
+    if prev == 0:
+        return {"growthPct": None, "changeText": "N/A", "isPositive": None}
+    growth = round(((curr - prev) / prev) * 100, 1)
+    sign = "↑" if growth > 0 else "↓"
+    return {"growthPct": growth, "changeText": f"{sign} {abs(growth):.1f}% vs Tahun Lalu", "isPositive": growth > 0}
+
+
+def compare_years(years, period=(None, None)):
+    """
+    Nilai per tahun + selisih & pertumbuhan year-over-year untuk setiap metrik.
+    Pembanding tiap tahun = tahun sebelumnya dengan rentang tanggal digeser satu tahun.
+    """
+    previous_period = shift_period(period, -1)
+    values = year_metrics(
+        [(year, period) for year in years] + [(year - 1, previous_period) for year in years]
+    )
+    comparison = {metric: [] for metric in COMPARE_METRICS}
+    for year in years:
+        curr = values[(year, period)]
+        prev = values[(year - 1, previous_period)]
+        for metric in COMPARE_METRICS:
+            comparison[metric].append({
+                "year": year,
+                "value": curr[metric],
+                "previous": prev[metric],
+                "delta": round(curr[metric] - prev[metric], 2),
+                **change_fields(curr[metric], prev[metric]),
+            })
+    return comparison
+
+
+@app.get("/api/dashboard-compare")
+async def get_dashboard_compare(years: str = "all", period=Depends(date_range_param)):
+    """
+    Metrik kartu dashboard untuk banyak tahun sekaligus (tren multi-tahun dalam satu request).
+    Contoh:
+      /api/dashboard-compare?years=2023,2024,2025
+      /api/dashboard-compare?years=all&from=2024-01&to=2024-06
+    """
+    try:
+        selected_years = parse_years_param(years)
+        if not selected_years:
+            return {"years": [], "metrics": {}}
+        return {"years": selected_years, "metrics": compare_years(selected_years, period)}
+
+    except Exception as e:
+        uncacheable()
+        print(f"[ERROR] Dashboard Compare ({years}): {e}")
+        import traceback
+        traceback.print_exc()
+        return {"years": [], "metrics": {}}
+
+
+# =====================================================
+# ✅ Event Dataset (SSE): versi baru dipush ke semua dashboard yang berlangganan
+# =====================================================
+import json
+from fastapi.responses import StreamingResponse
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# Klien lambat: antrean per klien dibatasi, event terlama dibuang lebih dulu
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "8"))
+
+dataset_subscribers = {}  # nama dataset → {queue: parameter years}
+# Referensi task latar belakang: event loop hanya menyimpan weakref, task tanpa pemilik bisa hilang
+background_tasks = set()
+
+
+def spawn(coro):
+    # Job latar belakang tidak ikut batas waktu / pembatalan request yang memicunya
+    context = contextvars.copy_context()
+    context.run(request_budget.set, None)
+    task = asyncio.create_task(coro, context=context)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def sse_message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def deliver(queue, message):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+async def publish_dataset_event(dataset, reason, previous_version=None, rows_added=None):
+    """
+    Kirim event `dataset-version` ke semua pelanggan dataset. Metrik perbandingan dihitung
+    SEKALI per kombinasi tahun yang dilanggan, lalu pesan yang sama dibagikan ke semua kliennya.
+    """
+    subscribers = list(dataset_subscribers.get(dataset.name, {}).items())
+    groups = {}
+    for queue, years in subscribers:
+        groups.setdefault(years, []).append(queue)
+
+    token = active_dataset.set(dataset)
+    try:
+        for years, queues in groups.items():
+            selected_years = parse_years_param(years) if years else []
+            payload = {
+                "dataset": dataset.name,
+                "version": dataset.version,
+                "previousVersion": previous_version,
+                "reason": reason,
+                "rowsAdded": rows_added,
+                "years": selected_years,
+            }
+            if selected_years:
+                payload["metrics"] = await asyncio.to_thread(compare_years, selected_years)
+            message = sse_message("dataset-version", payload)
+            for queue in queues:
+                deliver(queue, message)
+    except Exception as e:
+        print(f"[ERROR] Publish event dataset '{dataset.name}': {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        active_dataset.reset(token)
+    print(f"[INFO] Event {reason} dataset '{dataset.name}' ({dataset.version}) → "
+          f"{len(subscribers)} klien, {len(groups)} perhitungan")
+    return len(subscribers)
+
+
+NO_CACHE_PATHS.add("/api/events")
+STREAMING_PATHS.add("/api/events")
+
+
+@app.get("/api/events")
+async def dataset_events(years: str = ""):
+    """
+    Stream SSE perubahan dataset. Event pertama berisi versi saat ini; setelah reload/import
+    dikirim versi baru beserta metrik dashboard-compare untuk `years` yang dilanggan.
+    Contoh:
+      /api/events?years=2024,2025
+      /api/events?dataset=su&years=all
+    """
+    dataset = current()
+    years = years.strip().lower()
+
+    async def stream():
+        queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        dataset_subscribers.setdefault(dataset.name, {})[queue] = years
+        try:
+            yield sse_message("dataset-version", {
+                "dataset": dataset.name, "version": dataset.version, "reason": "subscribe",
+            })
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+        finally:
+            dataset_subscribers[dataset.name].pop(queue, None)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def reload_dataset(name):
+    """
+    Baca ulang file dataset; registry hanya diganti jika isinya berubah → (lama, baru).
+    Seluruhnya di bawah dataset_lock: reload yang bersamaan menunggu lalu melihat versi yang
+    sudah sama, jadi CSV tidak dimuat dua kali.
+    """
+    with dataset_lock:
+        old = loaded_datasets.get(name)
+        if old is not None and old.version == file_version(DATASET_FILES[name]):
+            return old, old
+        return old, swap_dataset(name, old)
+
+
+def swap_dataset(name, old):
+    """Muat file dataset & ganti entri registry (dataset_lock harus sedang dipegang)."""
+    fresh = Dataset(name, DATASET_FILES[name])
+    with registry_lock:
+        loaded_datasets[name] = fresh
+        loaded_datasets.move_to_end(name)
+    if old is not None:
+        drop_version_responses(old.version)
+    enforce_memory_budget(keep=name)
+    return fresh
+
+
+async def after_dataset_change(old, fresh, reason):
+    """Versi baru aktif: anomali dibawa/dihitung ulang, warm-up ulang, pelanggan SSE diberi tahu."""
+    if not await asyncio.to_thread(carry_anomalies, old, fresh):
+        spawn(run_anomaly_job(fresh))
+    if fresh.name == DEFAULT_DATASET:
+        request_warmup()
+    spawn(publish_dataset_event(
+        fresh, reason,
+        previous_version=old.version if old else None,
+        rows_added=len(fresh.df) - len(old.df) if old else None,
+    ))
+
+
+@app.post("/api/reload-data")
+async def reload_data():
+    """Muat ulang file CSV dataset aktif; jika berubah, pelanggan /api/events diberi tahu."""
+    name = current().name
+    try:
+        old, fresh = await asyncio.to_thread(reload_dataset, name)
+        changed = old is not fresh
+        if changed:
+            await after_dataset_change(old, fresh, "reload")
+        return {"dataset": name, "version": fresh.version, "changed": changed}
+
+    except Exception as e:
+        print(f"[ERROR] Reload dataset '{name}': {e}")
+        import traceback
+        traceback.print_exc()
+        return {"dataset": name, "version": None, "changed": False}
+
+
     # =====================================================
 # ✅ Endpoint 7: Top 5 Unit Pemohon per Tahun
 # =====================================================
 
 
 @app.get("/api/top-requesters")
-async def get_top_requesters(years: str = "2025"):
-    selected_years = parse_years_param(years)
+async def get_top_requesters(years: Optional[str] = None, period=Depends(date_range_param)):
+    selected_years = parse_years_param(years, period)
     if not selected_years:
         return {"topRequesters": []}
 
-    data = df[df["Tahun"].isin(selected_years)].copy()
-    if data.empty:
-        return {"topRequesters": []}
-
+    # Profil unit (total, kategori pertama, LabelSegmen subset tahun ini) dari cache segmentasi
     agg = (
-        data.groupby("UnitPemohon")
-        .agg(
-            TotalPermintaan=("Jumlah", "sum"),
-            TotalPengeluaran=("TotalHarga", "sum"),
-            Kategori=("Kategori", "first"),
-            label_segmen=("label_segmen", "first") # <-- ERROR: Kolom 'label_segmen' TIDAK ADA!
-        )
+        unit_profile(selected_years, period)["units"]
+        .rename(columns={"LabelSegmen": "label_segmen"})
         .reset_index()
         .nlargest(10, "TotalPermintaan")
     )
+    if agg.empty:
+        return {"topRequesters": []}
 
     top_requesters = []
     for _, row in agg.iterrows():
@@ -734,63 +2110,129 @@ async def get_top_requesters(years: str = "2025"):
 
 
 @app.get("/api/category-value/{year}")
-async def get_category_value(year: int):
+async def get_category_value(year: int, period=Depends(date_range_param)):
     try:
-        data = df[df["Tahun"] == year].copy()
-        if data.empty:
+        # Agregasi kategori → total nilai pengeluaran (6 kategori teratas)
+        category_agg = top_categories([year], period, "TotalHarga")
+        if category_agg.empty:
             return {"labels": [], "data": []}
-        # Agregasi kategori → total nilai pengeluaran
-        category_agg = (
-            data.groupby("Kategori")["TotalHarga"]
-            .sum()
-            .nlargest(6)  # Ambil 6 kategori teratas
-            .reset_index()
-        )
         return {
             "labels": category_agg["Kategori"].tolist(),
             "data": [float(x) for x in category_agg["TotalHarga"].tolist()],
         }
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Category Value: {e}")
         return {"labels": [], "data": []}
 
 
 @app.get("/api/category-unit/{year}")
-async def get_category_unit(year: int):
+async def get_category_unit(year: int, period=Depends(date_range_param)):
     try:
-        data = df[df["Tahun"] == year].copy()
-        if data.empty:
+        # Agregasi kategori → total unit permintaan (6 kategori teratas)
+        category_agg = top_categories([year], period, "Jumlah")
+        if category_agg.empty:
             return {"labels": [], "data": []}
-        # Agregasi kategori → total unit permintaan
-        category_agg = (
-            data.groupby("Kategori")["Jumlah"]
-            .sum()
-            .nlargest(6)  # Ambil 6 kategori teratas
-            .reset_index()
-        )
         return {
             "labels": category_agg["Kategori"].tolist(),
             "data": [int(x) for x in category_agg["Jumlah"].tolist()],
         }
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Category Unit: {e}")
         return {"labels": [], "data": []}
 
 
+# =====================================================
+# ✅ Kategori per Tahun (faceted): banyak tahun dalam satu agregasi
+# =====================================================
+def category_year_totals(years, period=(None, None)):
+    """
+    Jumlah & TotalHarga per (Tahun, Kategori) untuk semua tahun sekaligus — satu group-by
+    lewat storage backend. Subset tahun tanpa rentang tanggal di-cache per versi dataset.
+    """
+    years = cache_years(years)
+    if period == (None, None):
+        return cached_per_version(f"category_years:{years}",
+                                  lambda: current().storage.aggregate(["Tahun", "Kategori"], years))
+    return current().storage.aggregate(["Tahun", "Kategori"], years, period)
+
+
+def category_facets(years, period, metric, cast, n=6):
+    """Top-n kategori gabungan semua tahun + top-n per tahun (urutan sama dengan top_categories)."""
+    agg = category_year_totals(years, period)
+
+    def top(frame):
+        totals = frame.groupby("Kategori")[metric].sum().reset_index().sort_values("Kategori")
+        top_n = totals.nlargest(n, metric)
+        return {"labels": top_n["Kategori"].tolist(), "data": [cast(x) for x in top_n[metric].tolist()]}
+
+    combined = top(agg) if len(agg) else {"labels": [], "data": []}
+    return {
+        **combined,
+        "years": years,
+        "perYear": {
+            str(year): top(agg[agg["Tahun"] == year]) if (agg["Tahun"] == year).any() else {"labels": [], "data": []}
+            for year in years
+        },
+    }
+
+
+@app.get("/api/category-value")
+async def get_category_value_years(years: str = "all", period=Depends(date_range_param)):
+    """
+    Top 6 kategori menurut nilai pengeluaran untuk banyak tahun dalam satu request:
+    gabungan semua tahun (`labels`/`data`) dan per tahun (`perYear`).
+    Contoh:
+      /api/category-value?years=2023,2024,2025
+    """
+    try:
+        return category_facets(parse_years_param(years), period, "TotalHarga", float)
+    except Exception as e:
+        uncacheable()
+        print(f"[ERROR] Category Value ({years}): {e}")
+        import traceback
+        traceback.print_exc()
+        return {"labels": [], "data": [], "years": [], "perYear": {}}
+
+
+@app.get("/api/category-unit")
+async def get_category_unit_years(years: str = "all", period=Depends(date_range_param)):
+    """
+    Top 6 kategori menurut jumlah unit untuk banyak tahun dalam satu request.
+    Memakai agregasi (Tahun, Kategori) yang sama dengan /api/category-value.
+    Contoh:
+      /api/category-unit?years=2024,2025
+    """
+    try:
+        return category_facets(parse_years_param(years), period, "Jumlah", int)
+    except Exception as e:
+        uncacheable()
+        print(f"[ERROR] Category Unit ({years}): {e}")
+        import traceback
+        traceback.print_exc()
+        return {"labels": [], "data": [], "years": [], "perYear": {}}
+
+
 @app.get("/api/all-items/{year}")
-async def get_all_items(year: int):
+async def get_all_items(year: int, period=Depends(date_range_param), abc: Optional[str] = None):
+    """Semua barang pada tahun tsb. `abc=A` / `abc=A,B` → hanya barang kelas ABC itu (nilai TotalHarga)."""
+    id_index = current().id_index
     try:
-        data = df[df["Tahun"] == year].copy()
+        data = select_rows([year], period).copy()
+        if abc:
+            data = data[data["ItemID"].isin(abc_item_ids(abc, [year], period))]
         if data.empty:
             return {"items": []}
 
-        # Agregasi per Nama Barang & Kategori
+        # Agregasi per ItemID (KodeBarang), nama & kategori kanonik dari item_dim
         item_agg = (
-            data.groupby(["Kategori", "NamaBrg"])
+            data.groupby("ItemID")
             .agg(
                 TotalPermintaan=("Jumlah", "sum"),
                 TotalHarga=("TotalHarga", "sum")  # tambahan
             )
+            .join(id_index["item_dim"])
             .reset_index()
         )
 
@@ -805,6 +2247,8 @@ async def get_all_items(year: int):
         items = []
         for _, row in item_agg.iterrows():
             items.append({
+                "ItemID": int(row["ItemID"]),
+                "KodeBarang": row["KodeBarang"],
                 "Kategori": row["Kategori"],
                 "NamaBrg": row["NamaBrg"],
                 "TotalPermintaan": int(row["TotalPermintaan"]),
@@ -814,14 +2258,524 @@ async def get_all_items(year: int):
         return {"items": items}
 
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] All Items: {e}")
         import traceback
         traceback.print_exc()
         return {"items": []}
 
 
+# =====================================================
+# ✅ Klasifikasi ABC (Pareto) Barang
+# =====================================================
+ABC_METRICS = ["TotalHarga", "Jumlah"]
+ABC_DEFAULT_A = 80.0   # % kumulatif nilai yang ditutup kelas A
+ABC_DEFAULT_B = 95.0   # % kumulatif sampai akhir kelas B; sisanya C
+
+
+def build_abc_ranking(years, period=(None, None), metric="TotalHarga"):
+    """
+    Ranking barang (ItemID) menurut `metric` untuk tahun/rentang, lalu share kumulatif
+    lewat sort + cumsum. Hanya barang yang punya transaksi di subset yang diranking.
+    Ambang kelas tidak ikut di sini → satu ranking melayani semua kombinasi a/b.
+    """
+    df = current().df
+    n_items = len(current().id_index["item_codes"])
+    positions = select_positions(years, period)
+    item_ids = df["ItemID"].to_numpy()[positions]
+    values = np.bincount(item_ids, weights=df[metric].to_numpy(dtype=float)[positions], minlength=n_items)
+
+    active = np.flatnonzero(np.bincount(item_ids, minlength=n_items))
+    order = active[np.argsort(-values[active], kind="stable")]
+    ranked = values[order]
+    total = float(ranked.sum())
+    cum_pct = np.cumsum(ranked) / total * 100 if total > 0 else np.full(len(ranked), 100.0)
+    share_pct = ranked / total * 100 if total > 0 else np.zeros(len(ranked))
+
+    return {
+        "item_ids": order,
+        "values": ranked,
+        "share_pct": share_pct,
+        "cum_pct": cum_pct,
+        "before_pct": cum_pct - share_pct,
+        "total": total,
+    }
+
+
+def abc_classes(years, period=(None, None), metric="TotalHarga", a=ABC_DEFAULT_A, b=ABC_DEFAULT_B):
+    """
+    Klasifikasi ABC. Ranking di-cache per (subset tahun, metrik) per versi dataset (rentang
+    tanggal sembarang tidak di-cache); kelas dihitung per request dari share kumulatif
+    SEBELUM barang tersebut, jadi barang yang melewati batas `a`% masih masuk A.
+    """
+    years = cache_years(years)
+    if period == (None, None):
+        ranking = cached_per_version(f"abc:{years}:{metric}", lambda: build_abc_ranking(years, period, metric))
+    else:
+        ranking = build_abc_ranking(years, period, metric)
+    before_pct = ranking["before_pct"]
+    return {**ranking, "classes": np.select([before_pct < a, before_pct < b], ["A", "B"], "C")}
+
+
+def abc_item_ids(kelas, years, period=(None, None)):
+    """ItemID dengan kelas ABC (TotalHarga, ambang default) di `kelas`, mis. "A" atau "A,B"."""
+    wanted = [k.strip().upper() for k in kelas.split(",") if k.strip()]
+    abc = abc_classes(years, period)
+    return abc["item_ids"][np.isin(abc["classes"], wanted)]
+
+
+@app.get("/api/item-abc")
+async def get_item_abc(
+    years: str = "all",
+    period=Depends(date_range_param),
+    metric: str = "TotalHarga",
+    a: float = ABC_DEFAULT_A,
+    b: float = ABC_DEFAULT_B,
+    kelas: Optional[str] = None,
+    limit: Optional[int] = None,
+):
+    """
+    Klasifikasi ABC barang: A = barang teratas sampai `a`% nilai kumulatif, B sampai `b`%, sisanya C.
+    Contoh:
+      /api/item-abc?years=2024,2025
+      /api/item-abc?years=all&metric=Jumlah&kelas=A&limit=20
+    Hasil yang sama dipakai filter `abc=` di /api/all-items/{year} dan /api/item-forecast.
+    """
+    if metric not in ABC_METRICS:
+        raise HTTPException(status_code=400, detail=f"metric harus salah satu dari {ABC_METRICS}")
+    if not 0 < a < b <= 100:
+        raise HTTPException(status_code=400, detail="Ambang harus 0 < a < b <= 100")
+    if limit is not None and limit < 0:
+        raise HTTPException(status_code=400, detail="limit tidak boleh negatif")
+
+    try:
+        selected_years = parse_years_param(years)
+        abc = abc_classes(selected_years, period, metric, a, b)
+        item_dim = current().id_index["item_dim"]
+        n_total = len(abc["item_ids"])
+
+        summary = []
+        for cls in ["A", "B", "C"]:
+            mask = abc["classes"] == cls
+            summary.append({
+                "Kelas": cls,
+                "JumlahBarang": int(mask.sum()),
+                "PersenBarang": round(float(mask.sum()) / n_total * 100, 1) if n_total else 0.0,
+                "Nilai": round(float(abc["values"][mask].sum()), 2),
+                "PersenNilai": round(float(abc["share_pct"][mask].sum()), 1),
+            })
+
+        ranks = np.arange(1, n_total + 1)
+        if kelas:
+            keep = np.isin(abc["classes"], [k.strip().upper() for k in kelas.split(",")])
+        else:
+            keep = np.ones(n_total, dtype=bool)
+        rows = np.flatnonzero(keep)
+        if limit:
+            rows = rows[:limit]
+
+        dims = item_dim.iloc[abc["item_ids"][rows]]
+        items = [
+            {
+                "Rank": int(ranks[i]),
+                "ItemID": int(abc["item_ids"][i]),
+                "KodeBarang": dim.KodeBarang,
+                "NamaBrg": dim.NamaBrg,
+                "Kategori": dim.Kategori,
+                "Nilai": round(float(abc["values"][i]), 2),
+                "PersenNilai": round(float(abc["share_pct"][i]), 2),
+                "PersenKumulatif": round(float(abc["cum_pct"][i]), 2),
+                "Kelas": str(abc["classes"][i]),
+            }
+            for i, dim in zip(rows, dims.itertuples())
+        ]
+
+        return {
+            "metric": metric,
+            "thresholds": {"A": a, "B": b},
+            "total": round(abc["total"], 2),
+            "summary": summary,
+            "items": items,
+        }
+
+    except Exception as e:
+        uncacheable()
+        print(f"[ERROR] Item ABC ({years}, {metric}): {e}")
+        import traceback
+        traceback.print_exc()
+        return {"metric": metric, "thresholds": {"A": a, "B": b}, "total": 0, "summary": [], "items": []}
+
+
+# =====================================================
+# ✅ Forecast Permintaan per Barang (batch, vectorised)
+# =====================================================
+FORECAST_ALPHA = 0.3   # smoothing level
+FORECAST_GAMMA = 0.3   # smoothing musiman
+# Lonjakan sekali-waktu tidak meluruh dari slot musimannya dengan GAMMA saja → perkiraan per bulan
+# dibatasi maksimum permintaan bulanan 12 bulan terakhir (barang tanpa permintaan baru → 0)
+FORECAST_RECENT_MONTHS = 12
+FORECAST_MAX_HORIZON = 12
+
+
+def build_item_month_matrix(column="Jumlah"):
+    """
+    Matriks bulan × barang (ItemID) untuk seluruh rentang bulan di data,
+    bulan tanpa transaksi bernilai 0. Bulan terakhir yang belum lengkap (data berhenti
+    sebelum akhir bulan) dibuang supaya tidak terbaca sebagai penurunan. Return: (periods, matrix).
+    """
+    df = current().df
+    id_index = current().id_index
+    valid = df["Tanggal"].notna().to_numpy()
+    months = df["Tanggal"].to_numpy(dtype="datetime64[M]")[valid]
+    first, last = months.min(), months.max()
+    last_day = df["Tanggal"].max()
+    if (last_day + pd.Timedelta(days=1)).month == last_day.month and last > first:
+        keep = months < last
+        months, valid = months[keep], np.flatnonzero(valid)[keep]
+        last = last - 1
+    month_idx = (months - first).astype(np.int64)
+    n_months = int((last - first).astype(np.int64)) + 1
+    n_items = len(id_index["item_codes"])
+
+    cell = month_idx * n_items + df["ItemID"].to_numpy()[valid]
+    weights = df[column].to_numpy(dtype=float)[valid]
+    matrix = np.bincount(cell, weights=weights, minlength=n_months * n_items).reshape(n_months, n_items)
+    periods = np.arange(first, last + 1, dtype="datetime64[M]")
+    return periods, matrix
+
+
+def ets_forecast(y, horizon=FORECAST_MAX_HORIZON):
+    """
+    Exponential smoothing musiman aditif (ETS A,N,A tanpa tren) untuk matriks bulan × barang.
+    Loop hanya berjalan di sumbu waktu; setiap langkah adalah operasi array atas semua barang.
+    Musiman awal = rata-rata semua siklus 12 bulan yang lengkap (bukan tahun pertama saja),
+    dan hasil per bulan dibatasi maksimum FORECAST_RECENT_MONTHS bulan terakhir.
+    Return: (forecast horizon × barang, MAE one-step in-sample).
+    """
+    n_months, n_items = y.shape
+    season = min(12, n_months)
+    n_cycles = max(n_months // 12, 1)
+
+    level = y[:season].mean(axis=0)
+    seasonal = np.zeros((12, n_items))
+    if n_months >= 12:
+        cycles = y[:n_cycles * 12].reshape(n_cycles, 12, n_items)
+        seasonal[:] = (cycles - cycles.mean(axis=1, keepdims=True)).mean(axis=0)
+    else:
+        seasonal[:season] = y[:season] - level
+    abs_err = np.zeros(n_items)
+
+    for t in range(season, n_months):
+        s_idx = t % 12
+        one_step = np.maximum(level + seasonal[s_idx], 0)
+        abs_err += np.abs(y[t] - one_step)
+        new_level = FORECAST_ALPHA * (y[t] - seasonal[s_idx]) + (1 - FORECAST_ALPHA) * level
+        seasonal[s_idx] = FORECAST_GAMMA * (y[t] - new_level) + (1 - FORECAST_GAMMA) * seasonal[s_idx]
+        level = new_level
+
+    steps = np.arange(n_months, n_months + horizon)
+    recent_max = y[-FORECAST_RECENT_MONTHS:].max(axis=0)
+    forecast = np.clip(level[None, :] + seasonal[steps % 12], 0, recent_max[None, :])
+    return forecast, abs_err / max(n_months - season, 1)
+
+
+def build_item_forecast():
+    """Forecast semua barang dari matriks bulan × barang (lihat ets_forecast)."""
+    periods, y = build_item_month_matrix("Jumlah")
+    forecast, mae = ets_forecast(y)
+
+    return {
+        "periods": [str(p) for p in np.arange(periods[-1] + 1, periods[-1] + 1 + FORECAST_MAX_HORIZON)],
+        "forecast": forecast,            # horizon × barang
+        "mae": mae,                      # galat one-step in-sample
+        "last_12": y[-12:].sum(axis=0),  # pembanding: total 12 bulan terakhir
+        "history_from": str(periods[0]),
+        "history_to": str(periods[-1]),
+    }
+
+
+@app.get("/api/item-forecast")
+async def get_item_forecast(horizon: int = 3, kategori: Optional[str] = None, limit: Optional[int] = None,
+                            abc: Optional[str] = None):
+    """
+    Perkiraan permintaan (unit) per barang untuk `horizon` bulan setelah data terakhir
+    (default 3 bulan = kuartal berikutnya). Dihitung sekali per versi dataset.
+    Contoh:
+      /api/item-forecast?horizon=3
+      /api/item-forecast?horizon=6&kategori=ATK&limit=20
+      /api/item-forecast?abc=A   (hanya barang kelas A seluruh tahun)
+    """
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit harus >= 1")
+
+    id_index = current().id_index
+    try:
+        horizon = max(1, min(horizon, FORECAST_MAX_HORIZON))
+        fc = cached_per_version("item_forecast", build_item_forecast)
+        per_month = fc["forecast"][:horizon]
+        totals = per_month.sum(axis=0)
+
+        item_dim = id_index["item_dim"]
+        # ItemID di registry tanpa baris di dataset ini (NamaBrg NaN) tidak diperkirakan
+        candidates = np.flatnonzero(item_dim["NamaBrg"].notna().to_numpy()[:len(totals)])
+        if kategori:
+            candidates = candidates[(item_dim["Kategori"] == kategori).to_numpy()]
+        if abc:
+            candidates = candidates[np.isin(candidates, abc_item_ids(abc, all_years()))]
+        candidates = candidates[np.argsort(-totals[candidates], kind="stable")]
+        if limit is not None:
+            candidates = candidates[:limit]
+
+        items = []
+        for item_id in candidates:
+            dim = item_dim.iloc[item_id]
+            items.append({
+                "ItemID": int(item_id),
+                "KodeBarang": dim["KodeBarang"],
+                "Kategori": dim["Kategori"],
+                "NamaBrg": dim["NamaBrg"],
+                "Forecast": [round(float(x), 1) for x in per_month[:, item_id]],
+                "TotalForecast": round(float(totals[item_id]), 1),
+                "Total12BulanTerakhir": int(fc["last_12"][item_id]),
+                "MAE": round(float(fc["mae"][item_id]), 2),
+            })
+
+        return {
+            "periods": fc["periods"][:horizon],
+            "historyFrom": fc["history_from"],
+            "historyTo": fc["history_to"],
+            "items": items,
+        }
+
+    except Exception as e:
+        uncacheable()
+        print(f"[ERROR] Item Forecast: {e}")
+        import traceback
+        traceback.print_exc()
+        return {"periods": [], "items": []}
+
+
+# =====================================================
+# ✅ Deteksi Anomali Harga & Jumlah per Transaksi
+# =====================================================
+import asyncio
+
+ANOMALY_Z_THRESHOLD = 3.5   # modified z-score (Iglewicz & Hoaglin)
+ANOMALY_MIN_TRANSAKSI = 5   # barang dengan transaksi lebih sedikit tidak dinilai
+ANOMALY_MIN_REL_SCALE = 0.05  # skala harga minimal 5% median → selisih pembulatan tidak ter-flag
+ANOMALY_MIN_LOG_SCALE = 0.25  # skala minimal untuk log(1 + Jumlah)
+ANOMALY_MAX_LIMIT = 1000      # batas atas parameter `limit` /api/anomalies
+
+
+def robust_group_stats(values, groups, n_groups, min_scale):
+    """
+    Median & skala robust per grup dalam satu pass groupby.
+    Skala = 1.4826 × MAD; jika MAD = 0 (mis. harga hampir selalu sama)
+    dipakai 1.2533 × mean absolute deviation, minimal `min_scale` (array per grup).
+    """
+    s = pd.Series(values)
+    med = s.groupby(groups).median().reindex(range(n_groups)).to_numpy()
+    dev = np.abs(values - med[groups])
+    dev_s = pd.Series(dev).groupby(groups)
+    mad = dev_s.median().reindex(range(n_groups)).to_numpy() * 1.4826
+    meanad = dev_s.mean().reindex(range(n_groups)).to_numpy() * 1.2533
+    count = np.bincount(groups, minlength=n_groups)
+    scale = np.maximum(np.where(mad > 0, mad, meanad), min_scale(med))
+    scale = np.where(count >= ANOMALY_MIN_TRANSAKSI, scale, np.nan)
+    return med, scale
+
+
+def build_anomaly_stats():
+    """Statistik robust per ItemID: HargaSatuan (dua arah) dan log(1 + Jumlah) (hanya lonjakan)."""
+    df = current().df
+    id_index = current().id_index
+    item_ids = df["ItemID"].to_numpy()
+    n_items = len(id_index["item_codes"])
+    harga_med, harga_scale = robust_group_stats(
+        df["HargaSatuan"].to_numpy(dtype=float), item_ids, n_items,
+        lambda med: ANOMALY_MIN_REL_SCALE * np.abs(med))
+    jumlah_med, jumlah_scale = robust_group_stats(
+        np.log1p(df["Jumlah"].clip(lower=0).to_numpy(dtype=float)), item_ids, n_items,
+        lambda med: ANOMALY_MIN_LOG_SCALE)
+    return {
+        "item_codes": id_index["item_codes"],  # statistik ke-i milik KodeBarang item_codes[i]
+        "harga_med": harga_med, "harga_scale": harga_scale,
+        "jumlah_med": jumlah_med, "jumlah_scale": jumlah_scale,
+    }
+
+
+def score_anomalies(frame, stats):
+    """
+    Nilai baris `frame` terhadap statistik per barang (vectorised).
+    Return hanya baris yang ter-flag, satu baris per (transaksi, jenis anomali).
+    """
+    # Cocokkan lewat KodeBarang, bukan ItemID: statistik tetap benar walau ID berubah
+    ids = pd.Index(stats["item_codes"]).get_indexer(frame["KodeBarang"].astype(str))
+    known = ids >= 0  # barang baru (belum punya statistik) dilewati
+    ids = np.where(known, ids, 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        harga = frame["HargaSatuan"].to_numpy(dtype=float)
+        z_harga = (harga - stats["harga_med"][ids]) / stats["harga_scale"][ids]
+        jumlah = np.log1p(frame["Jumlah"].clip(lower=0).to_numpy(dtype=float))
+        z_jumlah = (jumlah - stats["jumlah_med"][ids]) / stats["jumlah_scale"][ids]
+
+    z_harga = np.where(known & np.isfinite(z_harga), z_harga, 0.0)
+    z_jumlah = np.where(known & np.isfinite(z_jumlah), z_jumlah, 0.0)
+
+    parts = []
+    for jenis, z, mask, med in [
+        ("Harga", z_harga, np.abs(z_harga) > ANOMALY_Z_THRESHOLD, stats["harga_med"][ids]),
+        ("Jumlah", z_jumlah, z_jumlah > ANOMALY_Z_THRESHOLD, np.expm1(stats["jumlah_med"][ids])),
+    ]:
+        if not mask.any():
+            continue
+        flagged = frame.loc[mask, ["Tanggal", "Tahun", "NomorSurat", "UnitID", "UnitPemohon",
+                                   "ItemID", "KodeBarang", "NamaBrg", "Jumlah", "HargaSatuan"]].copy()
+        flagged["Jenis"] = jenis
+        flagged["Median"] = med[mask]
+        flagged["Skor"] = z[mask]
+        parts.append(flagged)
+
+    if not parts:
+        return pd.DataFrame(columns=["Tanggal", "Tahun", "NomorSurat", "UnitID", "UnitPemohon", "ItemID",
+                                     "KodeBarang", "NamaBrg", "Jumlah", "HargaSatuan", "Jenis", "Median", "Skor"])
+    return pd.concat(parts)
+
+
+def build_anomalies():
+    df = current().df
+    stats = build_anomaly_stats()
+    return {"stats": stats, "flags": score_anomalies(df, stats)}
+
+
+def appended_rows(previous, dataset):
+    """Baris tambahan jika `dataset` = `previous` + baris baru di belakang; None jika tidak."""
+    n_old = len(previous.df)
+    if len(dataset.df) <= n_old:
+        return None
+    key = ["NomorSurat", "KodeBarang", "Jumlah", "HargaSatuan"]
+    head = dataset.df.iloc[:n_old][key].reset_index(drop=True)
+    if not head.equals(previous.df[key].reset_index(drop=True)):
+        return None
+    return dataset.df.iloc[n_old:]
+
+
+def rescore_new_rows(previous, dataset, new_rows):
+    """
+    Skoring inkremental saat ingest/reload: baris baru dinilai memakai statistik versi
+    sebelumnya, lalu hasilnya dipindah ke versi dataset yang baru (tanpa membangun ulang).
+    Return False jika versi sebelumnya belum punya hasil anomali.
+    """
+    entry = previous.derived_cache.get("anomalies")
+    if entry is None or entry[0] != previous.version:
+        return False
+    existing = entry[1]
+    new_flags = score_anomalies(new_rows, existing["stats"])
+    flags = pd.concat([existing["flags"], new_flags]) if len(new_flags) else existing["flags"]
+    dataset.derived_cache["anomalies"] = (dataset.version, {"stats": existing["stats"], "flags": flags})
+    return True
+
+
+def carry_anomalies(previous, dataset):
+    """Pindahkan hasil anomali ke versi baru bila hanya ada baris tambahan → berhasil?"""
+    if previous is None:
+        return False
+    new_rows = appended_rows(previous, dataset)
+    return new_rows is not None and rescore_new_rows(previous, dataset, new_rows)
+
+
+anomaly_inflight = {}  # (nama, versi) dataset → Task build anomali yang sedang berjalan
+
+
+async def anomalies_for(dataset):
+    """
+    Hasil anomali untuk `dataset`. Build per versi dijalankan sekali (single-flight): job
+    background dan request yang datang selama build berjalan menunggu task yang sama.
+    """
+    entry = dataset.derived_cache.get("anomalies")
+    if entry is not None and entry[0] == dataset.version:
+        return entry[1]
+    key = (dataset.name, dataset.version)
+    task = anomaly_inflight.get(key)
+    if task is None:
+        token = active_dataset.set(dataset)
+        try:
+            # spawn: build tidak ikut deadline / pembatalan request yang kebetulan memicunya
+            task = spawn(asyncio.to_thread(cached_per_version, "anomalies", build_anomalies))
+        finally:
+            active_dataset.reset(token)
+        anomaly_inflight[key] = task
+        task.add_done_callback(lambda _: anomaly_inflight.pop(key, None))
+    # shield: request yang batal tidak membatalkan build milik penunggu lain
+    return await asyncio.shield(task)
+
+
+async def run_anomaly_job(dataset=None):
+    """Job background: hitung anomali di thread terpisah supaya event loop tetap responsif."""
+    dataset = dataset if dataset is not None else current()
+    try:
+        await anomalies_for(dataset)
+        print(f"[INFO] Deteksi anomali selesai untuk dataset {dataset.version}")
+    except Exception as e:
+        print(f"[ERROR] Job anomali: {e}")
+
+
+@app.get("/api/anomalies")
+async def get_anomalies(years: str = "all", unit: Optional[str] = None, unit_id: Optional[int] = None,
+                        jenis: Optional[str] = None, limit: int = Query(100, ge=1, le=ANOMALY_MAX_LIMIT)):
+    """
+    Transaksi dengan HargaSatuan menyimpang dari median barangnya atau Jumlah yang melonjak.
+    Contoh:
+      /api/anomalies?years=2024,2025
+      /api/anomalies?unit=baak&jenis=Harga
+    """
+    try:
+        selected_years = parse_years_param(years)
+        result = (await anomalies_for(current()))["flags"]
+
+        mask = result["Tahun"].isin(selected_years)
+        if unit_id is not None:
+            mask &= result["UnitID"] == unit_id
+        elif unit:
+            mask &= result["UnitPemohon"] == unit
+        if jenis:
+            mask &= result["Jenis"].str.lower() == jenis.lower()
+
+        filtered = result[mask]
+        # Satu transaksi bisa ter-flag dua kali (Harga & Jumlah) → urutkan posisional
+        order = np.argsort(-np.abs(filtered["Skor"].to_numpy(dtype=float)), kind="stable")[:limit]
+        top = filtered.iloc[order]
+
+        anomalies = []
+        for _, row in top.iterrows():
+            anomalies.append({
+                "Tanggal": row["Tanggal"].strftime("%Y-%m-%d") if pd.notna(row["Tanggal"]) else None,
+                "NomorSurat": str(row["NomorSurat"]),
+                "UnitID": int(row["UnitID"]),
+                "UnitPemohon": row["UnitPemohon"],
+                "ItemID": int(row["ItemID"]),
+                "KodeBarang": row["KodeBarang"],
+                "NamaBrg": row["NamaBrg"],
+                "Jenis": row["Jenis"],
+                "Jumlah": safe_float(row["Jumlah"]),
+                "HargaSatuan": safe_float(row["HargaSatuan"]),
+                "Median": round(safe_float(row["Median"]), 2),
+                "Skor": round(safe_float(row["Skor"]), 2),
+            })
+
+        return {"total": int(len(filtered)), "anomalies": anomalies}
+
+    except Exception as e:
+        uncacheable()
+        print(f"[ERROR] Anomalies ({years}): {e}")
+        import traceback
+        traceback.print_exc()
+        return {"total": 0, "anomalies": []}
+
+
 @app.get("/api/item-detail/{year}/{item_name}")
-async def get_item_detail_by_name(year: int, item_name: str):
+async def get_item_detail_by_name(year: int, item_name: str, period=Depends(date_range_param)):
     try:
         if year not in [2023, 2024, 2025]:
             return {"units": []}
@@ -832,38 +2786,68 @@ async def get_item_detail_by_name(year: int, item_name: str):
         original_item_name = decoded_item.replace("-", "/")
         
         # Filter data berdasarkan tahun dan nama barang ASLI
-        filtered = df[
-            (df["Tahun"] == year) &
-            (df["NamaBrg"] == original_item_name)  # <-- Gunakan nama asli!
-        ]
+        data = select_rows([year], period)
+        filtered = data[data["NamaBrg"] == original_item_name]  # <-- Gunakan nama asli!
         
         if filtered.empty:
             return {"units": []}
-            
-        # Group by UnitPemohon → jumlahkan Jumlah dan TotalHarga
-        unit_agg = (
-            filtered.groupby("UnitPemohon")
-            .agg(
-                Jumlah=("Jumlah", "sum"),
-                TotalPengeluaran=("TotalHarga", "sum")
-            )
-            .reset_index()
-            .sort_values("Jumlah", ascending=False)
-        )
-        units = []
-        for _, row in unit_agg.iterrows():
-            units.append({
-                "UnitPemohon": row["UnitPemohon"],
-                "Jumlah": int(row["Jumlah"]),
-                "TotalPengeluaran": float(row["TotalPengeluaran"])
-            })
-        return {"units": units}
+
+        return {"units": item_units_breakdown(filtered)}
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Item Detail for '{item_name}' in {year}: {e}")
         import traceback
         traceback.print_exc()
         return {"units": []}
 
+
+def item_units_breakdown(filtered):
+    """Group by UnitPemohon → jumlahkan Jumlah dan TotalHarga, urut dari Jumlah terbesar."""
+    unit_agg = (
+        filtered.groupby(["UnitID", "UnitPemohon"])
+        .agg(
+            Jumlah=("Jumlah", "sum"),
+            TotalPengeluaran=("TotalHarga", "sum")
+        )
+        .reset_index()
+        .sort_values("Jumlah", ascending=False)
+    )
+    units = []
+    for _, row in unit_agg.iterrows():
+        units.append({
+            "UnitID": int(row["UnitID"]),
+            "UnitPemohon": row["UnitPemohon"],
+            "Jumlah": int(row["Jumlah"]),
+            "TotalPengeluaran": float(row["TotalPengeluaran"])
+        })
+    return units
+
+
+@app.get("/api/item-detail-by-id/{year}/{item_id}")
+async def get_item_detail_by_id(year: int, item_id: int, period=Depends(date_range_param)):
+    """
+    Detail unit pemohon untuk satu barang berdasarkan ItemID (dari /api/all-items).
+    Baris barang diambil lewat indeks ItemID, bukan perbandingan string NamaBrg.
+    """
+    df = current().df
+    try:
+        rows = rows_for("item", item_id)
+        if len(rows) == 0:
+            return {"units": []}
+
+        item_rows = df.iloc[rows]
+        filtered = in_period(item_rows[item_rows["Tahun"] == year], period)
+        if filtered.empty:
+            return {"units": []}
+
+        return {"units": item_units_breakdown(filtered)}
+    except Exception as e:
+        uncacheable()
+        print(f"[ERROR] Item Detail for ItemID {item_id} in {year}: {e}")
+        import traceback
+        traceback.print_exc()
+        return {"units": []}
+
 # =====================================================
 # ✅ Endpoint 9: ChatBot Query (Dynamic)
 # =====================================================
@@ -889,6 +2873,7 @@ async def chatbot_query(question: str):
     Deteksi tahun otomatis dari kalimat.
     Jika tidak ada tahun, gunakan semua data.
     """
+    df = current().df
     try:
         # Ekstrak tahun dari kalimat
         years_in_question = []
@@ -903,9 +2888,11 @@ async def chatbot_query(question: str):
             target_year = years_in_question[0]  # Ambil tahun pertama
             data = df[df["Tahun"] == target_year].copy()
             year_label = f"tahun {target_year}"
+            scope_years = [target_year]
         else:
             data = df.copy()
             year_label = "semua tahun (2023–2025)"
+            scope_years = all_years()
 
         if data.empty:
             return {"answer": f"Tidak ada data untuk {year_label}."}
@@ -970,13 +2957,7 @@ async def chatbot_query(question: str):
 
         # 6. Tren Bulanan (Januari - Desember)
         elif "tren bulanan" in lower_q:
-            data["Tanggal"] = pd.to_datetime(
-                data["Tanggal"], dayfirst=True, errors="coerce")
-            data = data.dropna(subset=["Tanggal"])
-            data["Bulan"] = data["Tanggal"].dt.month
-            monthly = data.groupby("Bulan")["Jumlah"].sum().reindex(
-                range(1, 13), fill_value=0)
-            trend = [int(x) for x in monthly.tolist()]
+            trend = [int(x) for x in monthly_series(scope_years, "jumlah")]
             return {"answer": f"Tren pengeluaran bulanan {year_label}: {trend}"}
 
         # Default: tidak dikenali
@@ -994,6 +2975,7 @@ async def chatbot_query(question: str):
         }
 
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] ChatBot Query: {e}")
         return {"answer": "Maaf, terjadi kesalahan saat memproses pertanyaan Anda."}
 
@@ -1012,6 +2994,203 @@ def format_rupiah(value):
 
 import json
 
+# =====================================================
+# ✅ Panggilan LLM (OpenRouter): Single-Flight, Semaphore & Token Bucket
+# =====================================================
+LLM_MODEL = os.getenv("LLM_MODEL", "openai/gpt-4o-mini")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+# Maksimal request upstream yang berjalan bersamaan & yang boleh mengantre di belakangnya
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "16"))
+# Token bucket: rata-rata LLM_RATE_PER_MINUTE panggilan/menit (0 = tanpa batas rate), burst sampai LLM_BURST
+LLM_RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", "20"))
+LLM_BURST = int(os.getenv("LLM_BURST", "5"))
+# Antrean token lebih lama dari ini → langsung ditolak (429), tidak menunggu
+LLM_MAX_WAIT = float(os.getenv("LLM_MAX_WAIT", "10"))
+
+
+class LLMBusyError(Exception):
+    """Permintaan LLM ditolak karena batas rate/antrean terlampaui."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"LLM sibuk, coba lagi dalam {retry_after:.0f} detik")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Rate limiter token bucket. Token yang belum tersedia "dipesan" (saldo boleh negatif),
+    jadi pemanggil berikutnya otomatis mengantre di belakangnya; jika waktu tunggu
+    melebihi max_wait, pemanggil ditolak tanpa mengurangi saldo. rate ≤ 0 → tanpa batas rate.
+    """
+
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Detik sampai satu token tersedia untuk pemanggil berikutnya."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def reserve(self, max_wait):
+        """Pesan satu token → detik yang harus ditunggu; raise LLMBusyError jika terlalu lama."""
+        if self.rate <= 0:
+            return 0.0
+        wait = self.wait_time()
+        if wait > max_wait:
+            raise LLMBusyError(wait)
+        self.tokens -= 1
+        return wait
+
+    def refund(self):
+        """Kembalikan token pesanan pemanggil yang batal sebelum sempat memakai upstream."""
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+llm_bucket = TokenBucket(LLM_RATE_PER_MINUTE / 60.0, LLM_BURST)
+llm_inflight = {}   # kunci pertanyaan → {"task": Task upstream, "waiters": jumlah pemanggil}
+# Semaphore & AsyncClient terikat ke event loop → dibuat di lifespan (open_llm), bukan saat import
+# waiting = pemanggil yang menunggu token bucket maupun slot semaphore
+llm_state = {"client": None, "semaphore": None, "waiting": 0, "service_seconds": None}
+llm_stats = {"upstream": 0, "coalesced": 0, "rejected": 0, "errors": 0, "cancelled": 0}
+
+
+def open_llm():
+    """Dipanggil dari lifespan: satu AsyncClient bersama (pool dibatasi sama dengan semaphore)."""
+    import httpx  # hanya dibutuhkan untuk warm-up & chatbot → tidak ikut dimuat saat import
+
+    llm_state["semaphore"] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    llm_state["client"] = httpx.AsyncClient(
+        timeout=LLM_TIMEOUT,
+        limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY),
+    )
+
+
+async def close_llm():
+    if llm_state["client"] is not None:
+        await llm_state["client"].aclose()
+    llm_state.update(client=None, semaphore=None)
+
+
+def llm_context():
+    """Ringkasan data tahun terakhir sebagai konteks untuk model."""
+    latest = all_years()[-1] if all_years() else 2025
+    summary = get_dashboard_data(latest)
+    return (
+        f"Data permintaan barang (STARK), tahun {latest}: "
+        f"total permintaan {summary['total_requests']} unit, "
+        f"total pengeluaran {format_rupiah(summary['total_expenditure'])}, "
+        f"unit terbesar {[u['UnitPemohon'] for u in summary['top_units']]}, "
+        f"barang terbanyak {[i['NamaBrg'] for i in summary['top_items']]}."
+    )
+
+
+async def llm_upstream(question, context):
+    """Satu panggilan ke OpenRouter (di dalam batas semaphore)."""
+    res = await llm_state["client"].post(
+        OPENROUTER_URL,
+        headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}"},
+        json={
+            "model": LLM_MODEL,
+            "messages": [
+                {"role": "system", "content": (
+                    "Anda adalah Jarvis Bot, asisten dashboard permintaan barang (STARK). "
+                    "Jawab singkat dalam Bahasa Indonesia. " + context
+                )},
+                {"role": "user", "content": question},
+            ],
+        },
+    )
+    res.raise_for_status()
+    return res.json()["choices"][0]["message"]["content"].strip()
+
+
+def llm_retry_after():
+    """Perkiraan detik sampai antrean LLM punya ruang: token berikutnya vs antrean semaphore."""
+    per_call = llm_state["service_seconds"] or LLM_TIMEOUT / 2
+    queue_drain = (llm_state["waiting"] - LLM_MAX_QUEUE + 1) * per_call / LLM_MAX_CONCURRENCY
+    return max(1.0, llm_bucket.wait_time(), queue_drain)
+
+
+async def guarded_llm_call(question, context):
+    """Rate limit (token bucket) → antre semaphore → upstream."""
+    if llm_state["waiting"] >= LLM_MAX_QUEUE:
+        raise LLMBusyError(llm_retry_after())
+    wait = llm_bucket.reserve(LLM_MAX_WAIT)
+
+    semaphore = llm_state["semaphore"]
+    llm_state["waiting"] += 1
+    try:
+        await asyncio.sleep(wait)
+        await semaphore.acquire()
+    except asyncio.CancelledError:
+        # Batal sebelum upstream dipanggil → token tidak terpakai, kapasitas jendela berikutnya utuh
+        llm_bucket.refund()
+        raise
+    finally:
+        llm_state["waiting"] -= 1
+    started = time.monotonic()
+    try:
+        llm_stats["upstream"] += 1
+        return await llm_upstream(question, context)
+    finally:
+        semaphore.release()
+        elapsed = time.monotonic() - started
+        previous = llm_state["service_seconds"]
+        llm_state["service_seconds"] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+
+
+async def get_answer_from_openrouter(question, data=None):
+    """
+    Jawaban LLM untuk pertanyaan umum. Pertanyaan identik (per versi dataset) yang datang
+    bersamaan berbagi satu panggilan upstream. Raise LLMBusyError jika ditolak limiter;
+    return None jika upstream gagal atau LLM tidak dikonfigurasi (OPENROUTER_API_KEY kosong).
+    """
+    if not OPENROUTER_API_KEY or llm_state["client"] is None:
+        return None
+    key = (current().version, " ".join(question.lower().split()))
+    call = llm_inflight.get(key)
+    if call is None:
+        task = asyncio.create_task(guarded_llm_call(question, llm_context()))
+        call = llm_inflight[key] = {"task": task, "waiters": 0}
+        task.add_done_callback(lambda _: llm_inflight.pop(key, None))
+    else:
+        llm_stats["coalesced"] += 1
+
+    call["waiters"] += 1
+    try:
+        # shield: pemanggil yang batal tidak membatalkan panggilan milik pemanggil lain
+        return await asyncio.shield(call["task"])
+    except asyncio.CancelledError:
+        # Pemanggil terakhir pergi (klien terputus/deadline) → request httpx upstream ikut dibatalkan
+        if call["waiters"] == 1 and not call["task"].done():
+            call["task"].cancel()
+            llm_stats["cancelled"] += 1
+        raise
+    except LLMBusyError:
+        llm_stats["rejected"] += 1
+        raise
+    except Exception as e:
+        llm_stats["errors"] += 1
+        print(f"[ERROR] OpenRouter: {e}")
+        return None
+    finally:
+        call["waiters"] -= 1
+
+
 @app.post("/api/chatbot-ai")
 async def chatbot_query_post(request: ChatRequest):
     """
@@ -1019,6 +3198,7 @@ async def chatbot_query_post(request: ChatRequest):
     - Jika pertanyaan terkait data → cari jawaban dari database
     - Jika pertanyaan umum lainnya → gunakan AI OpenRouter
     """
+    df = current().df
     try:
         question = request.question.strip()
         if not question:
@@ -1050,19 +3230,28 @@ async def chatbot_query_post(request: ChatRequest):
             target_year = years_in_question[0]
             data = df[df["Tahun"] == target_year].copy()
             year_label = f"tahun {target_year}"
+            scope_years = [target_year]
         else:
             data = df.copy()
             year_label = "semua tahun"
+            scope_years = all_years()
 
         # ===== STEP 2: Coba jawab dari database terlebih dahulu =====
         lower_q = question.lower()
-        db_answer = try_answer_from_database(question, data, year_label, lower_q)
+        db_answer = try_answer_from_database(question, data, year_label, lower_q, scope_years)
         if db_answer:
             return {"answer": db_answer}
 
         # ===== STEP 3: Jika tidak cocok dengan database, gunakan AI =====
         print(f"[INFO] Menggunakan OpenRouter AI untuk pertanyaan: {question}")
-        ai_answer = await get_answer_from_openrouter(question, df)
+        try:
+            ai_answer = await get_answer_from_openrouter(question, df)
+        except LLMBusyError as busy:
+            return JSONResponse(
+                status_code=429,
+                content={"answer": "Maaf, Jarvis Bot sedang melayani banyak pertanyaan 🙏. Silakan coba lagi sebentar lagi."},
+                headers={"Retry-After": str(int(busy.retry_after) + 1)},
+            )
         
         if ai_answer:
             return {"answer": ai_answer}
@@ -1091,11 +3280,15 @@ def handle_greeting(question):
         return "Waalaikumsalam! 👋 Saya Jarvis Bot. Siap membantu Anda dengan data permintaan, tren, atau barang terlaris. Silakan tanyakan!"
     return None
 
-def try_answer_from_database(question, data, year_label, lower_q):
+def try_answer_from_database(question, data, year_label, lower_q, years=None):
     """
     Coba jawab pertanyaan dari database menggunakan pattern matching
+    `years`: tahun yang dicakup `data` (untuk time-series bulanan), default semua tahun
     Return: string (jawaban) atau None (jika tidak cocok)
     """
+    df = current().df
+    if years is None:
+        years = all_years()
     # ===== PERTANYAAN TENTANG SISTEM STARK & ABOUT ===== ✅
     
     # 1. Apa itu STARK?
@@ -1459,25 +3652,14 @@ def try_answer_from_database(question, data, year_label, lower_q):
 
     # 9. Tren Permintaan Bulanan
     elif any(keyword in lower_q for keyword in ["tren permintaan", "pola permintaan", "grafik permintaan", "permintaan bulanan"]):
-        if "Tanggal" not in data.columns or data["Tanggal"].isna().all():
-            return f"Data tanggal tidak tersedia untuk {year_label}."
-        
-        data["Tanggal"] = pd.to_datetime(data["Tanggal"], dayfirst=True, errors="coerce")
-        data = data.dropna(subset=["Tanggal"])
-        
-        if data.empty:
+        monthly = monthly_active(years, "jumlah")
+        if monthly.empty:
             return f"Tidak ada data tanggal yang valid untuk {year_label}."
-        
-        data["Bulan"] = data["Tanggal"].dt.month
-        
-        monthly = data.groupby("Bulan")["Jumlah"].sum()
-        bulan_nama = ["Januari", "Februari", "Maret", "April", "Mei", "Juni", 
-                      "Juli", "Agustus", "September", "Oktober", "November", "Desember"]
-        
+
         bulan_min = monthly.idxmin()
         nilai_min = int(monthly.min())
         
-        return f"Bulan dengan permintaan terendah {year_label} adalah {bulan_nama[bulan_min - 1]} dengan {nilai_min:,} unit."
+        return f"Bulan dengan permintaan terendah {year_label} adalah {BULAN_NAMA[bulan_min - 1]} dengan {nilai_min:,} unit."
 
     # 13. Top 5 Barang Terlaris
     elif any(keyword in lower_q for keyword in ["top 5 barang", "5 barang terlaris", "lima barang", "daftar barang terlaris"]):
@@ -1535,21 +3717,14 @@ def try_answer_from_database(question, data, year_label, lower_q):
 
     # 12. Bulan Terendah
     elif any(keyword in lower_q for keyword in ["bulan terendah", "bulan tersedikit", "bulan sepi", "lowest month"]):
-        if "Tanggal" not in data.columns or data["Tanggal"].isna().all():
+        monthly = monthly_active(years, "jumlah")
+        if monthly.empty:
             return f"Data tanggal tidak tersedia untuk {year_label}."
-        
-        data["Tanggal"] = pd.to_datetime(data["Tanggal"], dayfirst=True, errors="coerce")
-        data = data.dropna(subset=["Tanggal"])
-        data["Bulan"] = data["Tanggal"].dt.month
-        
-        monthly = data.groupby("Bulan")["Jumlah"].sum()
-        bulan_nama = ["Januari", "Februari", "Maret", "April", "Mei", "Juni", 
-                      "Juli", "Agustus", "September", "Oktober", "November", "Desember"]
-        
+
         bulan_min = monthly.idxmin()
         nilai_min = int(monthly.min())
         
-        return f"Bulan dengan permintaan terendah {year_label} adalah {bulan_nama[bulan_min - 1]} dengan {nilai_min:,} unit."
+        return f"Bulan dengan permintaan terendah {year_label} adalah {BULAN_NAMA[bulan_min - 1]} dengan {nilai_min:,} unit."
 
     # 13. Top 5 Barang Terlaris
     elif any(keyword in lower_q for keyword in ["top 5 barang", "5 barang terlaris", "lima barang", "daftar barang terlaris"]):
@@ -1608,7 +3783,7 @@ def try_answer_from_database(question, data, year_label, lower_q):
     # Tidak cocok dengan database pattern
     # 9. Tren Permintaan Bulanan
     elif any(keyword in lower_q for keyword in ["tren permintaan", "pola permintaan", "grafik permintaan", "permintaan bulanan"]):
-        monthly = data.groupby("Bulan")["Jumlah"].sum().reindex(range(1, 13), fill_value=0)
+        monthly = pd.Series(monthly_series(years, "jumlah"), index=range(1, 13))
         
         bulan_nama = ["Jan", "Feb", "Mar", "Apr", "Mei", "Jun", "Jul", "Agu", "Sep", "Oct", "Nov", "Des"]
         trend_text = "\n".join([f"- {bulan_nama[i]}: {int(monthly.iloc[i]):,} unit" for i in range(12)])
@@ -1626,17 +3801,10 @@ def try_answer_from_database(question, data, year_label, lower_q):
 
     # 10. Tren Pengeluaran Bulanan
     elif any(keyword in lower_q for keyword in ["tren pengeluaran", "pola pengeluaran", "grafik pengeluaran", "pengeluaran bulanan"]):
-        if "Tanggal" not in data.columns or data["Tanggal"].isna().all():
-            return f"Data tanggal tidak tersedia untuk {year_label}."
-        
-        data["Tanggal"] = pd.to_datetime(data["Tanggal"], dayfirst=True, errors="coerce")
-        data = data.dropna(subset=["Tanggal"])
-        
-        if data.empty:
+        if monthly_active(years, "total").empty:
             return f"Tidak ada data tanggal yang valid untuk {year_label}."
-        
-        data["Bulan"] = data["Tanggal"].dt.month
-        monthly = data.groupby("Bulan")["TotalHarga"].sum().reindex(range(1, 13), fill_value=0)
+
+        monthly = pd.Series(monthly_series(years, "total"), index=range(1, 13))
         
         bulan_nama = ["Jan", "Feb", "Mar", "Apr", "Mei", "Jun", "Jul", "Agu", "Sep", "Oct", "Nov", "Des"]
         trend_text = "\n".join([f"- {bulan_nama[i]}: {format_rupiah(monthly.iloc[i])}" for i in range(12)])
@@ -1654,106 +3822,58 @@ def try_answer_from_database(question, data, year_label, lower_q):
 
     # 11. Bulan Tertinggi
     elif any(keyword in lower_q for keyword in ["bulan tertinggi", "bulan terbanyak", "bulan puncak", "peak month"]):
-        if "Tanggal" not in data.columns or data["Tanggal"].isna().all():
+        monthly = monthly_active(years, "jumlah")
+        if monthly.empty:
             return f"Data tanggal tidak tersedia untuk {year_label}."
-        
-        data["Tanggal"] = pd.to_datetime(data["Tanggal"], dayfirst=True, errors="coerce")
-        data = data.dropna(subset=["Tanggal"])
-        data["Bulan"] = data["Tanggal"].dt.month
-        
-        monthly = data.groupby("Bulan")["Jumlah"].sum()
-        bulan_nama = ["Januari", "Februari", "Maret", "April", "Mei", "Juni", 
-                      "Juli", "Agustus", "September", "Oktober", "November", "Desember"]
-        
+
         bulan_max = monthly.idxmax()
         nilai_max = int(monthly.max())
         
-        return f"Bulan dengan permintaan tertinggi {year_label} adalah {bulan_nama[bulan_max - 1]} dengan {nilai_max:,} unit."
+        return f"Bulan dengan permintaan tertinggi {year_label} adalah {BULAN_NAMA[bulan_max - 1]} dengan {nilai_max:,} unit."
 
     # 12. Bulan Terendah
     elif any(keyword in lower_q for keyword in ["bulan terendah", "bulan tersedikit", "bulan sepi", "lowest month"]):
-        if "Tanggal" not in data.columns or data["Tanggal"].isna().all():
+        monthly = monthly_active(years, "jumlah")
+        if monthly.empty:
             return f"Data tanggal tidak tersedia untuk {year_label}."
-        
-        data["Tanggal"] = pd.to_datetime(data["Tanggal"], dayfirst=True, errors="coerce")
-        data = data.dropna(subset=["Tanggal"])
-        data["Bulan"] = data["Tanggal"].dt.month
+
+        bulan_min = monthly.idxmin()
+        nilai_min = int(monthly.min())
+
+        return f"Bulan dengan permintaan terendah {year_label} adalah {BULAN_NAMA[bulan_min - 1]} dengan {nilai_min:,} unit."
 
 # === Endpoint: Daftar Semua Unit Pemohon dengan Segmen & Kategori ===
 
 @app.get("/api/unit-pemohon-list/{year}")
-async def get_unit_pemohon_list(year: int):
+async def get_unit_pemohon_list(year: int, period=Depends(date_range_param)):
     try:
         # === Validasi tahun (opsional tapi bagus) ===
         if year not in [2023, 2024, 2025]:
             return {"units": []}
 
-        # Filter data untuk tahun tertentu
-        data = df[df["Tahun"] == year].copy()
-        if data.empty:
-            return {"units": []}
-
-        # Agregasi per UnitPemohon
-        unit_agg = (
-            data.groupby("UnitPemohon")
-            .agg(
-                TotalPermintaan=("Jumlah", "sum"),
-                TotalPengeluaran=("TotalHarga", "sum"),
-                Kategori=("Kategori", "first")
-            )
-            .reset_index()
-            .fillna({"Kategori": "Lainnya"})
-        )
-
-        if unit_agg.empty:
+        # Total, kategori & segmen per unit dengan ambang batas tahun ini (cache per tahun)
+        units = unit_profile([year], period)["units"]
+        if units.empty:
             return {"units": []}
 
-        # === Hitung ambang batas berdasarkan data tahun ini ===
-        permintaan_vals = unit_agg["TotalPermintaan"]
-        pengeluaran_vals = unit_agg["TotalPengeluaran"]
-
-        # Jika hanya 1 unit, semua jadi "Sedang" secara default
-        if len(unit_agg) == 1:
-            p33 = p66 = permintaan_vals.iloc[0]
-            e33 = e66 = pengeluaran_vals.iloc[0]
-        else:
-            p33, p66 = permintaan_vals.quantile(0.33), permintaan_vals.quantile(0.66)
-            e33, e66 = pengeluaran_vals.quantile(0.33), pengeluaran_vals.quantile(0.66)
-
-        result = []
-        for _, row in unit_agg.iterrows():
-            total_permintaan = row["TotalPermintaan"]
-            total_pengeluaran = row["TotalPengeluaran"]
-
-            # Klasifikasi Permintaan → LabelSegmen
-            if total_permintaan >= p66:
-                label_segmen = "Tinggi"
-            elif total_permintaan >= p33:
-                label_segmen = "Sedang"
-            else:
-                label_segmen = "Rendah"
-
-            # Klasifikasi Pengeluaran → Segmen
-            if total_pengeluaran >= e66:
-                segmen = "Boros"
-            elif total_pengeluaran >= e33:
-                segmen = "Sedang"
-            else:
-                segmen = "Hemat"
-
-            result.append({
-                "UnitPemohon": row["UnitPemohon"],
-                "TotalPermintaan": int(total_permintaan),
-                "TotalPengeluaran": float(total_pengeluaran),
+        result = [
+            {
+                "UnitID": int(row["UnitID"]),
+                "UnitPemohon": unit,
+                "TotalPermintaan": int(row["TotalPermintaan"]),
+                "TotalPengeluaran": float(row["TotalPengeluaran"]),
                 "Kategori": str(row["Kategori"]),
-                "Segmen": segmen,
-                "LabelSegmen": label_segmen,
+                "Segmen": row["Segmen"],
+                "LabelSegmen": row["LabelSegmen"],
                 "Tahun": year
-            })
+            }
+            for unit, row in units.iterrows()
+        ]
 
         return {"units": result}
 
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Unit Pemohon List ({year}): {e}")
         import traceback
         traceback.print_exc()
@@ -1761,159 +3881,428 @@ async def get_unit_pemohon_list(year: int):
        
 # === Endpoint: Detail Barang Bulanan per Unit & Tahun ===
 @app.get("/api/unit-item-monthly")
-async def get_unit_item_monthly(unit: str, year: int):
+async def get_unit_item_monthly(unit: str, year: int, period=Depends(date_range_param)):
+    id_index = current().id_index
     try:
-        data = df[
-            (df["UnitPemohon"] == unit) &
-            (df["Tahun"] == year)
-        ].copy()
+        # Nama unit → UnitID lewat dictionary, lalu ambil barisnya dari indeks
+        unit_id = id_index["unit_to_id"].get(unit, -1)
+        return {"items": unit_items_monthly(unit_id, year, period)}
 
-        if data.empty:
-            return {"items": []}
+    except Exception as e:
+        uncacheable()
+        print(f"[ERROR] Unit Item Monthly ({unit}, {year}): {e}")
+        return {"items": []}
 
-        data["Tanggal"] = pd.to_datetime(
-            data["Tanggal"], dayfirst=True, errors="coerce")
-        data = data.dropna(subset=["Tanggal"])
-        data["Bulan"] = data["Tanggal"].dt.month
 
-        monthly_agg = data.groupby(["NamaBrg", "Bulan"])[
-            "Jumlah"].sum().reset_index()
-        pivot = monthly_agg.pivot(
-            index="NamaBrg", columns="Bulan", values="Jumlah").fillna(0)
+@app.get("/api/unit-item-monthly-by-id/{year}/{unit_id}")
+async def get_unit_item_monthly_by_id(year: int, unit_id: int, period=Depends(date_range_param)):
+    """
+    Sama dengan /api/unit-item-monthly, tetapi unit dipilih lewat UnitID
+    (dari /api/unit-pemohon-list atau /api/unit-scatter-data).
+    """
+    try:
+        return {"items": unit_items_monthly(unit_id, year, period)}
 
-        for bulan in range(1, 13):
-            if bulan not in pivot.columns:
-                pivot[bulan] = 0
-        pivot = pivot.reindex(sorted(pivot.columns), axis=1)
+    except Exception as e:
+        uncacheable()
+        print(f"[ERROR] Unit Item Monthly (UnitID {unit_id}, {year}): {e}")
+        return {"items": []}
 
-        items = []
-        for nama_brg in pivot.index:
-            bulan_data = [int(pivot.loc[nama_brg, bulan])
-                          for bulan in range(1, 13)]
-            total = sum(bulan_data)
-            items.append({
-                "NamaBarang": nama_brg,
-                "Total": total,
-                "Bulanan": bulan_data  # [Jan, Feb, ..., Des]
-            })
 
-        items.sort(key=lambda x: x["Total"], reverse=True)
-        return {"items": items}
+def unit_items_monthly(unit_id, year, period=(None, None)):
+    """Pivot NamaBrg × Bulan (Jan–Des) untuk satu unit & tahun, urut dari total terbesar."""
+    df = current().df
+    unit_rows = df.iloc[rows_for("unit", unit_id)]
+    data = in_period(unit_rows[unit_rows["Tahun"] == year], period).copy()
 
-    except Exception as e:
-        print(f"[ERROR] Unit Item Monthly ({unit}, {year}): {e}")
-        return {"items": []}
+    if data.empty:
+        return []
+
+    # Tanggal sudah datetime sejak load → cukup buang yang kosong
+    data = data.dropna(subset=["Tanggal"])
+    data["Bulan"] = data["Tanggal"].dt.month
+
+    monthly_agg = data.groupby(["NamaBrg", "Bulan"])[
+        "Jumlah"].sum().reset_index()
+    pivot = monthly_agg.pivot(
+        index="NamaBrg", columns="Bulan", values="Jumlah").fillna(0)
+
+    for bulan in range(1, 13):
+        if bulan not in pivot.columns:
+            pivot[bulan] = 0
+    pivot = pivot.reindex(sorted(pivot.columns), axis=1)
+
+    items = []
+    for nama_brg in pivot.index:
+        bulan_data = [int(pivot.loc[nama_brg, bulan])
+                      for bulan in range(1, 13)]
+        total = sum(bulan_data)
+        items.append({
+            "NamaBarang": nama_brg,
+            "Total": total,
+            "Bulanan": bulan_data  # [Jan, Feb, ..., Des]
+        })
+
+    items.sort(key=lambda x: x["Total"], reverse=True)
+    return items
 # === Endpoint: Data untuk Scatter Plot (semua unit) ===
 # === Endpoint: Data untuk Scatter Plot (semua unit) DENGAN FILTER TAHUN ===
 
 
 @app.get("/api/unit-scatter-data")
-async def get_unit_scatter_data(years: str = "all"):
+async def get_unit_scatter_data(years: str = "all", period=Depends(date_range_param)):
     try:
         # Parse tahun dari parameter
         selected_years = parse_years_param(years)
         if not selected_years:
             return {"units": []}
 
-        # Filter data berdasarkan tahun yang dipilih
-        data = df[df["Tahun"].isin(selected_years)].copy()
-        if data.empty:
-            return {"units": []}
+        # Segmen berdasarkan ambang batas dari tahun yang dipilih (sumber yang sama dengan daftar unit)
+        units = unit_profile(selected_years, period)["units"]
+        result = [
+            {
+                "UnitID": int(row["UnitID"]),
+                "UnitPemohon": unit,
+                "TotalPermintaan": int(row["TotalPermintaan"]),
+                "TotalPengeluaran": float(row["TotalPengeluaran"]),
+                "Segmen": row["Segmen"]
+            }
+            for unit, row in units.iterrows()
+        ]
+        return {"units": result}
+    except Exception as e:
+        uncacheable()
+        print(f"[ERROR] Scatter Data ({years}): {e}")
+        import traceback
+        traceback.print_exc()
+        return {"units": []}
+
+
+# =====================================================
+# ✅ Matriks Unit × Barang (sparse) & Unit Serupa
+# =====================================================
+SIMILARITY_METRICS = ["Jumlah", "TotalHarga"]
+SIMILARITY_MAX_K = 50
+
+
+def build_unit_item_matrix(years, metric="Jumlah"):
+    """
+    Matriks sparse unit × barang (format CSR dengan array numpy) berisi total `metric`
+    per (UnitID, ItemID) untuk subset tahun. Baris dinormalisasi L2 sehingga
+    perkalian baris = cosine similarity.
+    """
+    df = current().df
+    id_index = current().id_index
+    n_units, n_items = len(id_index["unit_names"]), len(id_index["item_codes"])
+    positions = select_positions(years)
+
+    # Kunci (unit, barang) → np.unique mengurutkan per unit lalu barang = urutan CSR
+    keys = df["UnitID"].to_numpy(dtype=np.int64)[positions] * n_items + df["ItemID"].to_numpy()[positions]
+    cells, inverse = np.unique(keys, return_inverse=True)
+    values = np.bincount(inverse, weights=df[metric].to_numpy(dtype=float)[positions])
+    rows, cols = cells // n_items, cells % n_items
+
+    norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=n_units))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normalized = np.where(norms[rows] > 0, values / norms[rows], 0.0)
+
+    return {
+        "indptr": np.searchsorted(rows, np.arange(n_units + 1)),
+        "rows": rows,
+        "cols": cols,
+        "values": values,
+        "normalized": normalized,
+        "n_items": n_items,
+    }
+
+
+def unit_item_matrix(years, metric="Jumlah"):
+    years = cache_years(years)
+    return cached_per_version(f"unit_item:{years}:{metric}", lambda: build_unit_item_matrix(years, metric))
+
+
+def similar_units(unit_id, years, metric="Jumlah", k=5):
+    """
+    Top-k unit paling mirip dengan `unit_id` (cosine). Hasil kali matriks-vektor sparse:
+    vektor unit dijadikan dense sepanjang jumlah barang, lalu setiap nonzero matriks
+    dikalikan dan dijumlah per baris dengan bincount — O(nnz), tanpa loop antar-unit.
+    """
+    matrix = unit_item_matrix(years, metric)
+    start, end = matrix["indptr"][unit_id], matrix["indptr"][unit_id + 1]
+    if start == end:
+        return []
+
+    query = np.zeros(matrix["n_items"])
+    query[matrix["cols"][start:end]] = matrix["normalized"][start:end]
+    n_units = len(matrix["indptr"]) - 1
+    contrib = matrix["normalized"] * query[matrix["cols"]]
+    scores = np.bincount(matrix["rows"], weights=contrib, minlength=n_units)
+    shared = np.bincount(matrix["rows"], weights=contrib > 0, minlength=n_units)
+    scores[unit_id] = -1.0
+
+    candidates = np.flatnonzero(scores > 0)
+    top = candidates[np.argsort(-scores[candidates], kind="stable")][:k]
+
+    item_dim = current().id_index["item_dim"]
+    result = []
+    for other in top:
+        lo, hi = matrix["indptr"][other], matrix["indptr"][other + 1]
+        # Barang bersama dengan kontribusi terbesar → kandidat pengadaan gabungan
+        best = np.argsort(-contrib[lo:hi], kind="stable")[:3]
+        result.append({
+            "UnitID": int(other),
+            "UnitPemohon": current().id_index["unit_names"][other],
+            "Similarity": round(float(scores[other]), 4),
+            "JumlahBarangSama": int(shared[other]),
+            "BarangUtamaSama": [
+                item_dim.iloc[matrix["cols"][lo + i]]["NamaBrg"] for i in best if contrib[lo + i] > 0
+            ],
+        })
+    return result
+
+
+@app.get("/api/similar-units")
+async def get_similar_units(
+    unit: Optional[str] = None,
+    unit_id: Optional[int] = None,
+    years: str = "all",
+    metric: str = "Jumlah",
+    k: int = 5,
+):
+    """
+    Unit dengan pola permintaan barang paling mirip (cosine similarity pada vektor barang),
+    mis. untuk menggabungkan pesanan.
+    Contoh:
+      /api/similar-units?unit=baak&years=2024,2025
+      /api/similar-units?unit_id=12&metric=TotalHarga&k=10
+    """
+    if metric not in SIMILARITY_METRICS:
+        raise HTTPException(status_code=400, detail=f"metric harus salah satu dari {SIMILARITY_METRICS}")
+
+    try:
+        unit_names = current().id_index["unit_names"]
+        if unit_id is None:
+            unit_id = current().id_index["unit_to_id"].get(unit, -1)
+        if unit_id < 0 or unit_id >= len(unit_names):
+            return {"unit": unit, "similar": []}
+
+        k = max(1, min(k, SIMILARITY_MAX_K))
+        return {
+            "unit": unit_names[unit_id],
+            "unitId": int(unit_id),
+            "metric": metric,
+            "similar": similar_units(unit_id, parse_years_param(years), metric, k),
+        }
+
+    except Exception as e:
+        uncacheable()
+        print(f"[ERROR] Similar Units ({unit or unit_id}): {e}")
+        import traceback
+        traceback.print_exc()
+        return {"unit": unit, "similar": []}
+
+
+# =====================================================
+# ✅ Klaster Unit (k-means pada fitur radar)
+# =====================================================
+CLUSTER_DEFAULT_K = 4
+CLUSTER_MAX_K = 8
+CLUSTER_N_INIT = 10
+CLUSTER_MAX_ITER = 100
+CLUSTER_SEED = 42  # deterministik: unit yang sama selalu masuk klaster yang sama
+
+FEATURE_NAMES = {
+    "TotalPengeluaran": "anggaran",
+    "TotalPermintaan": "volume",
+    "RataHarga": "biaya per item",
+    "Efisiensi": "efisiensi",
+    "Frekuensi": "frekuensi",
+    "Keragaman": "diversitas",
+}
+# Pola klaster yang sudah dikenal dashboard: arah di ruang fitur terstandardisasi.
+# "Umum" = klaster paling dekat ke rata-rata.
+CLUSTER_ARCHETYPES = {
+    "Hemat & Efisien": {"TotalPengeluaran": -1, "Efisiensi": 1},
+    "Boros & Tidak Efisien": {"TotalPengeluaran": 1, "Efisiensi": -1},
+    "Multikategori": {"Keragaman": 1},
+}
+
+
+def kmeans(X, k, n_init=CLUSTER_N_INIT, max_iter=CLUSTER_MAX_ITER, seed=CLUSTER_SEED):
+    """
+    K-means (Lloyd) vectorised untuk semua titik sekaligus, inisialisasi k-means++,
+    `n_init` kali dengan seed tetap; hasil dengan inertia terkecil dipakai.
+    Return: (labels, centroids, inertia).
+    """
+    rng = np.random.default_rng(seed)
+    best = None
+    for _ in range(n_init):
+        centroids = X[[rng.integers(len(X))]]
+        for _ in range(1, k):
+            d2 = ((X[:, None, :] - centroids[None]) ** 2).sum(axis=2).min(axis=1)
+            p = d2 / d2.sum() if d2.sum() > 0 else None
+            centroids = np.vstack([centroids, X[rng.choice(len(X), p=p)]])
+
+        for _ in range(max_iter):
+            dist = ((X[:, None, :] - centroids[None]) ** 2).sum(axis=2)
+            labels = dist.argmin(axis=1)
+            counts = np.bincount(labels, minlength=k)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, X)
+            # Klaster kosong mempertahankan centroid lamanya
+            updated = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centroids)
+            if np.allclose(updated, centroids):
+                break
+            centroids = updated
+
+        dist = ((X[:, None, :] - centroids[None]) ** 2).sum(axis=2)
+        labels = dist.argmin(axis=1)
+        inertia = float(dist[np.arange(len(X)), labels].sum())
+        if best is None or inertia < best[2]:
+            best = (labels, centroids, inertia)
+    return best
+
+
+def describe_centroid(z):
+    """Dua fitur paling menonjol dari centroid terstandardisasi, mis. 'anggaran tinggi, efisiensi rendah'."""
+    top = np.argsort(-np.abs(z), kind="stable")[:2]
+    return ", ".join(
+        f"{FEATURE_NAMES[RADAR_FEATURES[i]]} {'tinggi' if z[i] > 0 else 'rendah'}" for i in top
+    ).capitalize()
+
+
+def label_clusters(centroids_z):
+    """
+    Nama klaster: klaster terdekat ke rata-rata → "Umum", sisanya dipasangkan secara greedy
+    ke pola CLUSTER_ARCHETYPES dengan cosine tertinggi; kelebihan klaster memakai deskripsinya.
+    """
+    k = len(centroids_z)
+    labels = [None] * k
+    labels[int(np.argmin(np.linalg.norm(centroids_z, axis=1)))] = "Umum"
+
+    names = list(CLUSTER_ARCHETYPES)
+    directions = np.array([
+        [CLUSTER_ARCHETYPES[name].get(f, 0) for f in RADAR_FEATURES] for name in names
+    ], dtype=float)
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    norms = np.maximum(np.linalg.norm(centroids_z, axis=1, keepdims=True), 1e-12)
+    cosine = (centroids_z / norms) @ directions.T
+
+    pairs = sorted(((cosine[c, a], c, a) for c in range(k) for a in range(len(names))), reverse=True)
+    used = set()
+    for score, c, a in pairs:
+        if labels[c] is None and a not in used and score > 0:
+            labels[c] = names[a]
+            used.add(a)
+    return [label or describe_centroid(centroids_z[c]) for c, label in enumerate(labels)]
+
+
+def build_unit_clusters(years, period=(None, None), k=CLUSTER_DEFAULT_K, profile=None):
+    """
+    Fitur radar per unit (unit_profile) → log1p (fitur sangat menceng) → z-score →
+    k-means untuk semua unit sekaligus. Centroid dikembalikan dalam skala asli & terstandardisasi.
+    `profile` = hasil unit_profile yang sudah dihitung pemanggil untuk subset yang sama.
+    """
+    if profile is None:
+        profile = unit_profile(years, period)
+    units = profile["units"]
+    if units.empty:
+        return {"units": units.index, "labels": np.array([], dtype=int), "clusters": []}
+
+    raw = units[RADAR_FEATURES].to_numpy(dtype=float)
+    logged = np.log1p(np.clip(raw, 0, None))
+    mean, std = logged.mean(axis=0), logged.std(axis=0)
+    std[std == 0] = 1.0
+    X = (logged - mean) / std
+
+    k = max(1, min(k, len(X)))
+    labels, centroids_z, inertia = kmeans(X, k)
+    names = label_clusters(centroids_z)
+    centroids = np.expm1(centroids_z * std + mean)
+    sizes = np.bincount(labels, minlength=k)
+
+    clusters = [
+        {
+            "cluster": c,
+            "label": names[c],
+            "description": describe_centroid(centroids_z[c]),
+            "size": int(sizes[c]),
+            "centroid": {f: round(float(v), 2) for f, v in zip(RADAR_FEATURES, centroids[c])},
+            "centroidZ": {f: round(float(v), 3) for f, v in zip(RADAR_FEATURES, centroids_z[c])},
+        }
+        for c in range(k)
+    ]
+    return {"units": units.index, "unit_ids": units["UnitID"].to_numpy(), "labels": labels,
+            "clusters": clusters, "inertia": inertia}
+
 
-        # Hitung ambang batas global berdasarkan data yang difilter
-        all_units_agg = data.groupby("UnitPemohon").agg(
-            TotalPengeluaran=("TotalHarga", "sum")
-        )
-        if all_units_agg.empty:
-            return {"units": []}
+def unit_clusters(years, period=(None, None), k=CLUSTER_DEFAULT_K, profile=None):
+    """Klaster unit dengan cache per subset tahun & k (rentang tanggal sembarang tidak di-cache)."""
+    years = cache_years(years)
+    if period == (None, None):
+        return cached_per_version(f"unit_clusters:{years}:{k}", lambda: build_unit_clusters(years, k=k))
+    return build_unit_clusters(years, period, k, profile)
 
-        e33 = all_units_agg["TotalPengeluaran"].quantile(0.33)
-        e66 = all_units_agg["TotalPengeluaran"].quantile(0.66)
 
-        # Agregasi utama berdasarkan data yang difilter
-        agg = data.groupby("UnitPemohon").agg(
-            TotalPermintaan=("Jumlah", "sum"),
-            TotalPengeluaran=("TotalHarga", "sum")
-        ).reset_index()
+@app.get("/api/unit-clusters")
+async def get_unit_clusters(years: str = "all", period=Depends(date_range_param), k: int = CLUSTER_DEFAULT_K):
+    """
+    Segmentasi perilaku unit dengan k-means pada 6 fitur radar
+    (anggaran, volume, biaya per item, efisiensi, frekuensi, diversitas).
+    Contoh:
+      /api/unit-clusters?years=all
+      /api/unit-clusters?years=2024,2025&k=5
+    """
+    try:
+        k = max(2, min(k, CLUSTER_MAX_K))
+        result = unit_clusters(parse_years_param(years), period, k)
+        clusters = result["clusters"]
+        members = {c["cluster"]: [] for c in clusters}
+        for unit, unit_id, label in zip(result["units"], result.get("unit_ids", []), result["labels"]):
+            members[int(label)].append({"UnitID": int(unit_id), "UnitPemohon": unit})
+
+        return {
+            "k": len(clusters),
+            "features": RADAR_FEATURES,
+            "clusters": [{**c, "units": members[c["cluster"]]} for c in clusters],
+        }
 
-        result = []
-        for _, row in agg.iterrows():
-            total_pengeluaran = safe_float(row["TotalPengeluaran"])
-            # Klasifikasi segmen berdasarkan ambang batas dari data yang difilter
-            if total_pengeluaran >= e66:
-                segmen = "Boros"
-            elif total_pengeluaran >= e33:
-                segmen = "Sedang"
-            else:
-                segmen = "Hemat"
-            result.append({
-                "UnitPemohon": row["UnitPemohon"],
-                "TotalPermintaan": int(row["TotalPermintaan"]),
-                "TotalPengeluaran": float(row["TotalPengeluaran"]),
-                "Segmen": segmen # <-- ERROR: Kolom 'segmen' TIDAK ADA!
-            })
-        return {"units": result}
     except Exception as e:
-        print(f"[ERROR] Scatter Data ({years}): {e}")
+        uncacheable()
+        print(f"[ERROR] Unit Clusters ({years}, k={k}): {e}")
         import traceback
         traceback.print_exc()
-        return {"units": []}
+        return {"k": 0, "features": RADAR_FEATURES, "clusters": []}
 
 
 # === Endpoint: Data Radar per Unit ===
 # === Endpoint: Data Radar per Unit (DIPERBAIKI) ===
 @app.get("/api/data-radar")
-async def get_data_radar(unit: str):
+async def get_data_radar(unit: str, period=Depends(date_range_param)):
     try:
-        data = df[df["UnitPemohon"] == unit].copy()
-        if data.empty:
+        # Fitur semua unit + skala p10/p90 untuk semua tahun (cache), unit ini tinggal dibaca
+        profile = unit_profile(all_years(), period)
+        if unit not in profile["units"].index:
             return {
                 "scores": {},
                 "cluster": "Tidak Diketahui",
                 "description": "Tidak ada data"
             }
+        row = profile["units"].loc[unit]
 
-        # Hitung metrik dasar
-        total_permintaan = int(data["Jumlah"].sum())
-        total_pengeluaran = float(data["TotalHarga"].sum())
-        rata_harga = total_pengeluaran / total_permintaan if total_permintaan > 0 else 0
-        keragaman_kategori = int(data["Kategori"].nunique())
-        jumlah_transaksi = len(data)
-        efisiensi = total_permintaan / jumlah_transaksi if jumlah_transaksi > 0 else 0
-
-        # 🔹 Frekuensi permintaan per bulan — Tanggal SUDAH datetime!
-        if "Tanggal" in data.columns and data["Tanggal"].notna().any():
-            jumlah_bulan = len(data["Tanggal"].dt.to_period("M").unique())
-            frekuensi = total_permintaan / jumlah_bulan if jumlah_bulan > 0 else 0
-        else:
-            frekuensi = 0
-
-        # --- Hitung rentang global untuk normalisasi (semua unit) ---
-        all_units = df.groupby("UnitPemohon").agg(
-            TotalPermintaan=("Jumlah", "sum"),
-            TotalPengeluaran=("TotalHarga", "sum"),
-            RataHarga=("TotalHarga", lambda x: x.sum() /
-                       df.loc[x.index, "Jumlah"].sum() if x.sum() > 0 else 0),
-            Efisiensi=("Jumlah", lambda x: x.sum() /
-                       len(x) if len(x) > 0 else 0),
-            Keragaman=("Kategori", "nunique")
-        ).dropna()
-
-        # Tambahkan Frekuensi ke all_units
-        freq_series = df.groupby("UnitPemohon").apply(
-            lambda x: x["Jumlah"].sum() /
-            len(x["Tanggal"].dt.to_period("M").unique())
-            if x["Tanggal"].notna().any() else 0
-        )
-        all_units["Frekuensi"] = freq_series
+        # Metrik dasar
+        total_permintaan = int(row["TotalPermintaan"])
+        total_pengeluaran = float(row["TotalPengeluaran"])
+        rata_harga = float(row["RataHarga"])
+        keragaman_kategori = int(row["Keragaman"])
+        efisiensi = float(row["Efisiensi"])
+        frekuensi = float(row["Frekuensi"])
 
-        # Fungsi normalisasi ke skala 0–10
+        # Fungsi normalisasi ke skala 0–10 (rentang p10–p90 semua unit)
         def to_10_scale(value, col):
-            if col not in all_units.columns or all_units[col].empty:
+            if col not in profile["scale"]:
                 return 5.0
-            series = all_units[col]
-            min_val = series.quantile(0.1)
-            max_val = series.quantile(0.9)
+            min_val, max_val = profile["scale"][col]
             if max_val <= min_val:
                 return 5.0
             score = 10 * ((value - min_val) / (max_val - min_val))
@@ -1930,34 +4319,21 @@ async def get_data_radar(unit: str):
             "Segmen Keuangan": 0  # diisi manual
         }
 
-        # --- Segmen Keuangan → skor 0–10 ---
-        pengeluaran_vals = all_units["TotalPengeluaran"]
-        e33, e66 = pengeluaran_vals.quantile(
-            0.33), pengeluaran_vals.quantile(0.66)
-        if total_pengeluaran >= e66:
-            segmen_skor = 10.0
-            segmen_label = "Tinggi"
-        elif total_pengeluaran >= e33:
-            segmen_skor = 5.0
-            segmen_label = "Sedang"
-        else:
-            segmen_skor = 0.0
-            segmen_label = "Rendah"
+        # --- Segmen Keuangan → skor 0–10 (Segmen dari segmentasi yang sama) ---
+        segmen_skor, segmen_label = {
+            "Boros": (10.0, "Tinggi"),
+            "Sedang": (5.0, "Sedang"),
+            "Hemat": (0.0, "Rendah"),
+        }[row["Segmen"]]
         scores["Segmen Keuangan"] = segmen_skor
 
-        # --- Clustering ---
-        a = scores["Total Anggaran Digunakan"]
-        e = scores["Efisiensi Pengadaan"]
-        d = scores["Diversitas Permintaan"]
-        if a <= 3 and e >= 7:
-            cluster = "Hemat & Efisien"
-        elif a >= 7 and e <= 3:
-            cluster = "Boros & Tidak Efisien"
-        elif d >= 7:
-            cluster = "Multikategori"
-        else:
-            cluster = "Umum"
-        desc = "Pola permintaan seimbang"
+        # --- Clustering: klaster k-means semua unit (cache), unit ini tinggal dibaca ---
+        # Dengan rentang tanggal profil tidak di-cache → profil di atas dipakai ulang, tidak dibangun dua kali
+        clustering = unit_clusters(all_years(), period, profile=profile)
+        position = clustering["units"].get_loc(unit)
+        cluster_info = clustering["clusters"][int(clustering["labels"][position])]
+        cluster = cluster_info["label"]
+        desc = cluster_info["description"]
 
         return {
             "scores": scores,
@@ -1974,6 +4350,7 @@ async def get_data_radar(unit: str):
         }
 
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Radar Data for {unit}: {e}")
         import traceback
         traceback.print_exc()
@@ -1986,7 +4363,7 @@ async def get_data_radar(unit: str):
 
 
 @app.get("/api/monthly-expenditure")
-async def get_monthly_expenditure(years: str = "2025"):
+async def get_monthly_expenditure(years: Optional[str] = None, period=Depends(date_range_param)):
     """
     Ambil total pengeluaran per bulan dari satu atau banyak tahun.
     Contoh:
@@ -1994,48 +4371,32 @@ async def get_monthly_expenditure(years: str = "2025"):
       /api/monthly-expenditure?years=all
     """
     try:
-        selected_years = parse_years_param(years)
+        selected_years = parse_years_param(years, period)
         if not selected_years:
             return {"monthlyExpenditure": [0] * 12}
 
-        # Filter data berdasarkan tahun yang dipilih
-        data = df[df["Tahun"].isin(selected_years)].copy()
-        if data.empty:
-            return {"monthlyExpenditure": [0] * 12}
-
-        # Parse tanggal
-        data["Tanggal"] = pd.to_datetime(
-            data["Tanggal"], dayfirst=True, errors="coerce")
-        data = data.dropna(subset=["Tanggal"])
-        data["Bulan"] = data["Tanggal"].dt.month
-
-        # Gunakan TotalHarga sebagai nilai
-        data["TotalHarga"] = pd.to_numeric(
-            data["TotalHarga"], errors="coerce").fillna(0)
-
-        # Jumlahkan per bulan (Jan–Des)
-        monthly = (
-            data.groupby("Bulan")["TotalHarga"]
-            .sum()
-            .reindex(range(1, 13), fill_value=0)
-            .tolist()
-        )
+        # Jumlahkan TotalHarga per bulan (Jan–Des) dari time-series bulanan
+        if period == (None, None):
+            monthly = monthly_series(selected_years, "total")
+        else:
+            monthly = monthly_from_frame(select_rows(selected_years, period), "TotalHarga")
 
-        return {"monthlyExpenditure": monthly}
+        return {"monthlyExpenditure": monthly.tolist()}
 
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Monthly Expenditure ({years}): {e}")
         return {"monthlyExpenditure": [0] * 12}
 
 
 @app.get("/api/dashboard-metrics")
-async def get_dashboard_metrics(years: str = "2025"):
+async def get_dashboard_metrics(years: Optional[str] = None, period=Depends(date_range_param)):
     try:
-        selected_years = parse_years_param(years)
+        selected_years = parse_years_param(years, period)
         if not selected_years:
             selected_years = [2025]
 
-        data = df[df["Tahun"].isin(selected_years)].copy()
+        data = select_rows(selected_years, period).copy()
         if data.empty:
             return {"error": "Tidak ada data"}
 
@@ -2061,6 +4422,7 @@ async def get_dashboard_metrics(years: str = "2025"):
             }
         }
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Dashboard Metrics ({years}): {e}")
         return {"error": "Internal Server Error"}
 
@@ -2077,32 +4439,25 @@ def safe_float(value):
         return 0.0
 
 @app.get("/api/top-spending-units")
-async def get_top_spending_units(years: str = "2025"):
+async def get_top_spending_units(years: Optional[str] = None, period=Depends(date_range_param)):
     try:
-        selected_years = parse_years_param(years)
-        data = df[df["Tahun"].isin(selected_years)].copy()
-
-        # Pastikan TotalHarga bersih dari NaN
-        data["TotalHarga"] = pd.to_numeric(data["TotalHarga"], errors='coerce').fillna(0)
-
-        if data.empty:
-            return {"topSpendingUnits": []}
-
+        selected_years = parse_years_param(years, period)
+        # Agregasi per unit lewat storage backend (pandas / SQLite rollup_unit)
         top_units = (
-            data.groupby("UnitPemohon")
-            .agg(
-                TotalPengeluaran=("TotalHarga", "sum"),
-                TotalPermintaan=("Jumlah", "sum")
-            )
-            .reset_index()
+            current().storage.aggregate(["UnitPemohon"], selected_years, period)
+            .rename(columns={"TotalHarga": "TotalPengeluaran", "Jumlah": "TotalPermintaan"})
+            .sort_values("UnitPemohon")
             .nlargest(10, "TotalPengeluaran")
         )
 
+        if top_units.empty:
+            return {"topSpendingUnits": []}
+
+        segments = unit_profile(selected_years, period)["units"]["Segmen"]
         result = []
         for _, row in top_units.iterrows():
-            # Ambil segmen dari dataset asli
-            segmen_row = df[df["UnitPemohon"] == row["UnitPemohon"]]["segmen"]
-            segmen = segmen_row.iloc[0] if not segmen_row.empty else "Tidak Diketahui"
+            # Segmen dengan ambang batas tahun yang sama (lihat unit_profile)
+            segmen = segments.get(row["UnitPemohon"], "Tidak Diketahui")
             result.append({
                 "UnitPemohon": row["UnitPemohon"],
                 "TotalPengeluaran": safe_float(row["TotalPengeluaran"]),
@@ -2112,6 +4467,7 @@ async def get_top_spending_units(years: str = "2025"):
 
         return {"topSpendingUnits": result}
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Top Spending Units: {e}")
         import traceback
         traceback.print_exc()
@@ -2119,7 +4475,7 @@ async def get_top_spending_units(years: str = "2025"):
 
 
 @app.get("/api/category-demand-proportion")
-async def get_category_demand_proportion(years: str = "2025"):
+async def get_category_demand_proportion(years: Optional[str] = None, period=Depends(date_range_param)):
     """
     Mengembalikan total permintaan (jumlah unit) per kategori untuk satu atau beberapa tahun.
     Contoh:
@@ -2127,21 +4483,14 @@ async def get_category_demand_proportion(years: str = "2025"):
       /api/category-demand-proportion?years=all
     """
     try:
-        selected_years = parse_years_param(years)
+        selected_years = parse_years_param(years, period)
         if not selected_years:
             return {"labels": [], "data": []}
 
-        data = df[df["Tahun"].isin(selected_years)].copy()
-        if data.empty:
-            return {"labels": [], "data": []}
-
         # Kelompokkan berdasarkan Kategori, jumlahkan kolom 'Jumlah' (unit)
-        category_agg = (
-            data.groupby("Kategori")["Jumlah"]
-            .sum()
-            .nlargest(6)  # Ambil 6 kategori teratas
-            .reset_index()
-        )
+        category_agg = top_categories(selected_years, period, "Jumlah")
+        if category_agg.empty:
+            return {"labels": [], "data": []}
 
         return {
             "labels": category_agg["Kategori"].tolist(),
@@ -2150,7 +4499,1188 @@ async def get_category_demand_proportion(years: str = "2025"):
         }
 
     except Exception as e:
+        uncacheable()
         print(f"[ERROR] Category Demand Proportion ({years}): {e}")
         import traceback
         traceback.print_exc()
         return {"labels": [], "data": []}
+
+
+# =====================================================
+# ✅ Query Generik: filter → group-by → metrik → urut & limit
+# =====================================================
+# Dimensi query → kolom df. UnitPemohon & KodeBarang di-group lewat kode integer
+# (UnitID/ItemID) lalu didekode, jauh lebih cepat daripada group-by string.
+QUERY_DIMENSIONS = {
+    "Tahun": "Tahun",
+    "Bulan": None,  # diturunkan dari Tanggal
+    "UnitPemohon": "UnitID",
+    "KodeBarang": "ItemID",
+    "NamaBrg": "NamaBrg",
+    "Kategori": "Kategori",
+    "GrupBarang": "GrupBarang",
+    "Segmen": "segmen",
+    "LabelSegmen": "label_segmen",
+}
+QUERY_MEASURES = ["Jumlah", "HargaSatuan", "TotalHarga"]
+QUERY_OPS = {"sum": "sum", "mean": "mean", "count": "size", "nunique": "nunique"}
+QUERY_MAX_LIMIT = 1000
+QUERY_PLAN_CACHE_MAX = 256
+
+query_plan_cache = SizedCache(lambda plan: deep_sizeof(plan))
+
+
+def split_param(value):
+    return [v.strip() for v in value.split(",") if v.strip()] if value else []
+
+
+def compile_query_plan(group_by, metrics, filter_dims, order_by, descending):
+    """
+    Susun rencana eksekusi untuk satu bentuk query (dimensi, metrik, kolom filter, urutan).
+    Nilai filter & tahun tidak termasuk bentuk, jadi satu plan dipakai ulang untuk semua nilainya.
+    Raise ValueError jika dimensi/metrik tidak dikenal.
+    """
+    for dim in list(group_by) + list(filter_dims):
+        if dim not in QUERY_DIMENSIONS:
+            raise ValueError(f"Dimensi tidak dikenal: {dim}")
+    if len(set(group_by)) != len(group_by):
+        raise ValueError("Dimensi group_by duplikat")
+
+    aggs = {}
+    for metric in metrics:
+        op, _, column = metric.partition(":")
+        if op not in QUERY_OPS:
+            raise ValueError(f"Operasi metrik tidak dikenal: {op}")
+        if op == "count":
+            aggs["count"] = ("Jumlah", "size")
+        elif op == "nunique":
+            if column not in QUERY_DIMENSIONS or column == "Bulan":
+                raise ValueError(f"nunique butuh dimensi, bukan '{column}'")
+            aggs[f"nunique_{column}"] = (QUERY_DIMENSIONS[column], "nunique")
+        else:
+            if column not in QUERY_MEASURES:
+                raise ValueError(f"{op} butuh salah satu kolom {QUERY_MEASURES}, bukan '{column}'")
+            aggs[f"{op}_{column}"] = (column, QUERY_OPS[op])
+    if not aggs:
+        raise ValueError("Minimal satu metrik diperlukan")
+
+    order_by = order_by or next(iter(aggs))
+    if order_by not in aggs and order_by not in group_by:
+        raise ValueError(f"order_by harus salah satu metrik/dimensi: {order_by}")
+
+    return {
+        "group_by": list(group_by),
+        "aggs": aggs,
+        # Filter UnitPemohon lewat indeks baris unit, sisanya lewat mask kolom
+        "unit_filter": "UnitPemohon" in filter_dims,
+        # Segmen dihitung ulang untuk subset tahun query (bukan kolom semua tahun)
+        "subset_segments": bool({"Segmen", "LabelSegmen"} & (
+            set(group_by) | set(filter_dims) | {m.partition(":")[2] for m in metrics}
+        )),
+        "column_filters": [d for d in filter_dims if d != "UnitPemohon"],
+        "order_by": order_by,
+        "descending": descending,
+    }
+
+
+def get_query_plan(group_by, metrics, filter_dims, order_by, descending):
+    """Plan dari cache LRU per bentuk query; dikompilasi sekali lalu dipakai ulang."""
+    key = (tuple(group_by), tuple(metrics), tuple(sorted(filter_dims)), order_by, descending)
+    plan = query_plan_cache.get(key)
+    if plan is not None:
+        query_plan_cache.move_to_end(key)
+        return plan
+    plan = compile_query_plan(group_by, metrics, filter_dims, order_by, descending)
+    query_plan_cache[key] = plan
+    while len(query_plan_cache) > QUERY_PLAN_CACHE_MAX:
+        query_plan_cache.popitem(last=False)
+    return plan
+
+
+def query_dim_values(dim, values):
+    """Nilai filter → nilai kolom df (nama UnitPemohon/KodeBarang dipetakan ke ID)."""
+    id_index = current().id_index
+    if dim == "KodeBarang":
+        return [id_index["item_to_id"][v] for v in values if v in id_index["item_to_id"]]
+    if dim == "Tahun":
+        return [int(v) for v in values if v.isdigit()]
+    return values
+
+
+def execute_query_plan(plan, years, period, filters, limit):
+    """Jalankan plan: indeks waktu → indeks unit → mask kolom → group-by → urut & limit."""
+    df = current().df
+    id_index = current().id_index
+    positions = select_positions(years, period)
+    if plan["unit_filter"]:
+        unit_ids = [id_index["unit_to_id"][u] for u in filters["UnitPemohon"] if u in id_index["unit_to_id"]]
+        unit_positions = np.concatenate([rows_for("unit", uid) for uid in unit_ids] or [positions[:0]])
+        positions = positions[np.isin(positions, unit_positions)]
+    data = df.iloc[positions]
+    if plan["subset_segments"]:
+        data = with_subset_segments(data, years, period)
+
+    for dim in plan["column_filters"]:
+        if dim == "Bulan":
+            months = [int(v) for v in filters[dim] if v.isdigit()]
+            data = data[data["Tanggal"].dt.month.isin(months)]
+        else:
+            data = data[data[QUERY_DIMENSIONS[dim]].isin(query_dim_values(dim, filters[dim]))]
+
+    if not plan["group_by"]:
+        result = pd.DataFrame([{
+            name: (len(data) if func == "size" else data[col].agg(func))
+            for name, (col, func) in plan["aggs"].items()
+        }])
+    else:
+        keys = [
+            data["Tanggal"].dt.month.rename("Bulan") if dim == "Bulan"
+            else data[QUERY_DIMENSIONS[dim]].rename(dim)
+            for dim in plan["group_by"]
+        ]
+        result = data.groupby(keys).agg(**plan["aggs"]).reset_index()
+        if "UnitPemohon" in plan["group_by"]:
+            result["UnitPemohon"] = id_index["unit_names"][result["UnitPemohon"].to_numpy()]
+        if "KodeBarang" in plan["group_by"]:
+            result["KodeBarang"] = id_index["item_codes"][result["KodeBarang"].to_numpy()]
+        if "Bulan" in plan["group_by"]:
+            result["Bulan"] = result["Bulan"].astype(int)
+
+    total_groups = len(result)
+    result = (
+        result.sort_values(plan["order_by"], ascending=not plan["descending"], kind="mergesort")
+        .head(limit)
+        .round(2)
+    )
+    return result, total_groups
+
+
+@app.get("/api/query")
+async def query_aggregate(
+    years: Optional[str] = None,
+    period=Depends(date_range_param),
+    group_by: str = "",
+    metrics: str = "sum:Jumlah",
+    unit: str = "",
+    kategori: str = "",
+    segmen: str = "",
+    kode_barang: str = "",
+    bulan: str = "",
+    order_by: str = "",
+    order: str = "desc",
+    limit: int = 100,
+):
+    """
+    Agregasi generik untuk panel dashboard baru tanpa endpoint khusus.
+      group_by : dimensi dipisah koma — Tahun, Bulan, UnitPemohon, KodeBarang, NamaBrg,
+                 Kategori, GrupBarang, Segmen, LabelSegmen (kosong = satu baris total)
+      metrics  : sum:<kolom>, mean:<kolom>, count, nunique:<dimensi>
+                 (kolom: Jumlah, HargaSatuan, TotalHarga)
+      filter   : years, from/to, unit, kategori, segmen, kode_barang, bulan (nilai dipisah koma)
+    Contoh:
+      /api/query?years=2024,2025&group_by=Kategori&metrics=sum:TotalHarga,nunique:UnitPemohon&limit=5
+      /api/query?years=2025&group_by=Bulan&metrics=sum:Jumlah&unit=baak&order_by=Bulan&order=asc
+    """
+    filters = {
+        dim: split_param(value)
+        for dim, value in (
+            ("UnitPemohon", unit), ("Kategori", kategori), ("Segmen", segmen),
+            ("KodeBarang", kode_barang), ("Bulan", bulan),
+        )
+        if split_param(value)
+    }
+    try:
+        plan = get_query_plan(
+            split_param(group_by), split_param(metrics), list(filters),
+            order_by.strip() or None, order.lower() != "asc",
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        limit = max(1, min(limit, QUERY_MAX_LIMIT))
+        result, total_groups = execute_query_plan(plan, parse_years_param(years, period), period, filters, limit)
+        return {
+            "columns": result.columns.tolist(),
+            "rows": result.to_dict(orient="records"),
+            "totalGroups": total_groups,
+        }
+    except Exception as e:
+        uncacheable()
+        print(f"[ERROR] Query ({group_by} / {metrics}): {e}")
+        import traceback
+        traceback.print_exc()
+        return {"columns": [], "rows": [], "totalGroups": 0}
+
+
+# =====================================================
+# ✅ Template & Ekspor Excel (XLSX streaming, write-only)
+# =====================================================
+import tempfile
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# Baris df yang dibaca sekaligus saat ekspor; memori tetap kecil berapa pun total barisnya
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+
+# Kolom file impor/ekspor = header CSV sumber, jadi hasil ekspor bisa diimpor ulang
+# (header, kolom df, contoh, keterangan)
+TRANSACTION_COLUMNS = [
+    ("Tanggal", "Tanggal", "03/01/2025", "Tanggal permintaan (dd/mm/yyyy)"),
+    ("Kode Transaksi", "NomorSurat", "2/k/atk/2025", "Nomor surat / kode transaksi"),
+    ("Pemohon", "Pemohon", "budi santoso", "Nama pemohon"),
+    ("Unit Pemohon", "UnitPemohon", "lab. elektronika digital", "Unit yang meminta barang"),
+    ("Kode Barang", "KodeBarang", "1.010.302.001.096", "Kode barang (kunci barang)"),
+    ("Nama Brg", "NamaBrg", "kertas a4 80 gr.", "Nama barang"),
+    ("Satuan", "Satuan", "rim", "Satuan barang"),
+    ("Jml", "Jumlah", 10, "Jumlah unit diminta (angka)"),
+    ("Harga", "HargaSatuan", 62759.4, "Harga satuan (angka)"),
+    ("Total", "TotalHarga", 627594.0, "Jml × Harga (angka)"),
+    ("Tahun", "Tahun", 2025, "Tahun permintaan"),
+    ("Kategori Barang", "GrupBarang", "Alat Tulis", "Grup barang"),
+    ("Kategori", "Kategori", "ATK", "Kategori barang"),
+]
+
+
+def write_xlsx(sheets):
+    """
+    Tulis workbook mode write-only: setiap baris langsung di-flush ke file sementara,
+    jadi memori tidak bertambah dengan jumlah baris. sheets: [(judul, header, iterable baris)].
+    Return path file .xlsx sementara (dihapus setelah respons terkirim).
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    wb = Workbook(write_only=True)
+    for title, header, rows in sheets:
+        ws = wb.create_sheet(title)
+        header_cells = []
+        for name in header:
+            cell = WriteOnlyCell(ws, value=name)
+            cell.font = Font(bold=True)
+            header_cells.append(cell)
+        ws.append(header_cells)
+        for row in rows:
+            ws.append(row)
+
+    fd, path = tempfile.mkstemp(prefix="stark_", suffix=".xlsx")
+    os.close(fd)
+    try:
+        wb.save(path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def export_rows(years, period=(None, None), unit=None, kategori=None):
+    """Baris transaksi per partisi tahun (urut tanggal), dibaca per potongan EXPORT_CHUNK_ROWS."""
+    df = current().df
+    order = current().time_index["order"]
+    columns = [column for _, column, _, _ in TRANSACTION_COLUMNS]
+    for year in years:
+        for lo, hi in time_slices([year], period):
+            for start in range(lo, hi, EXPORT_CHUNK_ROWS):
+                check_deadline()
+                chunk = df.iloc[order[start:min(start + EXPORT_CHUNK_ROWS, hi)]]
+                if unit:
+                    chunk = chunk[chunk["UnitPemohon"] == unit]
+                if kategori:
+                    chunk = chunk[chunk["Kategori"] == kategori]
+                chunk = chunk[columns].astype(object)
+                yield from chunk.where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def xlsx_response(path, filename):
+    return FileResponse(path, media_type=XLSX_MEDIA_TYPE, filename=filename,
+                        background=BackgroundTask(os.remove, path))
+
+
+# File unduhan: tidak disimpan di response_cache & tidak di-gzip ulang (xlsx sudah zip)
+for _path in ("/api/template", "/api/export-data"):
+    NO_CACHE_PATHS.add(_path)
+    STREAMING_PATHS.add(_path)
+
+
+@app.get("/api/template")
+async def download_template():
+    """Template impor kosong (.xlsx): sheet Data berisi header, sheet Petunjuk berisi contoh."""
+    try:
+        path = await asyncio.to_thread(write_xlsx, [
+            ("Data", [header for header, _, _, _ in TRANSACTION_COLUMNS], []),
+            ("Petunjuk", ["Kolom", "Keterangan", "Contoh"],
+             [(header, note, example) for header, _, example, note in TRANSACTION_COLUMNS]),
+        ])
+        return xlsx_response(path, "template_permintaan.xlsx")
+    except Exception as e:
+        print(f"[ERROR] Template XLSX: {e}")
+        import traceback
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"error": "Gagal membuat template"})
+
+
+@app.get("/api/export-data")
+async def export_data(years: str = "all", period=Depends(date_range_param),
+                      unit: Optional[str] = None, kategori: Optional[str] = None):
+    """
+    Laporan transaksi (.xlsx) untuk tahun/rentang & filter unit/kategori opsional.
+    Contoh:
+      /api/export-data?years=all
+      /api/export-data?years=2024&from=2024-01&to=2024-06&kategori=ATK
+    """
+    try:
+        selected_years = parse_years_param(years)
+        header = [header for header, _, _, _ in TRANSACTION_COLUMNS]
+        path = await asyncio.to_thread(
+            write_xlsx, [("Data", header, export_rows(selected_years, period, unit, kategori))]
+        )
+        label = "semua" if years.strip().lower() == "all" else "_".join(str(y) for y in selected_years)
+        return xlsx_response(path, f"data_permintaan_{current().name}_{label}.xlsx")
+    except Exception as e:
+        print(f"[ERROR] Export XLSX ({years}): {e}")
+        import traceback
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"error": "Gagal membuat file ekspor"})
+
+
+# =====================================================
+# ✅ Impor Data: Validasi Vectorised, De-duplikasi Hash & Laporan Penolakan
+# =====================================================
+import io
+from fastapi import File, UploadFile
+
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_MB", "20")) * 2**20
+IMPORT_MAX_REJECT_REPORT = int(os.getenv("IMPORT_MAX_REJECT_REPORT", "1000"))
+# Total dianggap cocok dengan Jml × Harga jika selisihnya ≤ 1 rupiah atau ≤ 1%
+IMPORT_TOTAL_ABS_TOLERANCE = 1.0
+IMPORT_TOTAL_REL_TOLERANCE = 0.01
+IMPORT_TEXT_REQUIRED = ["Kode Transaksi", "Unit Pemohon", "Kode Barang", "Nama Brg", "Kategori"]
+IMPORT_NUMERIC = ["Jml", "Harga", "Total"]
+
+
+def read_upload(filename, content):
+    """File unggahan (.csv / .xlsx, sheet pertama) → DataFrame mentah dengan header sumber."""
+    name = filename.lower()
+    if name.endswith(".csv"):
+        return pd.read_csv(io.BytesIO(content), dtype=str, keep_default_na=False)
+    if name.endswith(".xlsx"):
+        return pd.read_excel(io.BytesIO(content), sheet_name=0, dtype=object, engine="openpyxl")
+    raise ValueError("Format file tidak didukung: gunakan .csv atau .xlsx (lihat /api/template)")
+
+
+def dedup_hashes(kode_transaksi, kode_barang, tanggal, jumlah):
+    """Hash 64-bit per baris dari kunci (Kode Transaksi, Kode Barang, Tanggal per hari, Jml)."""
+    key = pd.DataFrame({
+        "transaksi": kode_transaksi.astype(str).str.strip().to_numpy(),
+        "barang": kode_barang.astype(str).str.strip().to_numpy(),
+        "tanggal": tanggal.dt.strftime("%Y-%m-%d").to_numpy(),
+        "jumlah": jumlah.astype(float).to_numpy(),
+    })
+    return pd.util.hash_pandas_object(key, index=False).to_numpy()
+
+
+def existing_key_index(dataset):
+    """Hash kunci semua transaksi dataset (terurut, unik) — dibangun sekali per versi."""
+    entry = dataset.derived_cache.get("ingest_keys")
+    if entry is None or entry[0] != dataset.version:
+        df = dataset.df
+        keys = np.unique(dedup_hashes(df["NomorSurat"], df["KodeBarang"], df["Tanggal"], df["Jumlah"]))
+        entry = (dataset.version, keys)
+        dataset.derived_cache["ingest_keys"] = entry
+    return entry[1]
+
+
+def validate_ingest(raw, dataset):
+    """
+    Validasi semua baris sekaligus dengan operasi kolom (tanpa loop per baris):
+    skema, tanggal, tahun, angka non-negatif, Total ≈ Jml × Harga, lalu de-duplikasi
+    terhadap dataset & di dalam file. Return baris diterima (format CSV sumber) + laporan.
+    """
+    headers = [header for header, _, _, _ in TRANSACTION_COLUMNS]
+    raw = raw.rename(columns=lambda c: str(c).strip())
+    missing = [h for h in headers if h not in raw.columns]
+    if missing:
+        raise ValueError(f"Kolom wajib tidak ditemukan: {', '.join(missing)}")
+
+    # astype("string") dulu: fillna("") pada kolom object (xlsx) memicu FutureWarning downcasting
+    text = raw[headers].astype("string").fillna("").apply(lambda col: col.str.strip())
+    blank_row = (text == "").all(axis=1)  # baris kosong sisa format Excel → diabaikan
+    text = text[~blank_row]
+
+    tanggal = pd.to_datetime(text["Tanggal"], format="%d/%m/%Y", errors="coerce").fillna(
+        pd.to_datetime(text["Tanggal"], format="ISO8601", errors="coerce"))
+    tahun = pd.to_numeric(text["Tahun"], errors="coerce")
+    numbers = {col: pd.to_numeric(text[col], errors="coerce") for col in IMPORT_NUMERIC}
+    expected_total = numbers["Jml"] * numbers["Harga"]
+    tolerance = np.maximum(IMPORT_TOTAL_ABS_TOLERANCE, IMPORT_TOTAL_REL_TOLERANCE * numbers["Total"].abs())
+
+    checks = {f"{col} kosong": text[col] == "" for col in IMPORT_TEXT_REQUIRED}
+    checks["Tanggal tidak valid"] = tanggal.isna()
+    checks["Tahun bukan angka"] = tahun.isna()
+    checks["Tahun tidak sesuai Tanggal"] = tahun.notna() & tanggal.notna() & (tahun != tanggal.dt.year)
+    for col, values in numbers.items():
+        checks[f"{col} bukan angka"] = values.isna()
+        checks[f"{col} negatif"] = values < 0
+    checks["Total ≠ Jml × Harga"] = (numbers["Total"] - expected_total).abs() > tolerance
+
+    hashes = dedup_hashes(text["Kode Transaksi"], text["Kode Barang"], tanggal, numbers["Jml"].fillna(-1))
+    checks["Duplikat data yang sudah ada"] = pd.Series(np.isin(hashes, existing_key_index(dataset)), index=text.index)
+    checks["Duplikat di dalam file"] = pd.Series(pd.Series(hashes).duplicated().to_numpy(), index=text.index)
+
+    problems = pd.DataFrame(checks)
+    rejected = problems.any(axis=1).to_numpy()
+
+    # Laporan penolakan: nomor baris file (header = baris 1) + semua alasannya
+    labels = problems.columns.tolist()
+    bad = np.flatnonzero(rejected)[:IMPORT_MAX_REJECT_REPORT]
+    reasons = [[] for _ in bad]
+    for i, j in zip(*np.nonzero(problems.to_numpy()[bad])):
+        reasons[i].append(labels[j])
+    row_numbers = text.index.to_numpy()[bad] + 2
+    rejects = [
+        {"row": int(row), "kodeTransaksi": text.at[idx, "Kode Transaksi"], "reasons": why}
+        for row, idx, why in zip(row_numbers, text.index[bad], reasons)
+    ]
+
+    ok = ~rejected
+    accepted = text[ok].assign(
+        Tanggal=tanggal[ok].dt.strftime("%d/%m/%Y"),
+        Tahun=tahun[ok].astype(int),
+        **{col: numbers[col][ok].astype(float) for col in IMPORT_NUMERIC},
+    )
+    counts = problems.sum()
+    return {
+        "accepted": accepted,
+        "received": int(len(text)),
+        "skippedBlank": int(blank_row.sum()),
+        "rejected": int(rejected.sum()),
+        "duplicates": int((problems["Duplikat data yang sudah ada"] | problems["Duplikat di dalam file"]).sum()),
+        "reasonCounts": {label: int(n) for label, n in counts.items() if n},
+        "rejects": rejects,
+        "rejectsTruncated": bool(rejected.sum() > len(rejects)),
+    }
+
+
+def append_csv_rows(path, rows):
+    """Tambahkan baris ke file CSV dataset dengan urutan kolom file (kolom lain dikosongkan)."""
+    file_columns = pd.read_csv(path, nrows=0).columns
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size:
+            f.seek(-1, os.SEEK_END)
+        needs_newline = size > 0 and f.read(1) != b"\n"
+    with open(path, "a", encoding="utf-8", newline="") as f:
+        if needs_newline:
+            f.write("\n")
+        rows.reindex(columns=file_columns, fill_value="").to_csv(f, header=False, index=False)
+
+
+def ingest_upload(name, dataset, raw, dry_run=False):
+    """
+    Validasi + tulis + muat ulang di bawah dataset_lock, jadi dua impor bersamaan tidak bisa
+    lolos de-duplikasi satu sama lain. Return (dataset lama, dataset baru, laporan).
+    """
+    with dataset_lock:
+        existing = loaded_datasets.get(name) or dataset
+        report = validate_ingest(raw, existing)
+        if dry_run or report["accepted"].empty:
+            return existing, existing, report
+        append_csv_rows(DATASET_FILES[name], report["accepted"])
+        return existing, swap_dataset(name, existing), report
+
+
+@app.post("/api/import-data")
+async def import_data(file: UploadFile = File(...), dry_run: bool = False):
+    """
+    Impor transaksi dari .csv/.xlsx (format /api/template) ke dataset aktif.
+    Baris tidak valid & duplikat ditolak per baris (beserta alasannya), sisanya ditambahkan
+    ke file dataset lalu versi baru dimuat. `dry_run=true` hanya memvalidasi.
+    """
+    dataset = current()
+    try:
+        content = await file.read(IMPORT_MAX_BYTES + 1)
+        if len(content) > IMPORT_MAX_BYTES:
+            return JSONResponse(status_code=413, content={
+                "error": f"File terlalu besar (maks {IMPORT_MAX_BYTES // 2**20} MB)"})
+        raw = await asyncio.to_thread(read_upload, file.filename or "", content)
+        old, fresh, report = await asyncio.to_thread(ingest_upload, dataset.name, dataset, raw, dry_run)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        print(f"[ERROR] Import data ({file.filename}): {e}")
+        import traceback
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"error": "Gagal memproses file impor"})
+
+    imported = 0 if dry_run else len(report["accepted"])
+    if fresh is not old:
+        await after_dataset_change(old, fresh, "import")
+    print(f"[INFO] Impor '{file.filename}' → dataset '{dataset.name}': {imported} diterima, "
+          f"{report['rejected']} ditolak ({report['duplicates']} duplikat)")
+    return {
+        "dataset": dataset.name,
+        "version": fresh.version,
+        "dryRun": dry_run,
+        "imported": imported,
+        "valid": len(report["accepted"]),
+        **{key: value for key, value in report.items() if key != "accepted"},
+    }
+
+
+# =====================================================
+# ✅ Registry Memori: Ukuran per Cache & Budget Global
+# =====================================================
+import sys
+
+# Budget total semua dataset, indeks & cache; lewat budget → entri paling murah dibangun ulang
+# dibuang lebih dulu (respons ter-cache → hasil turunan → dataset non-default), LRU dalam tiap tingkat
+MEMORY_BUDGET_MB = float(os.getenv("MEMORY_BUDGET_MB", "1024"))
+# Hasil turunan yang tidak pernah dibuang: anomali membawa status inkremental antar versi
+DERIVED_PINNED = {"anomalies"}
+memory_stats = {"evictions": 0, "evictedBytes": 0, "lastEviction": None}
+
+
+def deep_sizeof(obj, _depth=0):
+    """Perkiraan ukuran objek (byte): DataFrame/array lewat nbytes, container ditelusuri."""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True, index=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    size = sys.getsizeof(obj)
+    if _depth > 8:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(deep_sizeof(k, _depth + 1) + deep_sizeof(v, _depth + 1) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(deep_sizeof(v, _depth + 1) for v in obj)
+    return size
+
+
+def drop_version_responses(version):
+    """Buang respons ter-cache milik satu versi dataset (versi lama / dataset yang dilepas)."""
+    for etag in [k for k in list(response_cache) if f'"{version}-' in k]:
+        response_cache.pop(etag, None)
+
+
+def memory_usage():
+    """Byte per pool dari running total SizedCache — O(jumlah dataset), tanpa menelusuri entri."""
+    with registry_lock:
+        datasets = list(loaded_datasets.values())
+    return {
+        "response_cache": response_cache.nbytes,
+        "query_plan_cache": query_plan_cache.nbytes,
+        "derived_cache": sum(d.derived_cache.nbytes for d in datasets),
+        "datasets": sum(d.nbytes() for d in datasets),
+    }
+
+
+def eviction_candidates(pinned):
+    """
+    (cache, kunci) yang boleh dibuang, nilai terendah lebih dulu: respons ter-cache → plan query
+    → hasil turunan (dataset LRU lebih dulu) → dataset non-pin; LRU di dalam tiap cache.
+    cache None = seluruh dataset. Dibaca malas: hanya sebanyak yang perlu dibuang.
+    """
+    for cache in (response_cache, query_plan_cache):
+        for key in list(cache):
+            yield cache, key
+    with registry_lock:
+        datasets = list(loaded_datasets.values())
+    for dataset in datasets:
+        for key in list(dataset.derived_cache):
+            if key not in DERIVED_PINNED:
+                yield dataset.derived_cache, key
+    for dataset in datasets:
+        if dataset.name not in pinned:
+            yield None, dataset.name
+
+
+def drop_dataset(name):
+    with registry_lock:
+        evicted = loaded_datasets.pop(name, None)
+    if evicted is None:
+        return 0
+    drop_version_responses(evicted.version)
+    print(f"[INFO] Dataset '{name}' dilepas dari memori (budget {MEMORY_BUDGET_MB:.0f} MB)")
+    return evicted.nbytes() + evicted.derived_cache.nbytes
+
+
+def enforce_memory_budget(keep=None):
+    """
+    Buang entri bernilai terendah sampai total ≤ MEMORY_BUDGET_MB. Dataset default, dataset
+    request aktif & `keep` tidak pernah dilepas; dataset default menopang readiness & warm-up.
+    """
+    budget = MEMORY_BUDGET_MB * 2**20
+    if sum(memory_usage().values()) <= budget:
+        return 0
+    pinned = {DEFAULT_DATASET, keep} | {d.name for d in [active_dataset.get()] if d is not None}
+    with memory_lock:
+        used = sum(memory_usage().values())
+        freed = 0
+        for cache, key in eviction_candidates(pinned):
+            if used - freed <= budget:
+                break
+            if cache is None:
+                freed += drop_dataset(key)
+            else:
+                freed += cache.sizes.get(key, 0)
+                cache.pop(key, None)
+            memory_stats["evictions"] += 1
+        memory_stats["evictedBytes"] += freed
+        memory_stats["lastEviction"] = time.time()
+        return freed
+
+
+NO_CACHE_PATHS.add("/api/admin/memory")
+DATASET_FREE_PATHS.add("/api/admin/memory")
+
+
+def pool_info(cache, tier, pinned_keys=()):
+    return {
+        "entries": len(cache),
+        "bytes": cache.nbytes,
+        "pinnedBytes": sum(cache.sizes.get(key, 0) for key in pinned_keys),
+        "tier": tier,
+    }
+
+
+@app.get("/api/admin/memory")
+async def memory_breakdown():
+    """Pemakaian memori per pool (entri, MB, bagian yang dipin) terhadap budget global."""
+    with registry_lock:
+        datasets = list(loaded_datasets.values())
+    pools = {
+        "response_cache": pool_info(response_cache, 0),
+        "query_plan_cache": pool_info(query_plan_cache, 0),
+        **{f"derived_cache:{d.name}": pool_info(d.derived_cache, 1, DERIVED_PINNED) for d in datasets},
+        "datasets": {
+            "entries": len(datasets),
+            "bytes": sum(d.nbytes() for d in datasets),
+            "pinnedBytes": sum(d.nbytes() for d in datasets if d.name == DEFAULT_DATASET),
+            "tier": 2,
+        },
+    }
+    total = sum(info["bytes"] for info in pools.values())
+    return {
+        "budgetMB": MEMORY_BUDGET_MB,
+        "usedMB": round(total / 2**20, 2),
+        "processRssMB": process_rss_mb(),
+        "pools": {
+            pool: {**info, "mb": round(info["bytes"] / 2**20, 3)}
+            for pool, info in sorted(pools.items(), key=lambda kv: -kv[1]["bytes"])
+        },
+        "inflight": {
+            "llmCalls": len(llm_inflight),
+            "sseSubscribers": sum(len(s) for s in dataset_subscribers.values()),
+            "backgroundTasks": len(background_tasks),
+        },
+        "evictions": memory_stats,
+    }
+
+
+def process_rss_mb():
+    """RSS proses saat ini (Linux /proc); None jika tidak tersedia."""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# =====================================================
+# ✅ Admission Control: Kelas Prioritas per Jenis Trafik
+# =====================================================
+from collections import deque
+
+# Kelas → "batas_konkurensi:panjang_antrean"; antrean penuh / menunggu terlalu lama → 503 + Retry-After
+ADMISSION_CLASSES = {
+    "interactive": os.getenv("ADMISSION_INTERACTIVE", "32:256"),
+    "chatbot": os.getenv("ADMISSION_CHATBOT", "8:32"),
+    "bulk": os.getenv("ADMISSION_BULK", "2:4"),
+    "admin": os.getenv("ADMISSION_ADMIN", "4:8"),
+}
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+ADMISSION_ROUTES = {
+    "/api/chatbot-ai": "chatbot",
+    "/api/chatbot-query": "chatbot",
+    "/api/export-data": "bulk",
+    "/api/template": "bulk",
+    "/api/import-data": "bulk",
+    "/api/reload-data": "bulk",
+    "/api/datasets": "admin",
+}
+# Koneksi panjang (SSE) & healthcheck tidak menempati slot/antrean
+ADMISSION_EXEMPT_PATHS = {"/api/events", "/api/ready"}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class AdmissionClass:
+    """Semaphore FIFO dengan antrean terbatas + statistik antrean untuk satu kelas trafik."""
+
+    def __init__(self, name, spec):
+        limit, _, queue = spec.partition(":")
+        self.name = name
+        self.limit = max(1, int(limit))
+        self.queue_limit = max(0, int(queue or 0))
+        self.active = 0
+        self.waiters = deque()
+        self.waits = deque(maxlen=1000)   # detik menunggu, request terakhir
+        self.service_seconds = None       # EWMA lama layanan → perkiraan Retry-After
+        self.stats = {"admitted": 0, "rejected": 0, "queueTimeouts": 0, "peakQueued": 0}
+
+    def retry_after(self):
+        per_request = self.service_seconds or 1.0
+        return max(1, math.ceil(per_request * (len(self.waiters) + 1) / self.limit))
+
+    async def acquire(self):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            self.admitted(0.0)
+            return
+        if len(self.waiters) >= self.queue_limit:
+            self.stats["rejected"] += 1
+            raise AdmissionRejected(self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.stats["peakQueued"] = max(self.stats["peakQueued"], len(self.waiters))
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), ADMISSION_MAX_WAIT_SECONDS)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # slot sudah diserahkan bersamaan dengan timeout/batal
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats["queueTimeouts"] += 1
+                raise AdmissionRejected(self.retry_after()) from None
+            raise
+        self.admitted(time.monotonic() - started)
+
+    def admitted(self, waited):
+        self.stats["admitted"] += 1
+        self.waits.append(waited)
+
+    def release(self, service_seconds=None):
+        if service_seconds is not None:
+            previous = self.service_seconds
+            self.service_seconds = service_seconds if previous is None else 0.8 * previous + 0.2 * service_seconds
+        # Slot langsung diserahkan ke antrean terdepan (FIFO), active tidak berubah
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def snapshot(self):
+        waits = sorted(self.waits)
+
+        def percentile(q):
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 1) if waits else 0.0
+
+        return {
+            "limit": self.limit,
+            "queueLimit": self.queue_limit,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "waitMsP50": percentile(0.50),
+            "waitMsP99": percentile(0.99),
+            "serviceMsAvg": round(self.service_seconds * 1000, 1) if self.service_seconds else None,
+            **self.stats,
+        }
+
+
+admission_classes = {name: AdmissionClass(name, spec) for name, spec in ADMISSION_CLASSES.items()}
+
+
+def admission_class(path):
+    if path.startswith("/api/admin/"):
+        return "admin"
+    return ADMISSION_ROUTES.get(path, "interactive")
+
+
+class AdmissionMiddleware:
+    """
+    Setiap request menempati slot kelasnya sampai respons selesai, jadi ekspor/impor dan
+    antrean LLM tidak bisa menghabiskan giliran request dashboard yang singkat.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in ADMISSION_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        admission = admission_classes[admission_class(scope["path"])]
+        try:
+            await admission.acquire()
+        except AdmissionRejected as rejected:
+            busy = JSONResponse(
+                status_code=503,
+                content={"error": "Server sedang sibuk, silakan coba lagi sebentar lagi.",
+                         "class": admission.name, "retryAfter": rejected.retry_after},
+                # Middleware ini di luar CORSMiddleware → header CORS ditambahkan sendiri
+                headers={"Retry-After": str(rejected.retry_after), "Cache-Control": "no-store",
+                         "Access-Control-Allow-Origin": "*"},
+            )
+            await busy(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        completed = False
+        try:
+            await self.app(scope, receive, send)
+            completed = True
+        finally:
+            admission.release(time.monotonic() - started if completed else None)
+
+
+app.add_middleware(AdmissionMiddleware)
+
+NO_CACHE_PATHS.add("/api/admin/admission")
+DATASET_FREE_PATHS.add("/api/admin/admission")
+
+
+@app.get("/api/admin/admission")
+async def admission_metrics():
+    """Kedalaman antrean, slot aktif, waktu tunggu & penolakan per kelas trafik."""
+    return {name: admission.snapshot() for name, admission in admission_classes.items()}
+
+
+# =====================================================
+# ✅ Pembatalan Request Terputus & Batas Waktu Komputasi
+# =====================================================
+# Batas waktu sampai respons mulai dikirim (detik, 0 = tanpa batas); bisa diganti per path
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+REQUEST_DEADLINES = {
+    "/api/export-data": float(os.getenv("EXPORT_DEADLINE_SECONDS", "300")),
+    "/api/chatbot-ai": LLM_MAX_WAIT + LLM_TIMEOUT + 5,
+    "/api/events": 0,
+    # Healthcheck harus selalu menjawab status, bukan 504
+    "/api/ready": 0,
+}
+# Selain GET/HEAD hanya POST yang tidak menulis data yang boleh dibatalkan
+CANCELLABLE_POST_PATHS = {"/api/chatbot-ai"}
+
+request_budget = contextvars.ContextVar("request_budget", default=None)
+# Request internal (warm-up lewat ASGITransport berjalan di context task warm-up) → tanpa deadline
+internal_request = contextvars.ContextVar("internal_request", default=False)
+request_stats = {"disconnected": 0, "timedOut": 0}
+
+
+class RequestAborted(BaseException):
+    """
+    Klien terputus atau deadline lewat. Turunan BaseException (seperti CancelledError)
+    supaya tidak ditelan `except Exception` di handler yang membalas payload kosong.
+    """
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def check_deadline():
+    """
+    Titik periksa kooperatif untuk komputasi sinkron (di event loop maupun thread worker,
+    context ikut tersalin lewat asyncio.to_thread): raise RequestAborted jika request
+    sudah ditinggalkan klien atau melewati batas waktunya.
+    """
+    budget = request_budget.get()
+    if budget is None:
+        return
+    if budget["disconnected"]:
+        raise RequestAborted("disconnected")
+    if budget["deadline"] is not None and time.monotonic() > budget["deadline"]:
+        raise RequestAborted("deadline")
+
+
+def find_aborted(error):
+    """RequestAborted di dalam error, juga jika dibungkus BaseExceptionGroup oleh BaseHTTPMiddleware."""
+    if isinstance(error, RequestAborted):
+        return error
+    for inner in getattr(error, "exceptions", ()):
+        found = find_aborted(inner)
+        if found is not None:
+            return found
+    return None
+
+
+class RequestGuardMiddleware:
+    """
+    ASGI middleware terluar: handler dijalankan sebagai task terpisah sementara pesan
+    http.disconnect dipantau. Klien terputus → task dibatalkan (termasuk panggilan httpx
+    upstream) dan komputasi di thread berhenti di check_deadline berikutnya. Deadline lewat
+    sebelum respons dimulai → 504 dengan pesan yang jelas.
+
+    Batasan: handler yang menghitung sinkron di event loop menahan loop sampai selesai, jadi
+    disconnect baru terlihat setelahnya; pembatalan efektif untuk jalur await & asyncio.to_thread
+    (chatbot/LLM, anomali, dashboard-compare, ekspor). Deadline tetap berlaku lewat check_deadline.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (
+            scope["method"] in ("GET", "HEAD") or scope["path"] in CANCELLABLE_POST_PATHS
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        seconds = 0 if internal_request.get() else REQUEST_DEADLINES.get(scope["path"], REQUEST_DEADLINE_SECONDS)
+        budget = {"deadline": time.monotonic() + seconds if seconds > 0 else None, "disconnected": False}
+        inbox = asyncio.Queue()
+        response_started = response_complete = False
+
+        async def guarded_send(message):
+            nonlocal response_started, response_complete
+            if message["type"] == "http.response.start":
+                response_started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        token = request_budget.set(budget)
+        try:
+            app_task = asyncio.create_task(self.app(scope, inbox.get, guarded_send))
+        finally:
+            request_budget.reset(token)
+
+        async def watch_disconnect():
+            while True:
+                message = await receive()
+                inbox.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    # Disconnect setelah respons lengkap itu normal (background task tetap jalan)
+                    if not app_task.done() and not response_complete:
+                        budget["disconnected"] = True
+                        request_stats["disconnected"] += 1
+                        app_task.cancel()
+                    return
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            timeout = seconds if seconds > 0 else None
+            done, _ = await asyncio.wait({app_task}, timeout=timeout)
+            if not done and not response_started:
+                app_task.cancel()
+            # Respons sudah mulai (mis. unduhan besar) → dibiarkan selesai
+            await asyncio.wait({app_task})
+            try:
+                app_task.result()
+                return
+            except asyncio.CancelledError:
+                if budget["disconnected"]:
+                    return
+            except BaseException as error:
+                aborted = find_aborted(error)
+                if aborted is None:
+                    raise
+                if aborted.reason == "disconnected":
+                    return
+        finally:
+            watcher.cancel()
+            if not app_task.done():
+                app_task.cancel()
+
+        # Deadline lewat (di await maupun di titik periksa komputasi sinkron)
+        request_stats["timedOut"] += 1
+        print(f"[WARN] Request {scope['path']} melewati batas waktu {seconds:g} detik")
+        if response_started:
+            return
+        timeout_response = JSONResponse(
+            status_code=504,
+            content={
+                "error": f"Waktu komputasi habis (batas {seconds:g} detik). "
+                         "Persempit rentang tahun/filter atau coba lagi.",
+                "timeoutSeconds": seconds,
+            },
+            # Middleware ini di luar CORSMiddleware → header CORS ditambahkan sendiri
+            headers={"Cache-Control": "no-store", "Access-Control-Allow-Origin": "*"},
+        )
+        await timeout_response(scope, inbox.get, send)
+
+
+app.add_middleware(RequestGuardMiddleware)
+
+
+# =====================================================
+# ✅ Warm-up Cache & Readiness
+# =====================================================
+warmup_state = {
+    "status": "pending",   # pending → running → done
+    "done": 0,
+    "total": 0,
+    "failed": [],
+    "startedAt": None,
+    "finishedAt": None,
+    "seconds": None,
+    "rerun": False,
+}
+
+
+def warmup_paths():
+    """Respons dashboard yang paling sering diminta, untuk 'all' dan setiap tahun."""
+    year_params = ["all"] + [str(y) for y in all_years()]
+    per_years = [
+        "/api/dashboard-metrics", "/api/monthly-demand", "/api/monthly-expenditure",
+        "/api/category-and-top-items", "/api/top-requesters", "/api/top-spending-units",
+        "/api/unit-scatter-data", "/api/category-demand-proportion",
+        "/api/category-value", "/api/category-unit",
+    ]
+    per_year = [
+        "/api/dashboard-metrics/{y}", "/api/monthly-outcome/{y}", "/api/category-value/{y}",
+        "/api/category-unit/{y}", "/api/all-items/{y}", "/api/unit-pemohon-list/{y}",
+    ]
+    paths = ["/api/data", "/api/data-per-tahun", "/api/item-forecast", "/api/anomalies",
+             "/api/dashboard-compare?years=all"]
+    paths += [f"{p}?years={y}" for y in year_params for p in per_years]
+    paths += [p.format(y=y) for y in all_years() for p in per_year]
+    return paths
+
+
+async def run_warmup():
+    """
+    Panggil endpoint umum lewat ASGI (tanpa jaringan) supaya response_cache terisi.
+    Berjalan berurutan; di antara request event loop tetap melayani trafik lain.
+    """
+    import httpx  # hanya dibutuhkan untuk warm-up & chatbot → tidak ikut dimuat saat import
+
+    # Context task warm-up: request ASGI-nya dikenali RequestGuardMiddleware sebagai internal
+    internal_request.set(True)
+    try:
+        while True:
+            warmup_state["rerun"] = False
+            paths = warmup_paths()
+            warmup_state.update(status="running", done=0, total=len(paths), failed=[],
+                                startedAt=time.time(), finishedAt=None, seconds=None)
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://warmup") as client:
+                for path in paths:
+                    try:
+                        res = await client.get(path)
+                        if res.status_code != 200:
+                            warmup_state["failed"].append(path)
+                    except asyncio.CancelledError:
+                        raise
+                    except BaseException as e:
+                        print(f"[ERROR] Warm-up {path}: {e}")
+                        warmup_state["failed"].append(path)
+                    warmup_state["done"] += 1
+
+            finished = time.time()
+            warmup_state.update(status="done", finishedAt=finished,
+                                seconds=round(finished - warmup_state["startedAt"], 2))
+            print(f"[INFO] Warm-up selesai: {len(paths)} respons dalam {warmup_state['seconds']} detik")
+            # Data default berubah selama warm-up → ulangi untuk versi terbaru
+            if not warmup_state["rerun"]:
+                break
+    except asyncio.CancelledError:
+        raise
+    except BaseException:
+        warmup_state.update(status="failed", finishedAt=time.time())
+        raise
+
+
+def request_warmup():
+    """Warm-up ulang (mis. setelah reload); jika sedang berjalan, diulang setelah selesai."""
+    if warmup_state["status"] == "running":
+        warmup_state["rerun"] = True
+    elif warmup_state["status"] in ("done", "failed"):
+        spawn(run_warmup())
+    # "pending": warm-up startup belum mulai dan akan memakai versi terbaru
+
+
+NO_CACHE_PATHS.add("/api/ready")
+
+
+@app.get("/api/ready")
+async def readiness():
+    """
+    Readiness untuk healthcheck/proxy: 200 hanya jika data sudah dimuat dan startup (termasuk
+    warm-up pertama) selesai, selain itu 503 beserta progresnya. Warm-up ulang setelah reload
+    tidak membuat server keluar dari rotasi.
+    """
+    # Tidak memakai current(): readiness tidak boleh menunggu data selesai dimuat
+    dataset = loaded_datasets.get(DEFAULT_DATASET)
+    ready = dataset is not None and startup_state["status"] == "done"
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "dataset": DEFAULT_DATASET,
+            "datasetVersion": dataset.version if dataset is not None else None,
+            "dataLoaded": dataset is not None,
+            "rows": int(len(dataset.df)) if dataset is not None else 0,
+            "startup": startup_state,
+            "warmup": warmup_state,
+            "responseCacheEntries": len(response_cache),
+            "requests": request_stats,
+            "llm": llm_stats,
+        },
+        headers={"Cache-Control": "no-store"},
+    )
+
+
+# =====================================================
+# ✅ Lifecycle: Bind Dulu, Data Dimuat di Background
+# =====================================================
+from contextlib import asynccontextmanager
+
+startup_state = {"status": "pending", "error": None, "timings": startup_timings}
+
+
+async def run_startup():
+    """
+    Urutan startup setelah server menerima koneksi: muat dataset default (thread),
+    lalu deteksi anomali & warm-up cache berjalan bersamaan. Durasi tiap fase dicatat.
+    """
+    started = time.perf_counter()
+    startup_state["status"] = "loading"
+    try:
+        dataset = await asyncio.to_thread(timed, startup_timings, "data", get_dataset, DEFAULT_DATASET)
+        startup_timings.update({f"data.{k}": v for k, v in dataset.load_phases.items()})
+
+        async def phase(name, coro):
+            phase_started = time.perf_counter()
+            await coro
+            startup_timings[name] = round(time.perf_counter() - phase_started, 3)
+
+        startup_state["status"] = "warming"
+        await asyncio.gather(phase("anomalies", run_anomaly_job()), phase("warmup", run_warmup()))
+        startup_timings["total"] = round(time.perf_counter() - started, 3)
+        startup_state["status"] = "done"
+        print(f"[INFO] Startup selesai: {startup_timings}")
+    except asyncio.CancelledError:
+        raise
+    except BaseException as e:  # termasuk RequestAborted/BaseExceptionGroup → status tidak macet di "warming"
+        startup_state.update(status="failed", error=str(e))
+        print(f"[ERROR] Startup: {e}")
+        import traceback
+        traceback.print_exc()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    open_llm()
+    task = asyncio.create_task(run_startup())
+    yield
+    task.cancel()
+    await close_llm()
+
+
+app.router.lifespan_context = lifespan
+startup_timings["import"] = round(time.perf_counter() - _import_started, 3)
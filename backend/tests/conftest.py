@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# Path data absolut supaya pytest bisa dijalankan dari direktori mana pun
+os.environ.setdefault("DATA_DIR", os.path.join(BACKEND_DIR, "data"))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    """TestClient tanpa lifespan: dataset dimuat saat request pertama, tanpa warm-up/LLM."""
+    from fastapi.testclient import TestClient
+
+    main.response_cache.clear()
+    with_client = TestClient(main.app)
+    yield with_client
+    main.response_cache.clear()
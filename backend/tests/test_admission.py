@@ -0,0 +1,36 @@
+import main
+
+
+def saturate(monkeypatch, spec, service_seconds):
+    """Ganti kelas interactive dengan kelas kecil yang slotnya sudah penuh."""
+    admission = main.AdmissionClass("interactive", spec)
+    admission.active = admission.limit
+    admission.service_seconds = service_seconds
+    monkeypatch.setitem(main.admission_classes, "interactive", admission)
+    return admission
+
+
+def test_kelebihan_beban_503_dengan_retry_after(client, monkeypatch):
+    admission = saturate(monkeypatch, "1:0", service_seconds=2.5)
+    response = client.get("/api/dashboard-metrics", params={"years": "2024"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert response.headers["Cache-Control"] == "no-store"
+    assert response.json()["class"] == "interactive"
+    assert admission.stats["rejected"] == 1
+
+    # Kelas lain tidak ikut tertahan
+    assert client.get("/api/admin/admission").status_code == 200
+    # Healthcheck dikecualikan dari admission (503 di sini = belum siap, bukan antrean penuh)
+    assert "Retry-After" not in client.get("/api/ready").headers
+    assert admission.stats["rejected"] == 1
+
+
+def test_antrean_habis_waktu_503(client, monkeypatch):
+    admission = saturate(monkeypatch, "1:4", service_seconds=None)
+    monkeypatch.setattr(main, "ADMISSION_MAX_WAIT_SECONDS", 0.05)
+    response = client.get("/api/dashboard-metrics", params={"years": "2024"})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert admission.stats["queueTimeouts"] == 1
+    assert not admission.waiters
@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+import main
+
+
+def test_build_anomali_single_flight(monkeypatch):
+    dataset = main.get_dataset(main.DEFAULT_DATASET)
+    monkeypatch.setattr(dataset, "derived_cache", main.SizedCache(lambda entry: 0))
+    builds = []
+
+    def build_lambat():
+        builds.append(main.current().name)
+        time.sleep(0.2)
+        return {"stats": None, "flags": None}
+
+    monkeypatch.setattr(main, "build_anomalies", build_lambat)
+
+    async def skenario():
+        job = asyncio.create_task(main.run_anomaly_job(dataset))
+        await asyncio.sleep(0.05)  # job sudah berjalan di thread
+        results = await asyncio.gather(*(main.anomalies_for(dataset) for _ in range(3)))
+        await job
+        return results
+
+    results = asyncio.run(skenario())
+    assert builds == [dataset.name]
+    assert all(result is results[0] for result in results)
+    assert not main.anomaly_inflight
+
+
+def test_limit_anomali_divalidasi(client):
+    assert client.get("/api/anomalies", params={"limit": 0}).status_code == 422
+    assert client.get("/api/anomalies", params={"limit": main.ANOMALY_MAX_LIMIT + 1}).status_code == 422
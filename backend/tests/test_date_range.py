@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+import main
+
+
+def period(date_from=None, date_to=None):
+    return main.parse_date_range(date_from, date_to)
+
+
+def fake_dataset(monkeypatch):
+    frame = pd.DataFrame({
+        "Tahun": [2024, 2024, 2024, 2025],
+        "Tanggal": pd.to_datetime(["2024-02-01", "2024-08-01", None, "2025-03-01"]),
+        "Jumlah": [1, 10, 100, 1000],
+        "TotalHarga": [1.0, 10.0, 100.0, 1000.0],
+    })
+    dataset = SimpleNamespace(time_index=main.build_time_index(frame))
+    monkeypatch.setattr(main, "current", lambda: dataset)
+
+
+def test_baris_tanpa_tanggal_dikecualikan_bila_ada_batas(monkeypatch):
+    fake_dataset(monkeypatch)
+    assert main.range_sums([2024])[0] == 111
+    assert main.range_sums([2024], period("2024-01"))[0] == 11
+    assert main.range_sums([2024], period(None, "2024-12"))[0] == 11
+    assert main.range_sums([2024], period("2024-06", "2024-12"))[0] == 10
+
+
+def test_tahun_diturunkan_dari_rentang(monkeypatch):
+    fake_dataset(monkeypatch)
+    monkeypatch.setattr(main, "all_years", lambda: [2023, 2024, 2025])
+    assert main.parse_years_param(None) == [2025]
+    assert main.parse_years_param(None, period("2024-06", "2025-01")) == [2024, 2025]
+    assert main.parse_years_param(None, period("2024-03")) == [2024, 2025]
+    assert main.parse_years_param(None, period(None, "2023")) == [2023]
+    # `years` eksplisit tetap dihormati
+    assert main.parse_years_param("2025", period("2024-06", "2025-01")) == [2025]
+
+
+def test_dashboard_dengan_rentang_tanpa_years(client):
+    body = client.get("/api/dashboard-metrics", params={"from": "2024-01", "to": "2024-03"}).json()
+    expected = client.get("/api/dashboard-metrics", params={"years": "2024", "from": "2024-01", "to": "2024-03"}).json()
+    assert body == expected
+
+
+def test_radar_dengan_rentang_membangun_profil_sekali(client, monkeypatch):
+    calls = []
+    build = main.build_unit_profile
+    monkeypatch.setattr(main, "build_unit_profile", lambda *args: calls.append(args) or build(*args))
+    df = main.current().df
+    name = df.loc[(df["Tanggal"] >= "2024-01-01") & (df["Tanggal"] < "2024-07-01"), "UnitPemohon"].iloc[0]
+    body = client.get("/api/data-radar", params={"unit": name, "from": "2024-01", "to": "2024-06"}).json()
+    assert body["scores"]
+    assert len(calls) == 1
@@ -0,0 +1,32 @@
+import numpy as np
+
+import main
+
+
+def test_lonjakan_sekali_tidak_diulang_tahun_berikutnya():
+    # 33 bulan (Jan 2023 - Sep 2025), satu lonjakan di Oktober 2023, nol di bulan lain
+    y = np.zeros((33, 1))
+    y[9, 0] = 4900
+    forecast, _ = main.ets_forecast(y)
+    assert np.all(forecast == 0)
+
+
+def test_pola_musiman_berulang_tetap_diperkirakan():
+    # Lonjakan setiap Oktober → Oktober berikutnya tetap diperkirakan tinggi
+    y = np.full((33, 1), 10.0)
+    y[[9, 21], 0] = 500
+    forecast, _ = main.ets_forecast(y)
+    october = forecast[(9 - 33) % 12, 0]
+    assert october > 100
+    assert forecast.max() == october
+
+
+def test_limit_tidak_valid_ditolak(client):
+    for limit in ["0", "-1"]:
+        assert client.get("/api/item-forecast", params={"limit": limit}).status_code == 400
+
+
+def test_barang_registry_tanpa_transaksi_tidak_ikut(client):
+    items = client.get("/api/item-forecast", params={"limit": 2000}).json()["items"]
+    assert items
+    assert all(isinstance(item["NamaBrg"], str) for item in items)
@@ -0,0 +1,60 @@
+import io
+import warnings
+
+import pandas as pd
+import pytest
+
+import main
+
+
+@pytest.fixture
+def temp_dataset(tmp_path, monkeypatch):
+    """Dataset sementara (50 baris pertama Data_SPC) supaya impor tidak mengubah data asli."""
+    path = tmp_path / "impor.csv"
+    source = pd.read_csv(main.DATASET_FILES[main.DEFAULT_DATASET], dtype=str, keep_default_na=False, nrows=50)
+    source.to_csv(path, index=False)
+    monkeypatch.setitem(main.DATASET_FILES, "impor", str(path))
+    monkeypatch.setattr(main, "ID_REGISTRY_DIR", str(tmp_path))
+    yield source
+    main.loaded_datasets.pop("impor", None)
+
+
+def upload_rows(source):
+    headers = [header for header, _, _, _ in main.TRANSACTION_COLUMNS]
+    existing = source.iloc[0][headers].to_dict()
+    new = {**existing, "Kode Transaksi": "99/k/uji/2023", "Jml": "3", "Total": str(3 * float(existing["Harga"]))}
+    negative = {**new, "Kode Transaksi": "98/k/uji/2023", "Jml": "-1", "Total": str(-float(existing["Harga"]))}
+    blank = {header: "" for header in headers}
+    return pd.DataFrame([existing, new, new, negative, blank], columns=headers)
+
+
+def test_impor_menolak_duplikat_dan_melaporkan_alasan(client, temp_dataset):
+    content = upload_rows(temp_dataset).to_csv(index=False).encode()
+    response = client.post("/api/import-data", params={"dataset": "impor"},
+                           files={"file": ("impor.csv", content, "text/csv")})
+    assert response.status_code == 200
+    report = response.json()
+    assert report["received"] == 4 and report["skippedBlank"] == 1
+    assert report["imported"] == 1
+    assert report["duplicates"] == 2
+    assert report["rejected"] == 3
+    reasons = {reject["row"]: reject["reasons"] for reject in report["rejects"]}
+    assert reasons == {2: ["Duplikat data yang sudah ada"], 4: ["Duplikat di dalam file"], 5: ["Jml negatif", "Total negatif"]}
+
+    # Impor ulang file yang sama: baris yang tadi diterima sekarang duplikat
+    again = client.post("/api/import-data", params={"dataset": "impor"},
+                        files={"file": ("impor.csv", content, "text/csv")}).json()
+    assert again["imported"] == 0
+
+
+def test_impor_xlsx_tanpa_future_warning(temp_dataset):
+    buffer = io.BytesIO()
+    frame = upload_rows(temp_dataset)
+    frame["Jml"] = pd.to_numeric(frame["Jml"])  # sel angka & sel kosong seperti file Excel asli
+    frame.to_excel(buffer, index=False)
+    raw = main.read_upload("impor.xlsx", buffer.getvalue())
+    dataset = main.get_dataset("impor")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", FutureWarning)
+        report = main.validate_ingest(raw, dataset)
+    assert len(report["accepted"]) == 1
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    """Semaphore baru + upstream palsu; bucket 1 token, isi ulang 1 token/detik."""
+    calls = []
+
+    async def upstream_palsu(question, context):
+        calls.append(question)
+        return "ok"
+
+    monkeypatch.setattr(main, "llm_upstream", upstream_palsu)
+    monkeypatch.setattr(main, "llm_bucket", main.TokenBucket(1.0, 1))
+    monkeypatch.setattr(main, "LLM_MAX_QUEUE", 2)
+    monkeypatch.setitem(main.llm_state, "waiting", 0)
+    return calls
+
+
+def test_rate_nol_berarti_tanpa_batas():
+    bucket = main.TokenBucket(0.0, 5)
+    assert [bucket.reserve(max_wait=0) for _ in range(100)] == [0.0] * 100
+
+
+def test_antrean_menghitung_penunggu_token(limiter):
+    async def skenario():
+        main.llm_state["semaphore"] = asyncio.Semaphore(4)
+        first = await main.guarded_llm_call("a", "")          # token burst, langsung
+        waiting = [asyncio.create_task(main.guarded_llm_call(q, "")) for q in ("b", "c")]
+        await asyncio.sleep(0)
+        assert main.llm_state["waiting"] == 2                  # keduanya tidur menunggu token
+        with pytest.raises(main.LLMBusyError) as busy:
+            await main.guarded_llm_call("d", "")
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+        return first, busy.value.retry_after
+
+    first, retry_after = asyncio.run(skenario())
+    assert first == "ok"
+    assert retry_after >= 1
+    assert limiter == ["a"]
+
+
+def test_token_dikembalikan_saat_pemanggil_batal(limiter):
+    async def skenario():
+        main.llm_state["semaphore"] = asyncio.Semaphore(4)
+        await main.guarded_llm_call("a", "")
+        task = asyncio.create_task(main.guarded_llm_call("b", ""))
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # Token "b" dikembalikan → pemanggil berikutnya cukup menunggu ±1 detik, bukan 2
+        return main.llm_bucket.wait_time()
+
+    assert asyncio.run(skenario()) <= 1.0
+    assert main.llm_state["waiting"] == 0
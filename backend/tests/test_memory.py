@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+import main
+
+MB = 2**20
+
+
+class FakeDataset:
+    """Dataset tiruan: ukuran tetap, cache turunan asli (SizedCache)."""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.version = f"v-{name}"
+        self.size = size
+        self.derived_cache = main.SizedCache(lambda entry: len(entry[1]))
+
+    def nbytes(self):
+        return self.size
+
+
+def setup_registry(monkeypatch, budget_mb):
+    default = FakeDataset(main.DEFAULT_DATASET, 2 * MB)
+    other = FakeDataset("lain", 2 * MB)
+    monkeypatch.setattr(main, "loaded_datasets", OrderedDict([("lain", other), (default.name, default)]))
+    monkeypatch.setattr(main, "response_cache", main.SizedCache(lambda entry: len(entry[0])))
+    monkeypatch.setattr(main, "query_plan_cache", main.SizedCache(len))
+    monkeypatch.setattr(main, "MEMORY_BUDGET_MB", budget_mb)
+    return default, other
+
+
+def test_sized_cache_keeps_running_total():
+    cache = main.SizedCache(len)
+    cache["a"] = b"x" * 10
+    cache["b"] = b"x" * 5
+    cache["a"] = b"x" * 3
+    assert cache.nbytes == 8
+    cache.pop("b")
+    cache.pop("b", None)
+    assert cache.nbytes == 3
+    cache.popitem()
+    assert cache.nbytes == 0 and not cache.sizes
+
+
+def test_eviction_order_responses_then_derived_then_datasets(monkeypatch):
+    default, other = setup_registry(monkeypatch, budget_mb=10)
+    main.response_cache['"v-lain-1"'] = (b"x" * MB, "application/json")
+    default.derived_cache["anomalies"] = (default.version, b"x" * MB)
+    default.derived_cache["summary"] = (default.version, b"x" * MB)
+    other.derived_cache["summary"] = (other.version, b"x" * MB)
+    assert main.enforce_memory_budget() == 0  # 8 MB ≤ 10 MB: jalur cepat
+
+    main.MEMORY_BUDGET_MB = 7.5
+    main.enforce_memory_budget()
+    assert len(main.response_cache) == 0
+    assert "summary" in default.derived_cache and "summary" in other.derived_cache
+
+    main.MEMORY_BUDGET_MB = 5.5
+    main.enforce_memory_budget()
+    assert "summary" not in other.derived_cache and "summary" not in default.derived_cache
+    assert "lain" in main.loaded_datasets
+
+    main.MEMORY_BUDGET_MB = 1
+    main.enforce_memory_budget()
+    assert list(main.loaded_datasets) == [main.DEFAULT_DATASET]  # dataset default dipin
+    assert "anomalies" in default.derived_cache  # hasil anomali dipin
+
+
+def test_dropping_dataset_purges_its_responses(monkeypatch):
+    default, other = setup_registry(monkeypatch, budget_mb=4.5)
+    main.response_cache['"v-lain-1"'] = (b"x", "application/json")
+    main.response_cache['"v-lain-2"'] = (b"x", "application/json")
+    main.enforce_memory_budget(keep=main.DEFAULT_DATASET)
+    assert "lain" in main.loaded_datasets  # cukup membuang respons
+
+    main.response_cache['"v-lain-3"'] = (b"x" * MB, "application/json")
+    main.MEMORY_BUDGET_MB = 3
+    main.enforce_memory_budget()
+    assert "lain" not in main.loaded_datasets
+    assert not main.response_cache
+
+
+def test_derived_lru_trim_keeps_pinned_entry(monkeypatch):
+    default, _ = setup_registry(monkeypatch, budget_mb=1024)
+    monkeypatch.setattr(main, "current", lambda: default)
+    monkeypatch.setattr(main, "DERIVED_CACHE_MAX_ENTRIES", 3)
+    main.cached_per_version("anomalies", lambda: b"a")
+    for name in ["p", "q", "r", "s"]:
+        main.cached_per_version(name, lambda: b"x")
+    assert list(default.derived_cache) == ["anomalies", "r", "s"]
@@ -0,0 +1,65 @@
+import asyncio
+
+import httpx
+
+import main
+
+
+def test_deadline_di_handler_menjadi_504_dan_tidak_di_cache(client, monkeypatch):
+    # check_deadline yang terpicu di dalam handler (di bawah BaseHTTPMiddleware) → 504, bukan 500
+    def deadline_lewat(*args, **kwargs):
+        raise main.RequestAborted("deadline")
+
+    monkeypatch.setattr(main, "select_rows", deadline_lewat)
+    res = client.get("/api/dashboard-metrics?years=2024&from=2024-01")
+    assert res.status_code == 504
+    assert res.json()["timeoutSeconds"] == main.REQUEST_DEADLINE_SECONDS
+    assert res.headers["cache-control"] == "no-store"
+    assert not main.response_cache
+
+    monkeypatch.undo()
+    res = client.get("/api/dashboard-metrics?years=2024&from=2024-01")
+    assert res.status_code == 200
+    assert res.headers["x-cache"] == "MISS"
+
+
+def test_deadline_terlewati_saat_komputasi(client, monkeypatch):
+    monkeypatch.setitem(main.REQUEST_DEADLINES, "/api/dashboard-metrics", 1e-9)
+    res = client.get("/api/dashboard-metrics?years=2024&from=2024-02")
+    assert res.status_code == 504
+    assert not main.response_cache
+
+
+def test_readiness_tidak_terkena_deadline(client, monkeypatch):
+    monkeypatch.setattr(main, "REQUEST_DEADLINE_SECONDS", 1e-9)
+    res = client.get("/api/ready")
+    assert res.status_code in (200, 503)
+    assert "ready" in res.json()
+
+
+def test_request_warmup_tidak_terkena_deadline(monkeypatch):
+    monkeypatch.setattr(main, "REQUEST_DEADLINE_SECONDS", 1e-9)
+
+    async def warmup_get():
+        main.internal_request.set(True)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://warmup") as c:
+            return await c.get("/api/dashboard-metrics?years=2023")
+
+    assert asyncio.run(warmup_get()).status_code == 200
+    main.response_cache.clear()
+
+
+def test_startup_gagal_tidak_macet_di_warming(monkeypatch):
+    async def tanpa_anomali(dataset=None):
+        return None
+
+    async def warmup_batal():
+        raise BaseExceptionGroup("middleware", [RuntimeError("No response returned."),
+                                                main.RequestAborted("deadline")])
+
+    monkeypatch.setattr(main, "run_anomaly_job", tanpa_anomali)
+    monkeypatch.setattr(main, "run_warmup", warmup_batal)
+    monkeypatch.setitem(main.startup_state, "status", "pending")
+    asyncio.run(main.run_startup())
+    assert main.startup_state["status"] == "failed"
@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+import main
+
+
+@pytest.fixture
+def storages(tmp_path):
+    dataset = main.get_dataset(main.DEFAULT_DATASET)
+    token = main.active_dataset.set(dataset)
+    sqlite = main.SQLiteStorage(str(tmp_path / "stark_test.db"), dataset.df, dataset.version)
+    yield main.PandasStorage(), sqlite
+    main.active_dataset.reset(token)
+
+
+def sorted_frame(frame, by):
+    frame = frame.sort_values(by).reset_index(drop=True) if by else frame
+    return frame.round({"Jumlah": 2, "TotalHarga": 2}).astype({"Transaksi": int})
+
+
+@pytest.mark.parametrize("by, years, period, filters", [
+    (["Kategori"], [2024], (None, None), None),                       # rollup_kategori
+    (["Tahun", "Kategori"], [2023, 2024, 2025], (None, None), None),  # rollup + Tahun
+    (["UnitPemohon"], [2025], (None, None), None),                    # rollup_unit
+    (["Kategori"], [2024], main.parse_date_range("2024-03", "2024-08"), None),  # tabel transaksi
+    (["Bulan"], [2023], (None, None), {"Kategori": ["ATK"]}),
+    ([], [2024], main.parse_date_range("2024-02-10", None), None),
+])
+def test_sqlite_sama_dengan_pandas(storages, by, years, period, filters):
+    pandas_storage, sqlite_storage = storages
+    expected = sorted_frame(pandas_storage.aggregate(by, years, period, filters), by)
+    actual = sorted_frame(sqlite_storage.aggregate(by, years, period, filters), by)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, atol=0.01)
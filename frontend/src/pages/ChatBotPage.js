@@ -71,7 +71,8 @@ const ChatBotPage = () => {
         body: JSON.stringify({ question: text }),
       });
 
-      if (!response.ok) {
+      // 429 = server sedang sibuk; body tetap berisi jawaban untuk ditampilkan
+      if (!response.ok && response.status !== 429) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
@@ -1,6 +1,6 @@
 // src/pages/DataManagementPage.js
 import React, { useState } from "react";
-import { fetchAPI } from "../utils/api";
+import { fetchAPI, API_BASE_URL } from "../utils/api";
 
 const DataManagementPage = () => {
   const [uploadStatus, setUploadStatus] = useState("");
@@ -32,7 +32,7 @@ const DataManagementPage = () => {
 
   // Export Semua Data
   const handleExportAllData = () => {
-    window.location.href = "/api/export-data?years=all"; // langsung download
+    window.location.href = `${API_BASE_URL}/api/export-data?years=all`; // langsung download (xlsx di-stream backend)
   };
 
   // Import File
@@ -40,8 +40,8 @@ const DataManagementPage = () => {
     const file = e.target.files[0];
     if (!file) return;
 
-    if (!file.name.endsWith(".xlsx") && !file.name.endsWith(".xls") && !file.name.endsWith(".csv")) {
-      alert("❌ Format file tidak didukung. Harap gunakan .xlsx, .xls, atau .csv");
+    if (!file.name.endsWith(".xlsx") && !file.name.endsWith(".csv")) {
+      alert("❌ Format file tidak didukung. Harap gunakan .xlsx atau .csv");
       return;
     }
 
@@ -60,7 +60,11 @@ const DataManagementPage = () => {
       const result = await res.json();
 
       if (res.ok) {
-        setUploadStatus(`✅ Berhasil! ${result.imported} baris ditambahkan.`);
+        const ditolak = result.rejected
+          ? ` ${result.rejected} baris ditolak (${result.duplicates} duplikat)` +
+            (result.rejects?.length ? `, mis. baris ${result.rejects[0].row}: ${result.rejects[0].reasons.join(", ")}` : "")
+          : "";
+        setUploadStatus(`✅ Berhasil! ${result.imported} baris ditambahkan.${ditolak}`);
       } else {
         setUploadStatus(`❌ Gagal: ${result.error || "Server error"}`);
       }
@@ -136,7 +140,7 @@ const DataManagementPage = () => {
           <input
             id="importFile"
             type="file"
-            accept=".xlsx,.xls,.csv"
+            accept=".xlsx,.csv"
             onChange={handleImportFile}
             style={{ display: "none" }}
             disabled={isUploading}
@@ -158,8 +162,8 @@ const DataManagementPage = () => {
         <p>File harus memiliki kolom berikut (<strong>case-sensitive</strong>):</p>
         <div className="columns-grid">
           {[
-            "Tahun", "UnitPemohon", "NamaBrg", "Kategori",
-            "Jumlah", "HargaSatuan", "TotalHarga", "Segmen"
+            "Tanggal", "Kode Transaksi", "Pemohon", "Unit Pemohon", "Kode Barang", "Nama Brg",
+            "Satuan", "Jml", "Harga", "Total", "Tahun", "Kategori Barang", "Kategori"
           ].map((col, i) => (
             <div key={i} className="column-item">
               <strong>{col}</strong>
@@ -167,7 +171,7 @@ const DataManagementPage = () => {
           ))}
         </div>
         <p className="note">
-          <i className="fas fa-info-circle"></i> Contoh nilai: <code>2025</code>, <code>IT</code>, <code>mouse</code>, <code>ATK</code>, <code>10</code>, <code>50000</code>, <code>500000</code>, <code>Teknologi</code>
+          <i className="fas fa-info-circle"></i> Contoh nilai: <code>03/01/2025</code>, <code>lab. elektronika digital</code>, <code>kertas a4 80 gr.</code>, <code>10</code>, <code>62759.4</code>, <code>ATK</code> — lihat sheet <strong>Petunjuk</strong> di template
         </p>
       </div>
             <style jsx>{`
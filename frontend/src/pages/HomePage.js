@@ -12,7 +12,7 @@ import {
   Legend,
   Filler,
 } from "chart.js";
-import { fetchAPI } from "../utils/api";
+import { fetchAPI, subscribeDatasetEvents } from "../utils/api";
 
 ChartJS.register(
   ArcElement,
@@ -34,6 +34,7 @@ const HomePage = () => {
   const [error, setError] = useState(null);
   const [selectedYears, setSelectedYears] = useState([2023, 2024, 2025]); // default semua tahun
   const [isLoading, setIsLoading] = useState(true);
+  const [dataVersion, setDataVersion] = useState(null); // versi dataset dari event SSE
   const ALL_YEARS = [2023, 2024, 2025];
 
   // Helper: format Rupiah
@@ -222,6 +223,13 @@ const HomePage = () => {
     };
 
     loadData();
+  }, [selectedYears, dataVersion]);
+
+  // Data berubah di server (reload/import) → muat ulang dashboard tanpa polling
+  useEffect(() => {
+    return subscribeDatasetEvents(selectedYears.join(","), (event) => {
+      if (event.reason !== "subscribe") setDataVersion(event.version);
+    });
   }, [selectedYears]);
 
   // === Chart Configs ===
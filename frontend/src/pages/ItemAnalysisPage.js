@@ -96,51 +96,20 @@ const ItemAnalysisPage = () => {
       try {
         setLoading(true);
 
-        if (selectedYearsForCharts.length === 1) {
-          const year = selectedYearsForCharts[0];
-          const [valueRes, unitRes] = await Promise.all([
-            fetchAPI(`/api/category-value/${year}`),
-            fetchAPI(`/api/category-unit/${year}`),
-          ]);
+        // Satu request per grafik untuk semua tahun terpilih (top 6 gabungan dihitung di backend)
+        const yearsParam = selectedYearsForCharts.join(",");
+        const [valueRes, unitRes] = await Promise.all([
+          fetchAPI(`/api/category-value?years=${yearsParam}`),
+          fetchAPI(`/api/category-unit?years=${yearsParam}`),
+        ]);
 
-          if (!valueRes.ok || !unitRes.ok) throw new Error("Gagal mengambil data kategori");
+        if (!valueRes.ok || !unitRes.ok) throw new Error("Gagal mengambil data kategori");
 
-          const valueData = await valueRes.json();
-          const unitData = await unitRes.json();
+        const valueData = await valueRes.json();
+        const unitData = await unitRes.json();
 
-          setCategoryValueData({ labels: valueData.labels || [], data: valueData.data || [] });
-          setCategoryUnitData({ labels: unitData.labels || [], data: unitData.data || [] });
-        } else {
-          const fetchPromises = selectedYearsForCharts.map((year) =>
-            Promise.all([
-              fetchAPI(`/api/category-value/${year}`).then((r) => (r.ok ? r.json() : { labels: [], data: [] })),
-              fetchAPI(`/api/category-unit/${year}`).then((r) => (r.ok ? r.json() : { labels: [], data: [] })),
-            ])
-          );
-
-          const allResponses = await Promise.all(fetchPromises);
-          const valueResponses = allResponses.map((res) => res[0]);
-          const unitResponses = allResponses.map((res) => res[1]);
-
-          const aggregateData = (dataList) => {
-            const result = {};
-            dataList.forEach((data) => {
-              if (!data || !Array.isArray(data.labels)) return;
-              data.labels.forEach((label, i) => {
-                if (!result[label]) result[label] = 0;
-                result[label] += data.data[i] || 0;
-              });
-            });
-            const sorted = Object.entries(result).sort((a, b) => b[1] - a[1]).slice(0, 6);
-            return {
-              labels: sorted.map(([label]) => label),
-              data: sorted.map(([, value]) => value),
-            };
-          };
-
-          setCategoryValueData(aggregateData(valueResponses));
-          setCategoryUnitData(aggregateData(unitResponses));
-        }
+        setCategoryValueData({ labels: valueData.labels || [], data: valueData.data || [] });
+        setCategoryUnitData({ labels: unitData.labels || [], data: unitData.data || [] });
       } catch (err) {
         console.error("Error fetching chart data:", err);
       } finally {
@@ -208,18 +177,14 @@ const ItemAnalysisPage = () => {
     }
   };
 
-  // ✅ Perbaiki handleShowDetail: ganti '/' → '-'
-  const handleShowDetail = async (namaBarang) => {
+  // ✅ Detail barang lewat ItemID (tidak perlu lagi mengganti '/' → '-')
+  const handleShowDetail = async (item) => {
+    const namaBarang = item.NamaBrg;
     try {
-      // 🔑 Ganti '/' dengan '-' agar aman di URL path
-      const safeNamaBarang = namaBarang.replace(/\//g, "-");
-      const encodedNamaBarang = encodeURIComponent(safeNamaBarang);
-
-      const res = await fetchAPI(`/api/item-detail/${selectedYearForTable}/${encodedNamaBarang}`);
+      const res = await fetchAPI(`/api/item-detail-by-id/${selectedYearForTable}/${item.ItemID}`);
       if (!res.ok) throw new Error("Gagal ambil detail item");
 
       const data = await res.json();
-      const item = allItemsForTable.find((i) => i.NamaBrg === namaBarang);
       const hargaSatuan = item?.HargaSatuan || 0;
 
       const unitsWithCost = data.units?.map((unit) => ({
@@ -598,7 +563,7 @@ const shortenText = (text, maxLength = 20) => {
               {paginatedItems.length > 0 ? (
                 paginatedItems.map((item, index) => (
                   <tr
-                    key={item.NamaBrg || index}
+                    key={item.ItemID ?? index}
                     style={{
                       borderBottom: "1px solid #eee",
                       transition: "background-color 0.2s",
@@ -633,7 +598,7 @@ const shortenText = (text, maxLength = 20) => {
                       textAlign: "center",
                     }}>
                       <button
-                        onClick={() => handleShowDetail(item.NamaBrg)}
+                        onClick={() => handleShowDetail(item)}
                         style={{
                           padding: "6px 12px",
                           backgroundColor: "#3b82f6",
@@ -1,5 +1,5 @@
 // src/utils/api.js
-const API_BASE_URL = process.env.REACT_APP_API_URL || "http://localhost:8000";
+export const API_BASE_URL = process.env.REACT_APP_API_URL || "http://localhost:8000";
 
 export const fetchAPI = async (endpoint, options = {}) => {
   // Handle absolute URLs
@@ -37,4 +37,12 @@ export const fetchAPI = async (endpoint, options = {}) => {
     console.error(`[API ERROR] ${url}`, error);
     throw error;
   }
-};
\ No newline at end of file
+};
+// Langganan SSE perubahan dataset; mengembalikan fungsi untuk menutup koneksi
+export const subscribeDatasetEvents = (years, onEvent) => {
+  const source = new EventSource(
+    `${API_BASE_URL}/api/events?years=${encodeURIComponent(years)}`
+  );
+  source.addEventListener("dataset-version", (e) => onEvent(JSON.parse(e.data)));
+  return () => source.close();
+};